@@ -1,318 +1,1076 @@
 import os
-import json
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, g, has_request_context, stream_with_context
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import datetime
+import functools
+import hashlib
+import hmac
+import json
 import logging
-import openai
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, Callable, Iterator, List, Tuple
+
+from auth import AuthError, token_subscription_tier, verify_access_token
+from brownout import Degradation, build_brownout_from_env
+from compatibility import MODES as COMPATIBILITY_MODES, read_pairs, score_stream
+from delusional import build_delusional_scores_from_env, read_rows
+from content import ContentPack, content_store_from_env
+from context_selection import ContextSelector
+from jobs import JobQueue, QueueFullError
+from materialized import MaterializedAnswers
+from memory_profile import KEY_TYPES as MEMORY_KEY_TYPES, build_memory_profiler_from_env
+from logging_setup import configure_logging
+from llm_router import TIER_FAST, TIER_STANDARD, build_router_from_env
+from prompts import PromptBuilder
+from realtime import ChannelHub, register_chat_socket
+from retry import Deadline
+from scheduler import CapacityUnavailable, build_scheduler_from_env
+from score_analytics import assessment_type, build_score_analytics_from_env
+from sessions import SessionStore
+from token_ledger import QuotaExceeded, build_token_ledger_from_env
+from tracing import configure_tracing, tracer
+from traffic_capture import build_traffic_capture_from_env
+from summarizer import RollingSummarizer, estimate_tokens, format_turns, history_tokens, make_summarize, recent_turns
+from validation import MAX_BODY_BYTES, ChatRequest, ValidationError, check_content_length, decode_chat_request
+from warmup import Warmup
 
 # Azure deployment trigger - hybrid AI system implementation
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (AI_LOG_MODE=json_async moves formatting and output off the request thread)
+log_pipeline = configure_logging()
+configure_tracing()
 logger = logging.getLogger(__name__)
 
 # ─── BOOK CONTENT ─────────────────────────────────────────────────────────────
-BOOK_CHAPTERS = {
-    "communication": {
-        "chapter_title": "Chapter 2: Communication and Emotional Awareness",
-        "chapter_excerpt": """
-Effective communication is the cornerstone of any healthy relationship. This chapter explores how to build better communication habits through empathy, active listening, and emotional awareness.
-
-Key Principles:
-• Practice active listening without interrupting
-• Use "I feel" statements instead of "You always" accusations
-• Validate your partner's emotions before offering solutions
-• Take breaks during heated discussions to prevent escalation
-• Express appreciation and gratitude regularly
-
-Remember: Communication is not just about talking—it's about creating understanding and connection.
-        """.strip(),
-        "recommendation_reason": "Your communication score indicates room for improvement in how you express and receive messages in relationships."
-    },
-    "trust": {
-        "chapter_title": "Chapter 3: Building Trust in Relationships",
-        "chapter_excerpt": """
-Trust is foundational in any relationship. This chapter outlines frameworks for rebuilding and strengthening trust after conflict or betrayal.
-
-Key Principles:
-• Be consistent in your words and actions
-• Follow through on promises, no matter how small
-• Be transparent about your feelings and intentions
-• Give your partner the benefit of the doubt
-• Rebuild trust through small, consistent actions over time
-
-Remember: Trust is earned through consistent behavior, not grand gestures.
-        """.strip(),
-        "recommendation_reason": "Your trust score suggests you may need to work on building or maintaining trust in your relationships."
-    },
-    "affection": {
-        "chapter_title": "Chapter 1: Consistent Effort and Affection",
-        "chapter_excerpt": """
-Affection is not just about grand gestures but about consistent effort in daily interactions. This chapter focuses on showing love through small, meaningful actions.
-
-Key Principles:
-• Express affection through physical touch (hugs, hand-holding)
-• Use words of affirmation and appreciation daily
-• Create small moments of connection throughout the day
-• Remember important dates and preferences
-• Show interest in your partner's life and experiences
-
-Remember: Small, consistent acts of affection build stronger bonds than occasional grand gestures.
-        """.strip(),
-        "recommendation_reason": "Your affection score indicates you could benefit from more consistent expressions of love and care."
-    },
-    "empathy": {
-        "chapter_title": "Chapter 4: Developing Emotional Intelligence",
-        "chapter_excerpt": """
-Emotional intelligence is crucial for understanding and responding to your partner's needs. This chapter teaches you how to develop deeper empathy and emotional awareness.
-
-Key Principles:
-• Practice perspective-taking in conflicts
-• Recognize and validate your partner's emotions
-• Respond to emotions before trying to solve problems
-• Develop self-awareness about your own emotional triggers
-• Learn to read non-verbal cues and body language
-
-Remember: Empathy is a skill that can be developed with practice and intention.
-        """.strip(),
-        "recommendation_reason": "Your empathy score suggests you could enhance your ability to understand and connect with your partner's emotions."
-    },
-    "shared_goals": {
-        "chapter_title": "Chapter 5: Aligning Visions and Goals",
-        "chapter_excerpt": """
-Shared goals create a strong foundation for long-term relationship success. This chapter helps you identify, communicate, and work toward common objectives.
-
-Key Principles:
-• Have regular conversations about your future together
-• Identify both individual and shared goals
-• Create actionable steps toward your shared vision
-• Celebrate progress and milestones together
-• Be flexible and willing to adjust goals as you grow
-
-Remember: Shared goals give your relationship direction and purpose.
-        """.strip(),
-        "recommendation_reason": "Your shared goals score indicates you may need to better align your vision and objectives with your partner."
-    }
-}
+# Chapters live in a versioned content pack (content/book_chapters.json) that is reloaded when the file changes
+content_store = content_store_from_env()
+
+prompt_builder = PromptBuilder()
+llm_router = build_router_from_env()
+
+# Model calls are admitted by subscription tier; when capacity is short, lower tiers get the book fallback first
+scheduler = build_scheduler_from_env()
+
+# Token usage per call, and token-per-minute quotas per account and for the service
+token_ledger = build_token_ledger_from_env()
+MAX_COMPLETION_TOKENS = 500
+
+# While /api/chat p95 latency is over its SLO, answers get cheaper step by step down to book fallback only
+brownout = build_brownout_from_env(MAX_COMPLETION_TOKENS)
+
+# Overall time budget for a chat request, including every retry of the model call
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("AI_REQUEST_DEADLINE_SECONDS", "30"))
+
+# Token budget for verbatim recent turns; older turns are carried by the rolling summary
+HISTORY_RECENT_TOKENS = int(os.environ.get("AI_HISTORY_RECENT_TOKENS", "800"))
+
+# Book context is chosen principle by principle within a token budget (AI_CONTEXT_MODE=chapters sends whole chapters)
+CONTEXT_MODE = os.environ.get("AI_CONTEXT_MODE", "principles").lower()
+context_selector = ContextSelector(token_budget=int(os.environ.get("AI_CONTEXT_TOKEN_BUDGET", "200")))
 
 # ─── HYBRID AI AND RULE-BASED LOGIC ──────────────────────────────────────────
-def get_ai_response(user_input: str, user_context: Dict[str, Any], chat_history: list) -> Optional[str]:
+def get_ai_response(user_input: str, user_context: Dict[str, Any], chat_history: list, summary: str = "",
+                    deadline: Optional[Deadline] = None, content: Optional[ContentPack] = None,
+                    subscription_tier: Optional[str] = None, account: Optional[str] = None,
+                    degradation: Optional[Degradation] = None,
+                    route: Optional[Dict[str, str]] = None) -> Optional[str]:
     """Attempt to get AI response from OpenAI"""
     try:
-        # Check if OpenAI API key is available
-        if not os.environ.get("OPENAI_API_KEY"):
+        # Check if any model endpoint is configured
+        if not llm_router.enabled:
             logger.warning("⚠️ OpenAI API key not available, using fallback")
             return None
+        with scheduler.slot(subscription_tier, deadline):
+            return generate_ai_response(user_input, user_context, chat_history, summary, deadline, content, account,
+                                        degradation=degradation, route=route)
         
+    except (CapacityUnavailable, QuotaExceeded) as e:
+        logger.warning(f"⚠️ {str(e)}, using fallback")
+        return None
+    except Exception as e:
+        logger.error(f"❌ AI response failed: {str(e)}")
+        return None
+
+def build_ai_messages(user_input: str, user_context: Dict[str, Any], chat_history: list, summary: str = "",
+                      content: Optional[ContentPack] = None,
+                      degradation: Optional[Degradation] = None) -> Tuple[List[Dict[str, str]], str]:
+    """Retrieve book context and build the prompt; returns (messages, model tier)"""
+    degradation = degradation or brownout.current()
+    if degradation.drop_context:
+        # Brownout: only the question and the user's profile and scores
+        relevant_chunks, chat_history, summary = [], [], ""
+    else:
         # Get relevant book context for the user's question
-        relevant_chunks = get_relevant_context(user_input, list(BOOK_CHAPTERS.values()))
-        book_context = "\n\n".join([chunk["chapter_excerpt"] for chunk in relevant_chunks]) if relevant_chunks else "No specific book context found."
-        
-        # Build comprehensive prompt
-        prompt = f"""
-You are an AI Relationship Mentor based on "The Cog Effect" book knowledge. 
+        with tracer.span("context_retrieval") as span:
+            if CONTEXT_MODE == "principles":
+                pack = content or content_store.current
+                relevant_chunks, selection = context_selector.select(user_input, pack.index, pack.principles)
+                span.set(chunks=len(relevant_chunks), **selection)
+            else:
+                relevant_chunks = get_relevant_context(user_input, content=content)
+                span.set(chunks=len(relevant_chunks))
+    
+    # Static persona and book context lead the prompt so providers can cache the prefix
+    with tracer.span("prompt_build") as span:
+        recent_history = format_turns(recent_turns(chat_history, HISTORY_RECENT_TOKENS))
+        messages, prompt_stats = prompt_builder.build(user_input, user_context, relevant_chunks, summary, recent_history)
+        span.set(prompt_tokens=prompt_stats['total_tokens'],
+                 stable_prefix_ratio=prompt_stats['stable_prefix_ratio'])
+    logger.info("Prompt built: %d tokens, %.0f%% stable prefix",
+                prompt_stats['total_tokens'], prompt_stats['stable_prefix_ratio'] * 100)
 
-User Context:
-- Name: {user_context.get('profile', {}).get('name', 'User')}
-- Gender: {user_context.get('profile', {}).get('gender', 'Not specified')}
-- Region: {user_context.get('profile', {}).get('region', 'Not specified')}
-- Cultural Context: {user_context.get('profile', {}).get('cultural_context', 'global')}
+    # Simple questions may use a cheaper model, and under brownout every question does
+    tier = TIER_FAST if degradation.fast_model or llm_router.is_simple(user_input, chat_history) else TIER_STANDARD
+    return messages, tier
 
-Assessment Data:
-- Assessment Scores: {json.dumps(user_context.get('assessment_scores', {}))}
-- Delusional Score: {user_context.get('delusional_score', 'Not available')}
-- Compatibility Score: {user_context.get('compatibility_score', 'Not available')}%
+def generate_ai_response(user_input: str, user_context: Dict[str, Any], chat_history: list, summary: str = "",
+                         deadline: Optional[Deadline] = None, content: Optional[ContentPack] = None,
+                         account: Optional[str] = None, source: str = "chat",
+                         degradation: Optional[Degradation] = None,
+                         route: Optional[Dict[str, str]] = None) -> str:
+    """Generate an AI response, raising when no model call succeeds (batch callers handle the error).
 
-Book Knowledge Context:
-{book_context}
+    The endpoint that answered is recorded in `route` when a dict is given.
+    """
+    degradation = degradation or brownout.current()
+    messages, tier = build_ai_messages(user_input, user_context, chat_history, summary, content, degradation)
+    # Reserve the most this call can use; the ledger settles the difference from the reported usage
+    reservation = token_ledger.reserve(account, history_tokens(messages) + degradation.max_tokens, source)
 
-Chat History: {len(chat_history)} previous messages
+    # Make API call on the fastest healthy endpoint
+    attempts = []
+    backend, usage, ai_response, error = None, None, None, None
+    try:
+        with tracer.span("llm_call", tier=tier, brownout_level=degradation.level) as span:
+            try:
+                response, backend = llm_router.complete(
+                    messages,
+                    tier=tier,
+                    deadline=deadline,
+                    attempts=attempts,
+                    temperature=0.7,
+                    max_tokens=degradation.max_tokens,
+                    timeout=30
+                )
+            finally:
+                span.set(attempts=len(attempts))
+                logger.info("LLM attempts: %s", attempts)
+            usage = getattr(response, "usage", None)
+            span.set(backend=backend.name, model=backend.model, response_id=getattr(response, "id", None),
+                     upstream_request_id=getattr(response, "_request_id", None),
+                     prompt_tokens=getattr(usage, "prompt_tokens", None),
+                     completion_tokens=getattr(usage, "completion_tokens", None))
+        logger.info("LLM response from endpoint %s (%s)", backend.name, backend.model)
+        if route is not None:
+            route.update(backend=backend.name, model=backend.model)
+        prompt_builder.record_usage(usage)
+        capture_note(prompt_tokens=getattr(usage, "prompt_tokens", None),
+                     completion_tokens=getattr(usage, "completion_tokens", None))
+        ai_response = response.choices[0].message.content
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        # Settled on every path, so a malformed response still pays for what the provider reports
+        model = backend.model if backend is not None else ""
+        if usage is not None:
+            token_ledger.settle(reservation, getattr(usage, "prompt_tokens", None),
+                                getattr(usage, "completion_tokens", None), kind=tier, model=model, error=error)
+        elif error is None:
+            token_ledger.settle(reservation, history_tokens(messages), estimate_tokens(ai_response or ""), kind=tier,
+                                model=model, estimated=True)
+        else:
+            token_ledger.settle(reservation, None, None, kind=tier, model=model, error=error)
+    logger.info("✅ AI response generated successfully", extra={"user": user_context.get('profile', {}).get('name', 'User')})
+    return ai_response
 
-User Question: {user_input}
+def stream_ai_response(user_input: str, user_context: Dict[str, Any], chat_history: list, summary: str = "",
+                       deadline: Optional[Deadline] = None, content: Optional[ContentPack] = None,
+                       account: Optional[str] = None, source: str = "socket",
+                       degradation: Optional[Degradation] = None,
+                       route: Optional[Dict[str, str]] = None) -> Iterator[str]:
+    """Yield an AI response as text deltas; raises when no endpoint accepts the call or the stream breaks.
 
-Please provide personalized relationship advice based on:
-1. The user's specific assessment data and profile
-2. Relevant knowledge from "The Cog Effect" book
-3. Best practices for healthy relationships
-4. Cultural sensitivity for their region and background
+    The endpoint streaming the answer is recorded in `route` when a dict is given.
+    """
+    degradation = degradation or brownout.current()
+    messages, tier = build_ai_messages(user_input, user_context, chat_history, summary, content, degradation)
+    reservation = token_ledger.reserve(account, history_tokens(messages) + degradation.max_tokens, source)
 
-Provide practical, actionable advice that addresses their specific situation.
-"""
+    # Failover and retries cover opening the stream; once tokens flow there is no retry
+    attempts = []
+    with tracer.span("llm_call", tier=tier, stream=True, brownout_level=degradation.level) as span:
+        try:
+            stream, backend = llm_router.complete(
+                messages,
+                tier=tier,
+                deadline=deadline,
+                attempts=attempts,
+                temperature=0.7,
+                max_tokens=degradation.max_tokens,
+                timeout=30,
+                stream=True
+            )
+        except Exception as e:
+            token_ledger.settle(reservation, None, None, kind=tier, error=type(e).__name__)
+            raise
+        finally:
+            span.set(attempts=len(attempts))
+            logger.info("LLM attempts: %s", attempts)
+        span.set(backend=backend.name, model=backend.model)
+    logger.info("LLM stream from endpoint %s (%s)", backend.name, backend.model)
+    if route is not None:
+        route.update(backend=backend.name, model=backend.model)
 
-        # Initialize OpenAI client
-        client = openai.OpenAI(api_key=os.environ["OPENAI_API_KEY"])
-        
-        # Make API call
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=500,
-            timeout=30
-        )
-        
-        ai_response = response.choices[0].message.content
-        logger.info(f"✅ AI response generated successfully for user: {user_context.get('profile', {}).get('name', 'User')}")
-        return ai_response
-        
+    # Streams carry no usage, so the ledger records estimates of what was sent and received
+    parts: List[str] = []
+    error = None
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
     except Exception as e:
-        logger.error(f"❌ AI response failed: {str(e)}")
-        return None
+        error = type(e).__name__
+        raise
+    finally:
+        stream.close()
+        token_ledger.settle(reservation, history_tokens(messages), estimate_tokens("".join(parts)), kind=tier,
+                            model=backend.model, estimated=True, error=error)
 
-def get_relevant_context(query: str, chapters: list, max_chunks: int = 2) -> list:
+def get_relevant_context(query: str, max_chunks: int = 2, content: Optional[ContentPack] = None) -> list:
     """Get relevant book chapters based on user query"""
-    query_lower = query.lower()
-    relevant_chapters = []
-    
-    for chapter in chapters:
-        chapter_text = f"{chapter['chapter_title']} {chapter['chapter_excerpt']}".lower()
-        # Simple relevance scoring
-        score = sum(1 for word in query_lower.split() if word in chapter_text)
-        if score > 0:
-            relevant_chapters.append((score, chapter))
-    
-    # Sort by relevance and return top chapters
-    relevant_chapters.sort(key=lambda x: x[0], reverse=True)
-    return [chapter for _, chapter in relevant_chapters[:max_chunks]]
+    return (content or content_store.current).index.search(query, max_chunks)
 
-def get_fallback_recommendation(assessment_scores: Dict[str, int]) -> Dict[str, str]:
+def get_fallback_recommendation(assessment_scores: Dict[str, int],
+                                chapters: Optional[Dict[str, Dict[str, str]]] = None) -> Dict[str, str]:
     """Get book chapter recommendation based on lowest assessment score (fallback)"""
+    chapters = chapters or content_store.current.chapters
     if not assessment_scores:
-        return BOOK_CHAPTERS["communication"]  # Default fallback
+        return chapters["communication"]  # Default fallback
     
     # Find the category with the lowest score
     lowest_score = float('inf')
     lowest_category = None
     
     for category, score in assessment_scores.items():
-        if category in BOOK_CHAPTERS and score < lowest_score:
+        # /api/recommendation passes client scores through unvalidated
+        if category in chapters and isinstance(score, (int, float)) and score < lowest_score:
             lowest_score = score
             lowest_category = category
     
     # If no valid categories found, return default
     if lowest_category is None:
-        return BOOK_CHAPTERS["communication"]
+        return chapters["communication"]
     
-    return BOOK_CHAPTERS[lowest_category]
+    return chapters[lowest_category]
 
-def generate_hybrid_response(user_input: str, user_context: Dict[str, Any], chat_history: list) -> Dict[str, Any]:
+def generate_hybrid_response(user_input: str, user_context: Dict[str, Any], chat_history: list, summary: str = "",
+                             deadline: Optional[Deadline] = None, subscription_tier: Optional[str] = None,
+                             account: Optional[str] = None) -> Dict[str, Any]:
     """Generate response using AI first, fallback to book chapters if AI fails"""
+    # One content version and one brownout level for the whole request, even if either changes midway
+    content = content_store.current
+    degradation = brownout.current()
+    
+    # Opening canonical questions are answered from the per-score-bucket table when it has an entry
+    if materialized_answers is not None and not chat_history and not summary:
+        answer = materialized_answers.lookup(user_input, user_context, content.version)
+        if answer:
+            return ai_result(answer, content, MATERIALIZED_SOURCE, materialized=True, brownout_level=degradation.level)
+    
+    if degradation.fallback_only:
+        return fallback_result(user_context, content, brownout_level=degradation.level)
     
     # Attempt AI response first
-    ai_response = get_ai_response(user_input, user_context, chat_history)
+    route: Dict[str, str] = {}
+    ai_response = get_ai_response(user_input, user_context, chat_history, summary, deadline, content, subscription_tier,
+                                  account, degradation, route)
     
     if ai_response:
         # AI succeeded - return AI response
-        return {
-            "success": True,
-            "response": ai_response,
-            "response_type": "ai_generated",
-            "source": "OpenAI GPT-3.5-turbo"
-        }
+        return ai_result(ai_response, content, route["model"], brownout_level=degradation.level)
     else:
         # AI failed - use fallback book recommendation
-        logger.info("📚 Using fallback book recommendation")
-        fallback = get_fallback_recommendation(user_context.get('assessment_scores', {}))
-        
-        return {
-            "success": True,
-            "response": f"Based on your assessment scores, I recommend focusing on:\n\n**{fallback['chapter_title']}**\n\n{fallback['chapter_excerpt']}\n\n**Why this recommendation?**\n{fallback['recommendation_reason']}",
-            "response_type": "book_fallback",
-            "source": "The Cog Effect Book",
-            "chapter_title": fallback['chapter_title'],
-            "chapter_excerpt": fallback['chapter_excerpt'],
-            "recommendation_reason": fallback['recommendation_reason']
-        }
+        return fallback_result(user_context, content, brownout_level=degradation.level)
+
+def stream_hybrid_response(user_input: str, user_context: Dict[str, Any], chat_history: list, summary: str,
+                           deadline: Optional[Deadline], emit: Callable[[str], bool],
+                           subscription_tier: Optional[str] = None, account: Optional[str] = None) -> Dict[str, Any]:
+    """generate_hybrid_response for streaming clients: the reply is passed to emit as it is generated.
+
+    emit returns False to stop early (the client cancelled or went away); the
+    result then holds the text sent so far and is marked truncated.
+    """
+    content = content_store.current
+    degradation = brownout.current()
+    
+    if materialized_answers is not None and not chat_history and not summary:
+        answer = materialized_answers.lookup(user_input, user_context, content.version)
+        if answer:
+            emit(answer)
+            return ai_result(answer, content, MATERIALIZED_SOURCE, materialized=True, brownout_level=degradation.level)
+    
+    if degradation.fallback_only:
+        logger.warning(f"⚠️ Brownout level {degradation.level}, using fallback")
+    elif llm_router.enabled:
+        parts: List[str] = []
+        route: Dict[str, str] = {}
+        try:
+            # The slot is held until the stream ends
+            with scheduler.slot(subscription_tier, deadline):
+                deltas = stream_ai_response(user_input, user_context, chat_history, summary, deadline, content, account,
+                                            degradation=degradation, route=route)
+                try:
+                    for delta in deltas:
+                        parts.append(delta)
+                        if not emit(delta):
+                            return ai_result("".join(parts), content, route["model"], truncated=True,
+                                             brownout_level=degradation.level)
+                finally:
+                    deltas.close()
+        except (CapacityUnavailable, QuotaExceeded) as e:
+            logger.warning(f"⚠️ {str(e)}, using fallback")
+        except Exception as e:
+            logger.error(f"❌ AI response failed: {str(e)}")
+            if parts:
+                # The client already has part of an answer; a book chapter would not follow on from it
+                return ai_result("".join(parts), content, route["model"], truncated=True,
+                                 brownout_level=degradation.level)
+        if parts:
+            return ai_result("".join(parts), content, route["model"], brownout_level=degradation.level)
+    else:
+        logger.warning("⚠️ OpenAI API key not available, using fallback")
+    
+    result = fallback_result(user_context, content, brownout_level=degradation.level)
+    emit(result["response"])
+    return result
+
+def ai_result(response: str, content: ContentPack, source: str, **extra: Any) -> Dict[str, Any]:
+    """A model answer; `source` names the model that wrote it"""
+    return {
+        "success": True,
+        "response": response,
+        "response_type": "ai_generated",
+        "source": source,
+        "content_version": content.version,
+        **extra
+    }
+
+def fallback_result(user_context: Dict[str, Any], content: ContentPack, **extra: Any) -> Dict[str, Any]:
+    """Book chapter recommendation for when no model answered"""
+    logger.info("📚 Using fallback book recommendation")
+    with tracer.span("fallback") as span:
+        fallback = get_fallback_recommendation(user_context.get('assessment_scores', {}), content.chapters)
+        span.set(chapter=fallback['chapter_title'])
+    
+    return {
+        "success": True,
+        "response": f"Based on your assessment scores, I recommend focusing on:\n\n**{fallback['chapter_title']}**\n\n{fallback['chapter_excerpt']}\n\n**Why this recommendation?**\n{fallback['recommendation_reason']}",
+        "response_type": "book_fallback",
+        "source": "The Cog Effect Book",
+        "chapter_title": fallback['chapter_title'],
+        "chapter_excerpt": fallback['chapter_excerpt'],
+        "recommendation_reason": fallback['recommendation_reason'],
+        "content_version": content.version,
+        **extra
+    }
+
+def build_chat_response(result: Dict[str, Any], user_context: Dict[str, Any], conversation_id: Optional[str] = None) -> Dict[str, Any]:
+    """Shape a hybrid result into the /api/chat response body"""
+    response = {
+        "success": True,
+        "response": result["response"],
+        "response_type": result["response_type"],
+        "source": result["source"],
+        "content_version": result["content_version"],
+        "brownout_level": result.get("brownout_level", 0),
+        "user_context_used": user_context,
+        "timestamp": datetime.datetime.now().isoformat()
+    }
+    if conversation_id:
+        response["conversation_id"] = conversation_id
+    if result.get("materialized"):
+        response["materialized"] = True
+    return response
+
+# ─── MATERIALIZED ANSWERS ────────────────────────────────────────────────────
+# Stored answers do not record which endpoint wrote them
+MATERIALIZED_SOURCE = "Precomputed AI answer"
+
+def generate_materialized_answer(question: str, user_context: Dict[str, Any]) -> str:
+    deadline = Deadline(REQUEST_DEADLINE_SECONDS)
+    with scheduler.slot("background", deadline):
+        # Stored answers are served for a day, so they are always generated in full
+        return generate_ai_response(question, user_context, [], "", deadline, source="materialized",
+                                    degradation=brownout.levels[0])
+
+materialized_answers: Optional[MaterializedAnswers] = None
+if llm_router.enabled and os.environ.get("AI_MATERIALIZED_ANSWERS", "true").lower() == "true":
+    materialized_answers = MaterializedAnswers(
+        categories=list(content_store.current.chapters),
+        generate=generate_materialized_answer,
+        bucket_size=int(os.environ.get("AI_MATERIALIZED_BUCKET_SIZE", "20")),
+        max_age_seconds=float(os.environ.get("AI_MATERIALIZED_MAX_AGE_SECONDS", "86400")),
+        max_entries=int(os.environ.get("AI_MATERIALIZED_MAX_ENTRIES", "50000")),
+        persist_path=os.environ.get("AI_MATERIALIZED_PATH") or None,
+        max_pending=int(os.environ.get("AI_MATERIALIZED_MAX_PENDING", "100")),
+        save_interval=int(os.environ.get("AI_MATERIALIZED_SAVE_INTERVAL", "60")),
+        save_every=int(os.environ.get("AI_MATERIALIZED_SAVE_EVERY", "100"))
+    )
+
+# ─── CONVERSATION SESSIONS ───────────────────────────────────────────────────
+session_store = SessionStore(
+    max_sessions=int(os.environ.get("AI_SESSION_MAX_SESSIONS", "1000")),
+    max_turns=int(os.environ.get("AI_SESSION_MAX_TURNS", "50")),
+    max_total_chars=int(os.environ.get("AI_SESSION_MAX_TOTAL_CHARS", "20000000")),
+    persist_path=os.environ.get("AI_SESSION_PERSIST_PATH") or None,
+    persist_interval=int(os.environ.get("AI_SESSION_PERSIST_INTERVAL", "60"))
+)
+
+summarizer = RollingSummarizer(
+    session_store,
+    threshold_tokens=int(os.environ.get("AI_SUMMARY_THRESHOLD_TOKENS", "1500")),
+    keep_recent_turns=int(os.environ.get("AI_SUMMARY_KEEP_RECENT_TURNS", "6")),
+    summarize=make_summarize(llm_router, token_ledger)
+)
+
+def load_conversation(conversation_id: str, chat_history: list, history_turns: int) -> Optional[list]:
+    """Return the server-side history for a conversation.
+
+    A client-supplied chat_history seeds a conversation the server does not know,
+    or replaces a stored copy with fewer turns than the client has (e.g. another
+    worker's older copy). Returns None when the client expects prior turns that
+    the server does not have, so the caller can ask the client to resend its full history.
+    """
+    stored_turns = session_store.turn_count(conversation_id)
+    if stored_turns is None or stored_turns < history_turns:
+        if chat_history:
+            if stored_turns is not None:
+                session_store.delete(conversation_id)
+            session_store.extend(conversation_id, chat_history, history_turns)
+        elif history_turns > 0:
+            return None
+    return session_store.history(conversation_id)
+
+def record_turn(conversation_id: str, user_input: str, result: Dict[str, Any]) -> None:
+    """Append the user's message and the generated reply to the conversation"""
+    session_store.append(conversation_id, "user", user_input)
+    session_store.append(conversation_id, "assistant", result["response"])
+    summarizer.maybe_schedule(conversation_id)
+
+def conversation_expired_response(conversation_id: str):
+    return jsonify({
+        "success": False,
+        "error": "Conversation history not found on server, resend chat_history",
+        "code": "conversation_expired",
+        "conversation_id": conversation_id,
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 409
+
+def run_chat_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Job handler: run hybrid generation for a queued chat request"""
+    conversation_id = payload.get('conversation_id')
+    chat_history = session_store.history(conversation_id) if conversation_id else payload['chat_history']
+    summary = session_store.summary(conversation_id) if conversation_id else ""
+    deadline = Deadline(REQUEST_DEADLINE_SECONDS)
+    started = time.perf_counter()
+    try:
+        with tracer.span("chat_job"):
+            result = generate_hybrid_response(payload['user_input'], payload['user_context'], chat_history, summary,
+                                              deadline, payload.get('subscription_tier'), payload.get('account'))
+    finally:
+        brownout.observe(time.perf_counter() - started)
+    if conversation_id:
+        record_turn(conversation_id, payload['user_input'], result)
+    return build_chat_response(result, payload['user_context'], conversation_id)
+
+# ─── SCORE ANALYTICS ─────────────────────────────────────────────────────────
+# Population percentiles per category, assessment type and region, from the scores requests carry
+score_analytics = build_score_analytics_from_env()
+
+def record_scores(assessment_scores: Any, user_context: Any) -> None:
+    """Feed a signed-in caller's scores to the analytics sketches; never fails the request"""
+    try:
+        claims = request_claims()
+        score_analytics.ingest(assessment_scores, user_context if isinstance(user_context, dict) else {},
+                               claims["sub"] if claims else None)
+    except Exception as e:
+        logger.warning(f"⚠️ Score analytics ingest failed: {str(e)}")
+
+# ─── DELUSIONAL SCORES ───────────────────────────────────────────────────────
+# Self vs external assessment gaps per user, kept current as assessments are posted to the feed
+delusional_scores = build_delusional_scores_from_env()
+# Shared secret for the assessment feed (e.g. a database webhook); the feed is disabled without it
+DELUSIONAL_INGEST_TOKEN = os.environ.get("AI_DELUSIONAL_INGEST_TOKEN", "")
+DELUSIONAL_MAX_BODY_BYTES = int(os.environ.get("AI_DELUSIONAL_MAX_BODY_BYTES", "52428800"))
+
+def attach_delusional_score(user_context: Dict[str, Any]) -> None:
+    """Fill in the caller's delusional score from the engine when the client did not send one (or sent null)"""
+    if user_context.get('delusional_score') is not None:
+        return
+    claims = request_claims()
+    if not claims or not claims.get("sub"):
+        return
+    result = delusional_scores.get(str(claims["sub"]), assessment_type(user_context))
+    if result is not None:
+        user_context['delusional_score'] = result["overall_score"]
+
+# ─── TRAFFIC CAPTURE ─────────────────────────────────────────────────────────
+# Anonymized request shapes for replay.py; off unless AI_CAPTURE_DIR is set
+traffic_capture = build_traffic_capture_from_env()
+
+def capture_note(**fields: Any) -> None:
+    """Add fields to this request's capture record; a no-op when it is not being captured"""
+    if traffic_capture is not None and has_request_context():
+        record = g.get("capture")
+        if record is not None:
+            record.update(fields)
+
+def capture_chat_request(chat_request: ChatRequest, chat_history: list) -> None:
+    """Describe a chat request; chat_history is the history the reply will be generated from"""
+    if traffic_capture is not None and g.get("capture") is not None:
+        g.capture.update(traffic_capture.describe_chat(chat_request.user_input, chat_request.user_context,
+                                                       chat_history, chat_request.conversation_id,
+                                                       content_store.current.chapters),
+                         history_turns=chat_request.history_turns, tier=request_subscription_tier())
+
+def capture_result(result: Dict[str, Any]) -> None:
+    capture_note(response_type=result["response_type"], materialized=bool(result.get("materialized")),
+                 response_chars=len(result["response"]), brownout_level=result.get("brownout_level", 0))
+
+def capture_recommendation(assessment_scores: Dict[str, Any]) -> None:
+    if traffic_capture is not None and g.get("capture") is not None:
+        chapters = content_store.current.chapters
+        g.capture.update(score_categories=len(assessment_scores), response_type="book_fallback",
+                         categories=sorted(category for category in assessment_scores if category in chapters))
+
+# ─── REQUEST VALIDATION ──────────────────────────────────────────────────────
+def parse_chat_request() -> ChatRequest:
+    """Validate a chat body, rejecting oversized requests before reading them in full"""
+    check_content_length(request.content_length)
+    # Read at most one byte past the limit so chunked uploads cannot exceed it either
+    return decode_chat_request(request.stream.read(MAX_BODY_BYTES + 1))
+
+# Verifies Supabase access tokens (HS256); without it a caller's subscription tier is taken as declared
+SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET", "")
+
+def request_claims() -> Optional[Dict[str, Any]]:
+    """The caller's verified access token claims, or None without a valid Bearer token"""
+    if "claims" in g:
+        return g.claims
+    authorization = request.headers.get("Authorization", "")
+    g.claims = None
+    if SUPABASE_JWT_SECRET and authorization.startswith("Bearer "):
+        try:
+            g.claims = verify_access_token(authorization[len("Bearer "):], SUPABASE_JWT_SECRET)
+        except AuthError:
+            pass
+    return g.claims
+
+def request_account() -> str:
+    """Whose token quota a request draws on: the verified user, else a hash of the client address"""
+    claims = request_claims()
+    if claims:
+        return f"user:{claims['sub']}"
+    return address_account()
+
+def address_account() -> str:
+    """Token quota account for an unauthenticated caller, from the proxy-verified client address"""
+    address = request.remote_addr or ""
+    # The front end may append the client's port ("203.0.113.7:51234", "[2001:db8::1]:51234")
+    if address.startswith("["):
+        address = address[1:].split("]")[0]
+    elif address.count(":") == 1:
+        address = address.split(":")[0]
+    return f"ip:{hashlib.sha256(address.encode('utf-8')).hexdigest()[:16]}"
+
+def request_subscription_tier() -> str:
+    """The caller's scheduling tier: a verified token's tier claim when tokens are verified
+    (the default tier without one), else the X-Subscription-Tier header"""
+    if SUPABASE_JWT_SECRET:
+        claims = request_claims()
+        return scheduler.tier_for(token_subscription_tier(claims) if claims else None)
+    return scheduler.tier_for(request.headers.get("X-Subscription-Tier"))
+
+def validation_error_response(error: ValidationError):
+    logger.warning(f"⚠️ Rejected chat request ({error.status}): {str(error)}")
+    return jsonify({
+        **error.to_dict(),
+        "timestamp": datetime.datetime.now().isoformat()
+    }), error.status
+
+# ─── BACKGROUND JOBS ─────────────────────────────────────────────────────────
+# Long-poll waits are capped below the Azure front door idle timeout
+JOB_MAX_WAIT_SECONDS = 25
+
+job_queue = JobQueue(
+    handler=run_chat_job,
+    max_workers=int(os.environ.get("AI_JOB_WORKERS", "4")),
+    result_ttl=int(os.environ.get("AI_JOB_RESULT_TTL", "600")),
+    max_pending=int(os.environ.get("AI_JOB_MAX_PENDING", "100"))
+)
 
 # Initialize service
 logger.info("✅ LoveMirror Hybrid AI and Book Recommendation Service initialized")
 
 # ─── FLASK APP SETUP ────────────────────────────────────────────────────────
 app = Flask(__name__)
+# App Service's front end appends the client address to X-Forwarded-For; only the entries added by
+# trusted proxies count, since the client controls the rest of the header
+TRUSTED_PROXY_HOPS = int(os.environ.get("AI_TRUSTED_PROXY_HOPS", "1"))
+if TRUSTED_PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
 
-# Configure CORS for Azure deployment
-CORS(app, origins=[
+ALLOWED_ORIGINS = [
     "https://lovemirror.co.uk", 
     "https://www.lovemirror.co.uk", 
     "http://localhost:5173", 
     "http://localhost:3000", 
     "https://lovemirror-ai-service-gzasfnbbbpcaf7ff.ukwest-01.azurewebsites.net"
-])
+]
+
+# Configure CORS for Azure deployment
+CORS(app, origins=ALLOWED_ORIGINS, expose_headers=["traceparent"])
 
 # Production configuration
 if not app.debug:
     app.config['PROPAGATE_EXCEPTIONS'] = True
 
+# ─── ADMIN ───────────────────────────────────────────────────────────────────
+# Operator-only diagnostics; every /admin endpoint answers 404 unless ADMIN_API_TOKEN is set
+ADMIN_API_TOKEN = os.environ.get("ADMIN_API_TOKEN", "")
+memory_profiler = build_memory_profiler_from_env() if ADMIN_API_TOKEN else None
+
+def admin_only(view: Callable) -> Callable:
+    """Require an X-Admin-Token header matching ADMIN_API_TOKEN"""
+    @functools.wraps(view)
+    def guarded(*args, **kwargs):
+        if not ADMIN_API_TOKEN:
+            return jsonify({"error": "Not found"}), 404
+        supplied = request.headers.get("X-Admin-Token", "")
+        if not hmac.compare_digest(supplied.encode("utf-8"), ADMIN_API_TOKEN.encode("utf-8")):
+            logger.warning(f"⚠️ Rejected admin request to {request.path}")
+            return jsonify({"success": False, "error": "Invalid admin token"}), 401
+        return view(*args, **kwargs)
+    return guarded
+
+def admin_key_type_and_limit() -> Tuple[str, int]:
+    """The key_type and limit query arguments of the memory endpoints"""
+    key_type = request.args.get('key_type', 'lineno')
+    if key_type not in MEMORY_KEY_TYPES:
+        raise ValueError(f"key_type must be one of {', '.join(MEMORY_KEY_TYPES)}")
+    return key_type, min(max(request.args.get('limit', 25, type=int), 1), 500)
+
+# ─── WEBSOCKET CHAT CHANNEL ─────────────────────────────────────────────────
+def open_socket_conversation(conversation_id: str, chat_history: list, history_turns: int) -> bool:
+    return load_conversation(conversation_id, chat_history, history_turns) is not None
+
+def respond_on_socket(conversation, user_input: str, emit: Callable[[str], bool]) -> Dict[str, Any]:
+    """Stream one reply on a chat channel; history lives in the session store like /api/chat conversations"""
+    conversation_id = conversation.conversation_id
+    started = time.perf_counter()
+    try:
+        result = stream_hybrid_response(user_input, conversation.user_context, session_store.history(conversation_id),
+                                        session_store.summary(conversation_id), Deadline(REQUEST_DEADLINE_SECONDS),
+                                        emit, conversation.subscription_tier,
+                                        f"user:{conversation.user_id}" if conversation.user_id else address_account())
+    finally:
+        # Time to the end of the reply, as for /api/chat
+        brownout.observe(time.perf_counter() - started)
+    record_turn(conversation_id, user_input, result)
+    # The client assembled the text from token frames, so it is not sent again
+    done = {key: result[key] for key in ("response_type", "source", "content_version")}
+    done["brownout_level"] = result.get("brownout_level", 0)
+    done.update({key: True for key in ("materialized", "truncated") if result.get(key)})
+    done["timestamp"] = datetime.datetime.now().isoformat()
+    return done
+
+channel_hub = ChannelHub(
+    open_conversation=open_socket_conversation,
+    respond=respond_on_socket,
+    jwt_secret=SUPABASE_JWT_SECRET,
+    allowed_origins=ALLOWED_ORIGINS,
+    heartbeat_seconds=float(os.environ.get("AI_WS_HEARTBEAT_SECONDS", "20")),
+    idle_seconds=float(os.environ.get("AI_WS_IDLE_SECONDS", "300")),
+    send_timeout=float(os.environ.get("AI_WS_SEND_TIMEOUT_SECONDS", "10")),
+    max_queued_frames=int(os.environ.get("AI_WS_MAX_QUEUED_FRAMES", "32")),
+    max_connections=int(os.environ.get("AI_WS_MAX_CONNECTIONS", "2"))
+)
+CHAT_SOCKET_ENABLED = register_chat_socket(app, channel_hub, MAX_BODY_BYTES)
+if not CHAT_SOCKET_ENABLED:
+    logger.warning("⚠️ flask-sock not installed, WebSocket chat channel disabled")
+elif not channel_hub.jwt_secret:
+    logger.warning("⚠️ SUPABASE_JWT_SECRET not set, WebSocket chat channels are not authenticated")
+
+# ─── STARTUP WARM-UP ────────────────────────────────────────────────────────
+# Dependency state is fixed at startup, so /health never re-reads it per request
+HEALTH_STATUS = {
+    "status": "healthy",
+    "service": "LoveMirror Hybrid AI and Book Recommendation Service",
+    "version": "3.0.0",
+    "features": {
+        "ai_enabled": llm_router.enabled,
+        "response_logic": "hybrid_ai_fallback",
+        "ai_model": ", ".join(sorted({b.model for b in llm_router.backends})) or "disabled"
+    }
+}
+
+def prime_caches():
+    """Warm the tokenizer and the per-chapter prompt fragments"""
+    prompt_builder.warm(content_store.current.documents)
+
+def refresh_content_caches(old: ContentPack, new: ContentPack, changed: set) -> None:
+    """Drop prompt fragments built from changed chapters and pre-render their new text"""
+    dropped = prompt_builder.invalidate([old.chapters[c]["chapter_excerpt"] for c in changed if c in old.chapters])
+    prompt_builder.warm([new.chapters[c] for c in changed if c in new.chapters])
+    logger.info("Content %s active, %d cached prompt fragments invalidated", new.version, dropped)
+
+content_store.on_change(refresh_content_caches)
+content_store.start()
+
+warmup = Warmup()
+warmup.step("prompt_cache", prime_caches)
+if llm_router.enabled:
+    warmup.step("model_connections", llm_router.warm, required=False)
+warmup.start()
+
 # ─── API ENDPOINTS ──────────────────────────────────────────────────────────
+# Endpoints that get a root span; callers may continue their own trace via a traceparent header
+TRACED_ENDPOINTS = {"chat", "submit_chat_job", "get_chapter_recommendation"}
+
+@app.before_request
+def begin_request_logging():
+    """Tag this request's log records with its endpoint and make the sampling decision"""
+    log_pipeline.sampler.begin_request(request.endpoint)
+    if traffic_capture is not None and request.endpoint in TRACED_ENDPOINTS and traffic_capture.sampled():
+        g.capture = {"t": round(time.time(), 3), "endpoint": request.endpoint,
+                     "body_bytes": request.content_length, "started": time.perf_counter()}
+    if request.endpoint in TRACED_ENDPOINTS:
+        g.trace_span = tracer.begin_trace(f"{request.method} {request.path}", request.headers.get("traceparent"),
+                                          endpoint=request.endpoint)
+
+@app.after_request
+def add_trace_header(response):
+    """Return the trace id so a slow request can be found in the exported spans"""
+    span = g.get("trace_span")
+    if span is not None:
+        span.set(status_code=response.status_code)
+        response.headers["traceparent"] = span.traceparent
+    record = g.pop("capture", None)
+    if record is not None:
+        record["duration_ms"] = round((time.perf_counter() - record.pop("started")) * 1000, 1)
+        record["status"] = response.status_code
+        traffic_capture.record(record)
+    return response
+
+@app.teardown_request
+def end_request_trace(error=None):
+    span = g.pop("trace_span", None)
+    if span is not None:
+        if error is not None:
+            span.status = "error"
+        tracer.end(span)
+
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
-    try:
-        health_status = {
-            "status": "healthy",
-            "timestamp": datetime.datetime.now().isoformat(),
-            "service": "LoveMirror Hybrid AI and Book Recommendation Service",
-            "version": "3.0.0",
-            "features": {
-                "book_chapters": len(BOOK_CHAPTERS),
-                "ai_enabled": bool(os.environ.get("OPENAI_API_KEY")),
-                "response_logic": "hybrid_ai_fallback",
-                "ai_model": "gpt-3.5-turbo" if os.environ.get("OPENAI_API_KEY") else "disabled"
-            }
-        }
-        
-        return jsonify(health_status), 200
-        
-    except Exception as e:
-        logger.error(f"Health check failed: {e}")
-        return jsonify({
-            "status": "unhealthy",
-            "error": str(e),
-            "timestamp": datetime.datetime.now().isoformat()
-        }), 503
+    """Liveness check; reads dependency state cached at startup"""
+    content = content_store.current
+    return jsonify({
+        **HEALTH_STATUS,
+        "features": {**HEALTH_STATUS["features"], "book_chapters": len(content.chapters)},
+        "content_version": content.version,
+        "ready": warmup.ready.is_set(),
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 200
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness check; only ready once the warm-up stage has finished"""
+    status = warmup.status()
+    return jsonify({
+        "status": "ready" if status["ready"] else "warming_up",
+        **status,
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 200 if status["ready"] else 503
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Hybrid AI chat endpoint - tries AI first, falls back to book chapters"""
+    # Every upstream attempt for this request has to fit inside one overall deadline
+    deadline = Deadline(REQUEST_DEADLINE_SECONDS)
+    started = time.perf_counter()
+    chat_request = None
     try:
-        # Parse request data
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "No data provided"}), 400
+        # Parse and validate request data
+        try:
+            with tracer.span("parse"):
+                chat_request = parse_chat_request()
+        except ValidationError as e:
+            return validation_error_response(e)
         
-        user_input = data.get('user_input', '')
-        user_context = data.get('user_context', {})
-        chat_history = data.get('chat_history', [])
+        user_input = chat_request.user_input
+        user_context = chat_request.user_context
+        chat_history = chat_request.chat_history
+        conversation_id = chat_request.conversation_id
+        record_scores(user_context.get('assessment_scores'), user_context)
+        attach_delusional_score(user_context)
         
-        if not user_input:
-            return jsonify({"error": "No user input provided"}), 400
+        # With a conversation id the server holds the history; clients send only the new turn
+        summary = ""
+        if conversation_id:
+            with tracer.span("session_load"):
+                chat_history = load_conversation(conversation_id, chat_history, chat_request.history_turns)
+                if chat_history is None:
+                    return conversation_expired_response(conversation_id)
+                summary = session_store.summary(conversation_id)
+        capture_chat_request(chat_request, chat_history)
         
         # Log the request
         user_name = user_context.get('profile', {}).get('name', 'User')
-        logger.info(f"Chat request from user: {user_name}")
+        logger.info("Chat request received", extra={"user": user_name})
         
         # Generate hybrid response (AI first, fallback to book chapters)
-        result = generate_hybrid_response(user_input, user_context, chat_history)
+        result = generate_hybrid_response(user_input, user_context, chat_history, summary, deadline,
+                                          request_subscription_tier(), request_account())
+        
+        if conversation_id:
+            record_turn(conversation_id, user_input, result)
+        capture_result(result)
+        
+        with tracer.span("serialize"):
+            response = jsonify(build_chat_response(result, user_context, conversation_id))
+        return response, 200
+        
+    except Exception as e:
+        logger.error(f"Chat endpoint error: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": f"Internal server error: {str(e)}",
+            "timestamp": datetime.datetime.now().isoformat()
+        }), 500
+    finally:
+        # Failed requests count too; only requests rejected by validation are left out
+        if chat_request is not None:
+            brownout.observe(time.perf_counter() - started)
+
+@app.route('/api/chat/jobs', methods=['POST'])
+def submit_chat_job():
+    """Queue a hybrid chat request and return a job id immediately"""
+    try:
+        # Parse and validate request data
+        try:
+            chat_request = parse_chat_request()
+        except ValidationError as e:
+            return validation_error_response(e)
+        record_scores(chat_request.user_context.get('assessment_scores'), chat_request.user_context)
+        attach_delusional_score(chat_request.user_context)
+        
+        payload = {
+            "user_input": chat_request.user_input,
+            "user_context": chat_request.user_context,
+            "chat_history": chat_request.chat_history,
+            "subscription_tier": request_subscription_tier(),
+            "account": request_account()
+        }
+        
+        conversation_id = chat_request.conversation_id
+        if conversation_id:
+            history = load_conversation(conversation_id, payload["chat_history"], chat_request.history_turns)
+            if history is None:
+                return conversation_expired_response(conversation_id)
+            capture_chat_request(chat_request, history)
+            # History is read from the session store when the job runs; the turn count keeps a repeated
+            # message in a later turn from being deduplicated onto the earlier turn's job
+            payload["conversation_id"] = conversation_id
+            payload["conversation_turn"] = session_store.turn_count(conversation_id)
+            payload["chat_history"] = []
+        else:
+            capture_chat_request(chat_request, payload["chat_history"])
+        
+        try:
+            job, deduplicated = job_queue.submit(payload)
+        except QueueFullError as e:
+            logger.warning(f"⚠️ Chat job rejected: {str(e)}")
+            response = jsonify({
+                "success": False,
+                "error": str(e),
+                "timestamp": datetime.datetime.now().isoformat()
+            })
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        
+        return jsonify({
+            "success": True,
+            "job_id": job.id,
+            "status": job.status,
+            "deduplicated": deduplicated,
+            "poll_url": f"/api/chat/jobs/{job.id}",
+            "timestamp": datetime.datetime.now().isoformat()
+        }), 202
+        
+    except Exception as e:
+        logger.error(f"Chat job submit error: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": f"Internal server error: {str(e)}",
+            "timestamp": datetime.datetime.now().isoformat()
+        }), 500
+
+@app.route('/api/chat/jobs/<job_id>', methods=['GET'])
+def get_chat_job(job_id):
+    """Poll a chat job; pass ?wait=<seconds> to long-poll until it finishes"""
+    try:
+        wait = min(max(request.args.get('wait', 0, type=float), 0), JOB_MAX_WAIT_SECONDS)
+        job = job_queue.wait(job_id, wait)
+        
+        if job is None:
+            return jsonify({"error": "Job not found or expired"}), 404
         
         return jsonify({
             "success": True,
-            "response": result["response"],
-            "response_type": result["response_type"],
-            "source": result["source"],
-            "user_context_used": user_context,
+            **job.to_dict(),
             "timestamp": datetime.datetime.now().isoformat()
         }), 200
         
     except Exception as e:
-        logger.error(f"Chat endpoint error: {str(e)}")
+        logger.error(f"Chat job poll error: {str(e)}")
         return jsonify({
             "success": False,
             "error": f"Internal server error: {str(e)}",
             "timestamp": datetime.datetime.now().isoformat()
         }), 500
 
+@app.route('/api/conversations/<conversation_id>', methods=['DELETE'])
+def delete_conversation(conversation_id):
+    """Forget the server-side history for a conversation"""
+    deleted = session_store.delete(conversation_id)
+    return jsonify({
+        "success": True,
+        "deleted": deleted,
+        "conversation_id": conversation_id,
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Runtime metrics for the service's background subsystems"""
+    return jsonify({
+        "content": content_store.stats(),
+        "jobs": job_queue.stats(),
+        "sessions": session_store.stats(),
+        "summarizer": summarizer.stats(),
+        "prompts": prompt_builder.stats(),
+        "context": {"mode": CONTEXT_MODE, **context_selector.stats()},
+        "llm_router": llm_router.stats(),
+        "scheduler": scheduler.stats(),
+        "score_analytics": score_analytics.stats(),
+        "delusional_scores": delusional_scores.stats(),
+        "websocket": channel_hub.stats() if CHAT_SOCKET_ENABLED else {"enabled": False},
+        "materialized_answers": materialized_answers.stats() if materialized_answers else {"enabled": False},
+        "logging": log_pipeline.stats(),
+        "tracing": tracer.stats(),
+        "traffic_capture": traffic_capture.stats() if traffic_capture else {"enabled": False},
+        "memory": memory_profiler.stats() if memory_profiler else {"enabled": False},
+        "token_ledger": token_ledger.stats(),
+        "brownout": brownout.stats(),
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 200
+
+@app.route('/admin/memory', methods=['GET'])
+@admin_only
+def memory_report():
+    """This worker's RSS/PSS/USS, GC stats, tracemalloc status and sampled history (?objects=N adds live types)"""
+    return jsonify({
+        "success": True,
+        **memory_profiler.report(objects=min(max(request.args.get('objects', 0, type=int), 0), 500)),
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 200
+
+@app.route('/admin/memory/tracemalloc/<action>', methods=['POST'])
+@admin_only
+def memory_tracing(action):
+    """Start (?frames=N) or stop tracemalloc in this worker"""
+    if action == "start":
+        status = memory_profiler.start(frames=min(max(request.args.get('frames', 1, type=int), 1), 50))
+    elif action == "stop":
+        status = memory_profiler.stop()
+    else:
+        return jsonify({"success": False, "error": "action must be start or stop"}), 404
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        **status,
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 200
+
+@app.route('/admin/memory/snapshots', methods=['POST'])
+@admin_only
+def memory_snapshot():
+    """Take an allocation snapshot and return its top sites (?key_type=lineno|filename|traceback&limit=&collect=1)"""
+    try:
+        key_type, limit = admin_key_type_and_limit()
+        snapshot = memory_profiler.snapshot(key_type, limit, collect=request.args.get('collect') == '1')
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"success": False, "error": str(e)}), 409
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        **snapshot,
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 200
+
+@app.route('/admin/memory/diff', methods=['GET'])
+@admin_only
+def memory_diff():
+    """Allocation growth between snapshots (?from=baseline&to=<id>; without to, against a fresh snapshot)"""
+    try:
+        key_type, limit = admin_key_type_and_limit()
+        diff = memory_profiler.diff(request.args.get('from', 'baseline'), request.args.get('to'), key_type, limit)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except KeyError as e:
+        return jsonify({"success": False, "error": e.args[0]}), 404
+    except RuntimeError as e:
+        return jsonify({"success": False, "error": str(e)}), 409
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        **diff,
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 200
+
+@app.route('/admin/tokens', methods=['GET'])
+@admin_only
+def token_usage():
+    """Quota state and token usage by account and question kind (?account=&top=20&since=<seconds>)"""
+    since = request.args.get('since', type=float)
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        "quota": token_ledger.quota(request.args.get('account')),
+        "usage": token_ledger.usage(min(max(request.args.get('top', 20, type=int), 1), 500), since),
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 200
+
+@app.route('/admin/brownout', methods=['POST'])
+@admin_only
+def pin_brownout():
+    """Hold this worker at a brownout level (?level=0-4) or hand it back to the latency controller (?level=auto)"""
+    level = request.args.get('level', 'auto')
+    if level != 'auto' and not (level.isdigit() and int(level) <= 4):
+        return jsonify({"success": False, "error": "level must be 0-4 or auto"}), 400
+    brownout.pin(None if level == 'auto' else int(level))
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        "brownout": brownout.stats(),
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 200
+
 @app.route('/api/recommendation', methods=['POST'])
 def get_chapter_recommendation():
     """Get book chapter recommendation based on assessment scores (fallback only)"""
@@ -327,13 +1085,16 @@ def get_chapter_recommendation():
         
         if not assessment_scores:
             return jsonify({"error": "No assessment scores provided"}), 400
+        record_scores(assessment_scores, user_context)
+        capture_recommendation(assessment_scores)
         
         # Get fallback recommendation
-        fallback = get_fallback_recommendation(assessment_scores)
+        content = content_store.current
+        fallback = get_fallback_recommendation(assessment_scores, content.chapters)
         
         # Log the request
         user_name = user_context.get('profile', {}).get('name', 'User')
-        logger.info(f"Fallback recommendation request from user: {user_name}")
+        logger.info("Fallback recommendation request received", extra={"user": user_name})
         
         return jsonify({
             "success": True,
@@ -344,6 +1105,7 @@ def get_chapter_recommendation():
             "assessment_scores_used": assessment_scores,
             "response_type": "book_fallback",
             "source": "The Cog Effect Book",
+            "content_version": content.version,
             "timestamp": datetime.datetime.now().isoformat()
         }), 200
         
@@ -355,12 +1117,164 @@ def get_chapter_recommendation():
             "timestamp": datetime.datetime.now().isoformat()
         }), 500
 
+@app.route('/api/analytics/percentiles', methods=['GET'])
+def get_score_percentiles():
+    """Where scores sit in the population: ?communication=72&trust=55[&assessment_type=...][&region=...]"""
+    kind = request.args.get('assessment_type')
+    region = request.args.get('region')
+    percentiles = {}
+    for category, value in request.args.items():
+        if category in ('assessment_type', 'region'):
+            continue
+        try:
+            score = float(value)
+        except ValueError:
+            return jsonify({"success": False, "error": f"Score for {category} must be a number"}), 400
+        percentiles[category] = score_analytics.percentile(category, score, kind, region)
+    if not percentiles:
+        return jsonify({"success": False, "error": "No scores provided"}), 400
+    return jsonify({
+        "success": True,
+        "percentiles": percentiles,
+        "assessment_type": kind or "all",
+        "region": region or "all",
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 200
+
+@app.route('/api/analytics/distribution', methods=['GET'])
+def get_score_distribution():
+    """Quantiles of one category's scores, for drift monitoring: ?category=trust[&assessment_type=...][&region=...]"""
+    category = request.args.get('category')
+    if not category:
+        return jsonify({"success": False, "error": "category is required"}), 400
+    return jsonify({
+        "success": True,
+        "category": category,
+        **score_analytics.quantiles(category, request.args.get('assessment_type'), request.args.get('region')),
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 200
+
+# Batch compatibility bodies are JSONL streams, far larger than a chat request
+COMPATIBILITY_MAX_BODY_BYTES = int(os.environ.get("AI_COMPATIBILITY_MAX_BODY_BYTES", "52428800"))
+COMPATIBILITY_BATCH_SIZE = int(os.environ.get("AI_COMPATIBILITY_BATCH_SIZE", "2048"))
+
+@app.route('/api/compatibility/batch', methods=['POST'])
+@admin_only
+def score_compatibility_batch():
+    """Compatibility for a JSONL stream of partner score pairs, streamed back as JSONL (?mode=edge|client)"""
+    mode = request.args.get('mode', 'edge')
+    if mode not in COMPATIBILITY_MODES:
+        return jsonify({"success": False, "error": f"mode must be one of {', '.join(COMPATIBILITY_MODES)}"}), 400
+    if request.content_length is not None and request.content_length > COMPATIBILITY_MAX_BODY_BYTES:
+        return jsonify({"success": False,
+                        "error": f"Request body too large (max {COMPATIBILITY_MAX_BODY_BYTES} bytes)"}), 413
+
+    def body_lines() -> Iterator[bytes]:
+        # Block reads: line-by-line reads of the request stream are far slower
+        received, partial = 0, b""
+        while True:
+            block = request.stream.read(65536)
+            if not block:
+                break
+            received += len(block)
+            if received > COMPATIBILITY_MAX_BODY_BYTES:
+                raise ValueError(f"Request body too large (max {COMPATIBILITY_MAX_BODY_BYTES} bytes)")
+            lines = (partial + block).split(b"\n")
+            partial = lines.pop()
+            yield from lines
+        if partial:
+            yield partial
+
+    def generate() -> Iterator[str]:
+        scored, pending = 0, []
+        try:
+            for line in score_stream(read_pairs(body_lines()), mode, COMPATIBILITY_BATCH_SIZE):
+                scored += 1
+                pending.append(line)
+                # One write per batch rather than per line
+                if len(pending) >= COMPATIBILITY_BATCH_SIZE:
+                    yield "".join(pending)
+                    pending = []
+            yield "".join(pending)
+        except Exception as e:
+            yield "".join(pending)
+            logger.error(f"Compatibility batch error: {str(e)}")
+            yield json.dumps({"error": str(e)}) + "\n"
+        logger.info(f"Compatibility batch wrote {scored} results", extra={"mode": mode})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/delusional-score', methods=['GET'])
+def get_delusional_score():
+    """The caller's delusional score for one assessment type (?assessment_type=), null until both sides exist"""
+    claims = request_claims()
+    if not claims or not claims.get("sub"):
+        return jsonify({
+            "success": False,
+            "error": "A valid access token is required",
+            "timestamp": datetime.datetime.now().isoformat()
+        }), 401
+    kind = request.args.get('assessment_type')
+    if not kind:
+        return jsonify({"success": False, "error": "assessment_type is required"}), 400
+    return jsonify({
+        "success": True,
+        "assessment_type": kind,
+        "delusional_score": delusional_scores.get(str(claims["sub"]), kind),
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 200
+
+@app.route('/api/delusional-score/assessments', methods=['POST'])
+def ingest_delusional_assessments():
+    """Feed self and external assessment rows (JSONL or a JSON array) to the delusional score engine.
+
+    Rows are folded in one at a time, in order; ?mode=rebuild instead recomputes
+    the users in the body from scratch (a backfill with their full history).
+    """
+    if not DELUSIONAL_INGEST_TOKEN:
+        return jsonify({"success": False, "error": "Assessment feed is disabled"}), 404
+    supplied = request.headers.get("X-Ingest-Token", "")
+    if not hmac.compare_digest(supplied.encode("utf-8"), DELUSIONAL_INGEST_TOKEN.encode("utf-8")):
+        return jsonify({"success": False, "error": "Invalid ingest token"}), 401
+    mode = request.args.get('mode', 'add')
+    if mode not in ("add", "rebuild"):
+        return jsonify({"success": False, "error": "mode must be one of add, rebuild"}), 400
+    if request.content_length is not None and request.content_length > DELUSIONAL_MAX_BODY_BYTES:
+        return jsonify({"success": False,
+                        "error": f"Request body too large (max {DELUSIONAL_MAX_BODY_BYTES} bytes)"}), 413
+    body = request.stream.read(DELUSIONAL_MAX_BODY_BYTES + 1)
+    if len(body) > DELUSIONAL_MAX_BODY_BYTES:
+        return jsonify({"success": False,
+                        "error": f"Request body too large (max {DELUSIONAL_MAX_BODY_BYTES} bytes)"}), 413
+    try:
+        body = body.strip()
+        rows = json.loads(body) if body.startswith(b"[") else list(read_rows(body.split(b"\n")))
+    except ValueError as e:
+        return jsonify({"success": False, "error": f"Invalid assessment rows: {str(e)}"}), 400
+    if not isinstance(rows, list):
+        return jsonify({"success": False, "error": "Body must be a JSON array or JSONL of assessment rows"}), 400
+
+    if mode == "rebuild":
+        results = delusional_scores.rebuild(rows)
+        updated = sum(1 for result in results.values() if result is not None)
+    else:
+        updated = sum(1 for row in rows if delusional_scores.add(row) is not None)
+    logger.info(f"Delusional score feed took {len(rows)} rows", extra={"mode": mode})
+    return jsonify({
+        "success": True,
+        "mode": mode,
+        "rows": len(rows),
+        "scored": updated,
+        "timestamp": datetime.datetime.now().isoformat()
+    }), 200
+
 @app.route('/api/chapters', methods=['GET'])
 def get_all_chapters():
     """Get all available book chapters"""
     try:
         chapters = []
-        for category, content in BOOK_CHAPTERS.items():
+        pack = content_store.current
+        for category, content in pack.chapters.items():
             chapters.append({
                 "category": category,
                 "chapter_title": content["chapter_title"],
@@ -371,6 +1285,7 @@ def get_all_chapters():
             "success": True,
             "chapters": chapters,
             "total_chapters": len(chapters),
+            "content_version": pack.version,
             "timestamp": datetime.datetime.now().isoformat()
         }), 200
         
@@ -392,12 +1307,22 @@ def root():
         "description": "Hybrid system: AI responses with book chapter fallback",
         "endpoints": {
             "health": "/health",
+            "ready": "/ready",
             "chat": "/api/chat",
+            "chat_jobs": "/api/chat/jobs",
+            "chat_socket": "/ws/chat" if CHAT_SOCKET_ENABLED else None,
+            "conversations": "/api/conversations/<conversation_id>",
+            "metrics": "/metrics",
             "recommendation": "/api/recommendation",
+            "score_percentiles": "/api/analytics/percentiles",
+            "score_distribution": "/api/analytics/distribution",
+            "compatibility_batch": "/api/compatibility/batch",
+            "delusional_score": "/api/delusional-score",
+            "delusional_assessments": "/api/delusional-score/assessments",
             "chapters": "/api/chapters"
         },
         "features": {
-            "ai_enabled": bool(os.environ.get("OPENAI_API_KEY")),
+            "ai_enabled": llm_router.enabled,
             "fallback_system": "book_chapters",
             "response_types": ["ai_generated", "book_fallback"]
         },
@@ -0,0 +1,57 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+from typing import Any, Dict, Optional
+
+
+class AuthError(Exception):
+    """A missing, malformed, expired or wrongly signed access token"""
+
+
+def _b64url_decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def verify_access_token(token: str, secret: str, audience: str = "authenticated", leeway: float = 30.0) -> Dict[str, Any]:
+    """Check a Supabase access token (an HS256 JWT signed with the project's JWT secret).
+
+    Returns the token's claims; the user id is in "sub".
+    """
+    if not token:
+        raise AuthError("Access token required")
+    try:
+        header_segment, payload_segment, signature_segment = token.split(".")
+        header = json.loads(_b64url_decode(header_segment))
+        signature = _b64url_decode(signature_segment)
+    except ValueError:
+        raise AuthError("Malformed access token")
+    if not isinstance(header, dict) or header.get("alg") != "HS256":
+        raise AuthError("Unsupported access token algorithm")
+
+    expected = hmac.new(secret.encode("utf-8"), f"{header_segment}.{payload_segment}".encode("utf-8"),
+                        hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        raise AuthError("Invalid access token signature")
+
+    try:
+        claims = json.loads(_b64url_decode(payload_segment))
+    except ValueError:
+        raise AuthError("Malformed access token")
+    if not isinstance(claims, dict) or not claims.get("sub"):
+        raise AuthError("Access token has no subject")
+    if not isinstance(claims.get("exp"), (int, float)) or claims["exp"] + leeway < time.time():
+        raise AuthError("Access token expired")
+    token_audience = claims.get("aud")
+    audiences = token_audience if isinstance(token_audience, list) else [token_audience]
+    if audience and audience not in audiences:
+        raise AuthError("Access token is for another audience")
+    return claims
+
+
+def token_subscription_tier(claims: Dict[str, Any]) -> Optional[str]:
+    """Subscription tier set in app_metadata by the project's access token hook, if any"""
+    app_metadata = claims.get("app_metadata")
+    tier = app_metadata.get("subscription_tier") if isinstance(app_metadata, dict) else None
+    return tier if isinstance(tier, str) else None
@@ -0,0 +1,185 @@
+"""
+Brownout: degrade chat answers step by step while /api/chat latency is over
+its SLO, instead of running at full cost until calls fail.
+
+Levels, each including the ones before it:
+    0 normal
+    1 short_replies    lower max_tokens
+    2 lean_prompt      no conversation history, summary or book context in the prompt
+    3 fast_model       every call goes to the fast (cheaper) model tier
+    4 fallback_only    no model call; book chapter answers only
+
+The controller keeps the latencies of recent chat requests. When their p95
+is over the SLO it moves down one level, at most once per step_down_seconds.
+It moves back up one level only once the p95 is under recover_ratio x SLO
+(or traffic is too thin to judge) and step_up_seconds have passed, so it
+does not flap around the threshold. After every change the window starts
+afresh, so the next decision is based on requests served at the new level.
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("brownout")
+
+LEVEL_NAMES = ("normal", "short_replies", "lean_prompt", "fast_model", "fallback_only")
+SHORT_REPLIES, LEAN_PROMPT, FAST_MODEL, FALLBACK_ONLY = 1, 2, 3, 4
+
+
+class Degradation:
+    """What a request may use at one brownout level"""
+
+    __slots__ = ("level", "name", "max_tokens", "drop_context", "fast_model", "fallback_only")
+
+    def __init__(self, level: int, max_tokens: int):
+        self.level = level
+        self.name = LEVEL_NAMES[level]
+        self.max_tokens = max_tokens
+        self.drop_context = level >= LEAN_PROMPT
+        self.fast_model = level >= FAST_MODEL
+        self.fallback_only = level >= FALLBACK_ONLY
+
+
+class BrownoutController:
+    """Sets the brownout level from the rolling p95 of observed chat latencies.
+
+    slo_ms <= 0 disables it: the level stays normal and observe() does nothing.
+    max_level caps how far it may degrade; pin() holds a level until unpinned.
+    """
+
+    def __init__(self, slo_ms: float = 0, window_seconds: float = 60, min_samples: int = 20,
+                 recover_ratio: float = 0.7, step_down_seconds: float = 10, step_up_seconds: float = 30,
+                 max_tokens: int = 500, reduced_max_tokens: int = 200, max_level: int = FALLBACK_ONLY,
+                 evaluate_interval: float = 1.0, max_samples: int = 5000):
+        self.slo_ms = slo_ms
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self.recover_ratio = recover_ratio
+        self.step_down_seconds = step_down_seconds
+        self.step_up_seconds = step_up_seconds
+        self.max_level = min(max(max_level, 0), FALLBACK_ONLY)
+        self.evaluate_interval = evaluate_interval
+        self.levels = [Degradation(level, max_tokens if level < SHORT_REPLIES else reduced_max_tokens)
+                       for level in range(len(LEVEL_NAMES))]
+        self._lock = threading.Lock()
+        self._samples: "collections.deque[tuple]" = collections.deque(maxlen=max_samples)
+        self._current = self.levels[0]
+        self._pinned = False
+        now = time.monotonic()
+        self._changed_at = now
+        self._evaluated_at = now
+        self._last_p95_ms: Optional[float] = None
+        self._seconds_at_level = [0.0] * len(LEVEL_NAMES)
+        self._transitions: "collections.deque[Dict[str, Any]]" = collections.deque(maxlen=20)
+        self._counters = {"steps_down": 0, "steps_up": 0, "observed": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.slo_ms > 0
+
+    def current(self) -> Degradation:
+        """The level to serve the next request at"""
+        return self._current
+
+    def observe(self, latency_seconds: float) -> None:
+        """Record one chat request's latency and re-evaluate the level at most every evaluate_interval"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, latency_seconds * 1000))
+            self._counters["observed"] += 1
+            if now - self._evaluated_at >= self.evaluate_interval:
+                self._evaluate(now)
+
+    def pin(self, level: Optional[int]) -> Degradation:
+        """Hold a level regardless of latency (an operator override), or None to resume automatic control"""
+        with self._lock:
+            now = time.monotonic()
+            if level is None:
+                self._pinned = False
+                logger.info("🟢 Brownout control back to automatic")
+            else:
+                self._pinned = True
+                self._set_level(min(max(level, 0), FALLBACK_ONLY), now, "pinned")
+            return self._current
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            seconds_at_level = list(self._seconds_at_level)
+            seconds_at_level[self._current.level] += now - self._changed_at
+            return {
+                "enabled": self.enabled,
+                "level": self._current.level,
+                "name": self._current.name,
+                "pinned": self._pinned,
+                "slo_ms": self.slo_ms,
+                "p95_ms": self._last_p95_ms,
+                "samples": len(self._samples),
+                "max_level": self.max_level,
+                "max_tokens": self._current.max_tokens,
+                "seconds_at_level": {name: round(seconds, 1) for name, seconds in zip(LEVEL_NAMES, seconds_at_level)},
+                "transitions": list(self._transitions),
+                **self._counters,
+            }
+
+    def _evaluate(self, now: float) -> None:
+        # Caller must hold self._lock
+        self._evaluated_at = now
+        cutoff = now - self.window_seconds
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        if self._pinned:
+            return
+        level = self._current.level
+        since_change = now - self._changed_at
+        if len(self._samples) < self.min_samples:
+            self._last_p95_ms = None
+            # Too little traffic to be under pressure
+            if level > 0 and since_change >= max(self.step_up_seconds, self.window_seconds):
+                self._set_level(level - 1, now, "quiet")
+            return
+        latencies = sorted(latency for _, latency in self._samples)
+        p95 = latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)]
+        self._last_p95_ms = round(p95, 1)
+        if p95 > self.slo_ms and level < self.max_level and since_change >= self.step_down_seconds:
+            self._set_level(level + 1, now, f"p95 {p95:.0f}ms over {self.slo_ms:.0f}ms")
+        elif p95 < self.slo_ms * self.recover_ratio and level > 0 and since_change >= self.step_up_seconds:
+            self._set_level(level - 1, now, f"p95 {p95:.0f}ms recovered")
+
+    def _set_level(self, level: int, now: float, reason: str) -> None:
+        # Caller must hold self._lock
+        previous = self._current.level
+        if level == previous:
+            return
+        self._seconds_at_level[previous] += now - self._changed_at
+        self._current = self.levels[level]
+        self._changed_at = now
+        self._samples.clear()
+        self._counters["steps_down" if level > previous else "steps_up"] += 1
+        self._transitions.append({"at": round(time.time(), 1), "from": LEVEL_NAMES[previous],
+                                  "to": LEVEL_NAMES[level], "reason": reason})
+        if level > previous:
+            logger.warning(f"⚠️ Brownout level {level} ({LEVEL_NAMES[level]}): {reason}")
+        else:
+            logger.info(f"🟢 Brownout level {level} ({LEVEL_NAMES[level]}): {reason}")
+
+
+def build_brownout_from_env(max_tokens: int) -> BrownoutController:
+    """Brownout controller configured from AI_BROWNOUT_* (off unless AI_BROWNOUT_SLO_MS is set)"""
+    return BrownoutController(
+        slo_ms=float(os.environ.get("AI_BROWNOUT_SLO_MS", "0")),
+        window_seconds=float(os.environ.get("AI_BROWNOUT_WINDOW_SECONDS", "60")),
+        min_samples=int(os.environ.get("AI_BROWNOUT_MIN_SAMPLES", "20")),
+        recover_ratio=float(os.environ.get("AI_BROWNOUT_RECOVER_RATIO", "0.7")),
+        step_down_seconds=float(os.environ.get("AI_BROWNOUT_STEP_DOWN_SECONDS", "10")),
+        step_up_seconds=float(os.environ.get("AI_BROWNOUT_STEP_UP_SECONDS", "30")),
+        max_tokens=max_tokens,
+        reduced_max_tokens=int(os.environ.get("AI_BROWNOUT_MAX_TOKENS", "200")),
+        max_level=int(os.environ.get("AI_BROWNOUT_MAX_LEVEL", str(FALLBACK_ONLY)))
+    )
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Precompute AI insights for many users from a JSONL export, e.g. overnight:
+
+    python bulk_insights.py users.jsonl insights.jsonl --workers 4 --rpm 120
+
+Each input line is one user, with the same user_context the chat endpoint takes:
+
+    {"user_id": "u1", "user_context": {"profile": {...}, "assessment_scores": {...}}}
+
+Results are appended to the output file as they finish, one JSON object per
+line. The output doubles as the checkpoint: rerunning with the same output
+file skips users that already have an insight and retries the ones that
+failed, so the latest line per user_id is the one to serve.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional, Set, Tuple
+
+from retry import retry_after_seconds
+from token_ledger import QuotaExceeded
+from validation import ValidationError, decode_user_context
+
+logger = logging.getLogger("bulk_insights")
+
+DEFAULT_QUESTION = ("Based on my profile and assessment scores, what are the most important insights "
+                    "about my relationship patterns, and what should I work on next?")
+
+
+class RateLimiter:
+    """Spaces model calls to a requests-per-minute ceiling shared by all workers.
+
+    A rate-limit error pauses every worker (for Retry-After when given) and
+    widens the spacing; each success narrows it back toward the configured rate.
+    """
+
+    def __init__(self, rpm: float, max_pause: float = 60.0):
+        self.base_interval = 60.0 / rpm if rpm > 0 else 0.0
+        self.interval = self.base_interval
+        self.max_pause = max_pause
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def rate_limited(self, retry_after: Optional[float], attempt: int) -> None:
+        pause = min(self.max_pause, retry_after if retry_after is not None else 2.0 ** attempt)
+        with self._lock:
+            self.interval = max(self.interval * 1.5, 0.1)
+            self._next_slot = max(self._next_slot, time.monotonic() + pause)
+
+    def succeeded(self) -> None:
+        with self._lock:
+            self.interval = max(self.base_interval, self.interval * 0.95)
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    # The service's own token quota pauses the run the same way an upstream 429 does
+    return isinstance(error, QuotaExceeded) or getattr(error, "status_code", None) == 429
+
+
+def read_users(path: str) -> Iterator[Tuple[str, Any]]:
+    """Stream (user_key, record) pairs; lines without a user_id are keyed by line number"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield f"line:{line_no}", None
+                continue
+            user_id = record.get("user_id") if isinstance(record, dict) else None
+            yield (str(user_id) if user_id is not None else f"line:{line_no}"), record
+
+
+def completed_users(output_path: str) -> Set[str]:
+    """Users that already have an insight in a previous run's output"""
+    done: Set[str] = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by an interrupted run
+            if result.get("status") == "ok":
+                done.add(result["user_id"])
+            else:
+                done.discard(result.get("user_id"))
+    return done
+
+
+class BulkInsightRunner:
+    """Generates insights through a bounded worker pool and streams them to JSONL"""
+
+    def __init__(self, generate: Callable[[Dict[str, Any], str], Tuple[str, str]], output_path: str,
+                 workers: int = 4, limiter: Optional[RateLimiter] = None, max_attempts: int = 5,
+                 question: str = DEFAULT_QUESTION, fsync_every: int = 50):
+        self.generate = generate
+        self.output_path = output_path
+        self.workers = workers
+        self.limiter = limiter or RateLimiter(0)
+        self.max_attempts = max_attempts
+        self.question = question
+        self.fsync_every = fsync_every
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.counters = {"read": 0, "skipped": 0, "ok": 0, "failed": 0, "rate_limited": 0}
+
+    def run(self, users: Iterator[Tuple[str, Any]], done: Set[str]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        with open(self.output_path, "a", encoding="utf-8") as out, \
+                ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="insight") as pool:
+            try:
+                for user_key, record in users:
+                    self.counters["read"] += 1
+                    if user_key in done:
+                        self.counters["skipped"] += 1
+                        continue
+                    # Read ahead at most two records per worker, so memory stays flat on huge exports
+                    self._slots.acquire()
+                    pool.submit(self._process, out, user_key, record)
+            except KeyboardInterrupt:
+                logger.warning("Interrupted, finishing in-flight users; rerun to resume")
+                self._stop.set()
+                pool.shutdown(wait=True, cancel_futures=True)
+            finally:
+                pool.shutdown(wait=True)
+                out.flush()
+                os.fsync(out.fileno())
+        return {**self.counters, "seconds": round(time.perf_counter() - started, 1)}
+
+    def _process(self, out, user_key: str, record: Any) -> None:
+        try:
+            result = self._generate_one(user_key, record)
+            self._write(out, result)
+        except Exception as e:
+            logger.error(f"❌ Insight for {user_key} failed: {str(e)}")
+            self._write(out, {"user_id": user_key, "status": "failed", "error": str(e)})
+        finally:
+            self._slots.release()
+
+    def _generate_one(self, user_key: str, record: Any) -> Dict[str, Any]:
+        if not isinstance(record, dict):
+            return {"user_id": user_key, "status": "failed", "error": "Line is not a JSON object"}
+        try:
+            user_context = decode_user_context(record.get("user_context", record))
+        except ValidationError as e:
+            return {"user_id": user_key, "status": "failed", "error": str(e)}
+
+        for attempt in range(1, self.max_attempts + 1):
+            if self._stop.is_set():
+                return {"user_id": user_key, "status": "failed", "error": "Interrupted", "attempts": attempt - 1}
+            self.limiter.acquire()
+            try:
+                insight, content_version = self.generate(user_context, self.question)
+            except Exception as e:
+                cause = e.__cause__ or e
+                if is_rate_limited(cause) and attempt < self.max_attempts:
+                    with self._write_lock:
+                        self.counters["rate_limited"] += 1
+                    self.limiter.rate_limited(
+                        cause.retry_after if isinstance(cause, QuotaExceeded) else retry_after_seconds(cause), attempt)
+                    continue
+                return {"user_id": user_key, "status": "failed", "error": str(e), "attempts": attempt}
+            self.limiter.succeeded()
+            return {
+                "user_id": user_key,
+                "status": "ok",
+                "insight": insight,
+                "question": self.question,
+                "content_version": content_version,
+                "attempts": attempt,
+                "generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            }
+        return {"user_id": user_key, "status": "failed", "error": "Rate limited", "attempts": self.max_attempts}
+
+    def _write(self, out, result: Dict[str, Any]) -> None:
+        line = json.dumps(result, ensure_ascii=False) + "\n"
+        with self._write_lock:
+            out.write(line)
+            out.flush()
+            self.counters[result["status"]] += 1
+            written = self.counters["ok"] + self.counters["failed"]
+            if written % self.fsync_every == 0:
+                os.fsync(out.fileno())
+                logger.info("Progress: %d ok, %d failed, %d skipped", self.counters["ok"],
+                            self.counters["failed"], self.counters["skipped"])
+
+
+def service_generator(request_timeout: float) -> Callable[[Dict[str, Any], str], Tuple[str, str]]:
+    """Generate with the service's own retrieval, prompt and model routing"""
+    import app  # Deferred: importing the service configures logging and model clients
+    from retry import Deadline
+
+    if not app.llm_router.enabled:
+        raise SystemExit("No model endpoint configured (set OPENAI_API_KEY or AI_LLM_ENDPOINTS)")
+
+    def generate(user_context: Dict[str, Any], question: str) -> Tuple[str, str]:
+        content = app.content_store.current
+        insight = app.generate_ai_response(question, user_context, [], "", Deadline(request_timeout), content,
+                                           source="bulk")
+        return insight, content.version
+
+    return generate
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precompute AI insights from a JSONL export of users")
+    parser.add_argument("input", help="JSONL file, one user per line")
+    parser.add_argument("output", help="JSONL results; appended to, and used to resume")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent model calls")
+    parser.add_argument("--rpm", type=float, default=0, help="Requests per minute ceiling (0 = unlimited)")
+    parser.add_argument("--max-attempts", type=int, default=5, help="Attempts per user when rate limited")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds per user, including router retries")
+    parser.add_argument("--question", default=DEFAULT_QUESTION)
+    args = parser.parse_args()
+
+    runner = BulkInsightRunner(
+        generate=service_generator(args.timeout),
+        output_path=args.output,
+        workers=args.workers,
+        limiter=RateLimiter(args.rpm),
+        max_attempts=args.max_attempts,
+        question=args.question
+    )
+    done = completed_users(args.output)
+    if done:
+        logger.info("Resuming: %d users already have insights", len(done))
+    summary = runner.run(read_users(args.input), done)
+    print(json.dumps(summary))
+    sys.exit(0 if summary["failed"] == 0 else 1)
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Batch partner compatibility, with the formula of the per-relationship paths:
+
+    python compatibility.py pairs.jsonl results.jsonl --mode edge --batch-size 2048
+    python compatibility.py --synthetic 100000 --compare
+
+Each input line is one relationship, with both partners' latest
+assessment_history.category_scores:
+
+    {"relationship_id": "r1",
+     "user1_category_scores": [{"category": "Communication", "percentage": 72}, ...],
+     "user2_category_scores": [...]}
+
+"edge" mode reproduces supabase/functions/create-compatibility-score (the
+row it upserts into compatibility_scores, recommendations included);
+"client" mode reproduces calculateCompatibilityScores in
+src/lib/compatibility.ts. Results are written one line per relationship as
+each batch finishes. --compare also runs every pair through the one-pair
+path and checks that both give identical output.
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("compatibility")
+
+MODE_EDGE = "edge"
+MODE_CLIENT = "client"
+MODES = (MODE_EDGE, MODE_CLIENT)
+
+# Categories below this match get a suggestion in edge mode
+RECOMMENDATION_THRESHOLD = 70
+
+
+class CompatibilityError(Exception):
+    """A pair the per-relationship path would refuse to score"""
+
+
+_NUMBER_TYPES = (int, float)
+
+
+def _js_number(value: float) -> Any:
+    """A float as JSON.stringify would write it: integral values without ".0", NaN as null"""
+    if math.isnan(value):
+        return None
+    if value.is_integer() and abs(value) < 1e21:
+        return int(value)
+    return value
+
+
+def _json_numbers(values: np.ndarray) -> List[str]:
+    """JSON text of _js_number for every value of a 1-D array, in one json.dumps call"""
+    if not len(values):
+        return []
+    with np.errstate(invalid="ignore"):
+        integral = np.isfinite(values) & (np.abs(values) < 1e21) & (values == np.trunc(values))
+    converted = values.astype(object)
+    converted[integral] = values[integral].astype(np.int64).tolist()
+    converted[np.isnan(values)] = None
+    return json.dumps(converted.tolist())[1:-1].split(", ")
+
+
+def category_entries(category_scores: Any, mode: str) -> List[Tuple[str, float]]:
+    """(category, percentage) pairs in input order, validated and named the way `mode` does"""
+    if not isinstance(category_scores, list):
+        raise CompatibilityError("category_scores must be an array")
+    entries = []
+    edge = mode == MODE_EDGE
+    for entry in category_scores:
+        if type(entry) is not dict:
+            continue
+        category = entry.get("category")
+        if type(category) is not str:
+            continue
+        percentage = entry.get("percentage")
+        # type() rather than isinstance(): booleans are not numbers here
+        if edge:
+            # Number.isFinite, and 0-100 only
+            if type(percentage) in _NUMBER_TYPES and 0 <= percentage <= 100:
+                entries.append((category.strip().lower(), float(percentage)))
+        else:
+            # The app only writes numbers here; anything else is taken as NaN (the browser would
+            # coerce booleans and numeric strings) and comes out as null
+            entries.append((category, float(percentage) if type(percentage) in _NUMBER_TYPES else math.nan))
+    return entries
+
+
+def _result(per_category: List[Dict[str, Any]], overall: Any, mode: str) -> Dict[str, Any]:
+    result: Dict[str, Any] = {
+        "category_scores": per_category,
+        "overall_score": overall,
+        "overall_percentage": overall,
+    }
+    if mode == MODE_EDGE:
+        result["recommendations"] = [_recommendation(c["category"]) for c in per_category
+                                     if c["match_percentage"] < RECOMMENDATION_THRESHOLD]
+    return result
+
+
+def _recommendation(category: str) -> Dict[str, str]:
+    return {"category": category,
+            "suggestion": f"Your views differ the most in {category}. Try the guided exercise in that module together."}
+
+
+def _category_result(category: str, score1: float, score2: float, match: float, mode: str) -> Dict[str, Any]:
+    if mode == MODE_EDGE:
+        return {"category": category, "user1_score": _js_number(score1), "user2_score": _js_number(score2),
+                "compatibility_score": _js_number(match), "compatibility_percentage": _js_number(match),
+                "match_percentage": _js_number(match)}
+    return {"category": category, "user1_score": _js_number(score1), "user2_score": _js_number(score2),
+            "normalized_user1": _js_number(score1 / 50), "normalized_user2": _js_number(score2 / 50),
+            "match_percentage": _js_number(match)}
+
+
+def _check_entries(user1: List[Tuple[str, float]], user2: List[Tuple[str, float]], mode: str) -> None:
+    if mode == MODE_EDGE and (not user1 or not user2):
+        raise CompatibilityError("Invalid or empty category scores")
+
+
+def compatibility_pair(user1_scores: Any, user2_scores: Any, mode: str = MODE_EDGE) -> Dict[str, Any]:
+    """One relationship, computed the way the per-call paths do it (the reference for the batch path)"""
+    user1 = category_entries(user1_scores, mode)
+    user2 = category_entries(user2_scores, mode)
+    _check_entries(user1, user2, mode)
+    categories = list(dict.fromkeys([category for category, _ in user1] + [category for category, _ in user2]))
+
+    per_category = []
+    matches = []
+    for category in categories:
+        # Array.find: the first entry for a category wins
+        score1 = next((score for name, score in user1 if name == category), None)
+        score2 = next((score for name, score in user2 if name == category), None)
+        if score1 is None or score2 is None:
+            continue
+        match = max(0.0, 100 - abs(score1 - score2)) if not math.isnan(score1 - score2) else math.nan
+        matches.append(match)
+        per_category.append(_category_result(category, score1, score2, match, mode))
+
+    if mode == MODE_EDGE and not per_category:
+        raise CompatibilityError("No matching categories found")
+    total = 0.0
+    for match in matches:
+        total += match
+    overall = total / len(matches) if matches else math.nan
+    return _result(per_category, _js_number(overall), mode)
+
+
+class CompatibilityBatch:
+    """Scores many relationships at once with NumPy.
+
+    The categories both partners have are laid out flat, pair after pair,
+    so differences and matches for the whole batch are single array
+    operations. Overall means add each pair's matches in the pair's own
+    category order, one column of a (pairs x categories) matrix at a time,
+    so the floating point sums are the same as the per-pair loop's.
+    """
+
+    def __init__(self, mode: str = MODE_EDGE):
+        if mode not in MODES:
+            raise ValueError(f"Unknown compatibility mode {mode}")
+        self.mode = mode
+
+    def score(self, pairs: List[Tuple[Any, Any]]) -> List[str]:
+        """Results in input order, as JSON text ready to stream: a compatibility row per pair, or {"error": message}.
+
+        The text is what json.dumps would write for the one-pair result; numbers are formatted
+        for the whole batch at once, which is most of the saving over json.dumps per result.
+        """
+        names: List[str] = []
+        values1: List[float] = []
+        values2: List[float] = []
+        counts: List[int] = []
+        errors: Dict[int, str] = {}
+        for row, (user1_scores, user2_scores) in enumerate(pairs):
+            try:
+                user1 = category_entries(user1_scores, self.mode)
+                user2 = category_entries(user2_scores, self.mode)
+                _check_entries(user1, user2, self.mode)
+            except CompatibilityError as e:
+                errors[row] = str(e)
+                counts.append(0)
+                continue
+            # Array.find: the first entry for a category wins. Shared categories all appear in
+            # user1, so user1's order is their order in the union of both partners' categories.
+            first1 = dict(reversed(user1))
+            first2 = dict(reversed(user2))
+            shared = [category for category in dict.fromkeys(category for category, _ in user1) if category in first2]
+            names.extend(shared)
+            values1.extend(first1[category] for category in shared)
+            values2.extend(first2[category] for category in shared)
+            counts.append(len(shared))
+
+        scores1, scores2 = np.array(values1, dtype=float), np.array(values2, dtype=float)
+        count_array = np.array(counts, dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(count_array)))
+        # NaN only comes from client-mode non-numbers, and propagates as it does in the browser
+        with np.errstate(invalid="ignore", divide="ignore"):
+            matches = np.maximum(0.0, 100 - np.abs(scores1 - scores2))
+            rows = np.repeat(np.arange(len(pairs)), count_array)
+            by_position = np.zeros((len(pairs), int(count_array.max(initial=0))))
+            by_position[rows, np.arange(len(names)) - offsets[rows]] = matches
+            totals = np.zeros(len(pairs))
+            for position in range(by_position.shape[1]):
+                totals += by_position[:, position]
+            overall = totals / count_array
+
+        user1_texts, user2_texts = _json_numbers(scores1), _json_numbers(scores2)
+        match_texts, overall_texts = _json_numbers(matches), _json_numbers(overall)
+        edge = self.mode == MODE_EDGE
+        if edge:
+            needs_work = (matches < RECOMMENDATION_THRESHOLD).tolist()
+        else:
+            normalized1, normalized2 = _json_numbers(scores1 / 50), _json_numbers(scores2 / 50)
+        # Category names repeat across pairs; each is JSON-encoded once per batch
+        name_texts = {name: json.dumps(name) for name in set(names)}
+        recommendation_texts = {name: json.dumps(_recommendation(name)) for name in name_texts} if edge else {}
+        bounds = offsets.tolist()
+        results: List[str] = []
+        for row, count in enumerate(counts):
+            if row in errors:
+                results.append(json.dumps({"error": errors[row]}))
+                continue
+            if edge and not count:
+                results.append(json.dumps({"error": "No matching categories found"}))
+                continue
+            span = range(bounds[row], bounds[row + 1])
+            overall_text = overall_texts[row]
+            if edge:
+                per_category = ", ".join(
+                    f'{{"category": {name_texts[names[i]]}, "user1_score": {user1_texts[i]}, '
+                    f'"user2_score": {user2_texts[i]}, "compatibility_score": {match_texts[i]}, '
+                    f'"compatibility_percentage": {match_texts[i]}, "match_percentage": {match_texts[i]}}}'
+                    for i in span)
+                recommendations = ", ".join(recommendation_texts[names[i]] for i in span if needs_work[i])
+                results.append(f'{{"category_scores": [{per_category}], "overall_score": {overall_text}, '
+                               f'"overall_percentage": {overall_text}, "recommendations": [{recommendations}]}}')
+            else:
+                per_category = ", ".join(
+                    f'{{"category": {name_texts[names[i]]}, "user1_score": {user1_texts[i]}, '
+                    f'"user2_score": {user2_texts[i]}, "normalized_user1": {normalized1[i]}, '
+                    f'"normalized_user2": {normalized2[i]}, "match_percentage": {match_texts[i]}}}'
+                    for i in span)
+                results.append(f'{{"category_scores": [{per_category}], "overall_score": {overall_text}, '
+                               f'"overall_percentage": {overall_text}}}')
+        return results
+
+
+def read_pairs(lines: Iterable[Any]) -> Iterator[Dict[str, Any]]:
+    """Parse JSONL relationship lines; unusable lines come back as {"line", "error"}"""
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield {"line": number, "error": "Line is not valid JSON"}
+            continue
+        if not isinstance(record, dict):
+            yield {"line": number, "error": "Line must be a JSON object"}
+            continue
+        yield record
+
+
+def score_stream(records: Iterable[Dict[str, Any]], mode: str = MODE_EDGE,
+                 batch_size: int = 2048) -> Iterator[str]:
+    """Score relationships batch by batch, yielding one JSON line per record in input order"""
+    batch = CompatibilityBatch(mode)
+    pending: List[Dict[str, Any]] = []
+
+    def flush() -> Iterator[str]:
+        scorable = [record for record in pending if "error" not in record]
+        scored = iter(batch.score([(record.get("user1_category_scores"), record.get("user2_category_scores"))
+                                   for record in scorable]))
+        for record in pending:
+            if "error" in record:
+                yield json.dumps(record) + "\n"
+            else:
+                yield f'{{"relationship_id": {json.dumps(record.get("relationship_id"))}, {next(scored)[1:]}\n'
+        pending.clear()
+
+    for record in records:
+        pending.append(record)
+        if len(pending) >= batch_size:
+            yield from flush()
+    yield from flush()
+
+
+def synthetic_pairs(count: int, seed: int = 7) -> List[Dict[str, Any]]:
+    """Random relationships shaped like real assessment_history rows, for benchmarking"""
+    rng = random.Random(seed)
+    categories = ["Communication", "Trust", "Emotional Intelligence", "Financial Responsibility",
+                  "Family & Cultural Compatibility", "Conflict Resolution", "Intimacy", "Shared Values"]
+
+    def scores() -> List[Dict[str, Any]]:
+        picked = rng.sample(categories, rng.randint(5, len(categories)))
+        return [{"category": name, "percentage": rng.choice([rng.randint(0, 100), round(rng.random() * 100, 2)])}
+                for name in picked]
+
+    return [{"relationship_id": f"r{i}", "user1_category_scores": scores(), "user2_category_scores": scores()}
+            for i in range(count)]
+
+
+def compare(records: List[Dict[str, Any]], mode: str, batch_size: int) -> Dict[str, Any]:
+    """Throughput of the one-pair path against the batch path, and whether their outputs are identical"""
+    started = time.perf_counter()
+    one_by_one = []
+    for record in records:
+        if "error" in record:
+            one_by_one.append(json.dumps(record) + "\n")
+            continue
+        try:
+            result = compatibility_pair(record.get("user1_category_scores"), record.get("user2_category_scores"), mode)
+        except CompatibilityError as e:
+            result = {"error": str(e)}
+        one_by_one.append(json.dumps({"relationship_id": record.get("relationship_id"), **result}) + "\n")
+    per_pair_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched = list(score_stream(records, mode, batch_size))
+    batch_seconds = time.perf_counter() - started
+
+    mismatches = sum(1 for a, b in zip(one_by_one, batched) if a != b)
+    return {
+        "pairs": len(records),
+        "mode": mode,
+        "identical": mismatches == 0 and len(one_by_one) == len(batched),
+        "mismatches": mismatches,
+        "per_pair_per_second": round(len(records) / per_pair_seconds),
+        "batch_per_second": round(len(records) / batch_seconds),
+        "speedup": round(per_pair_seconds / batch_seconds, 2),
+    }
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Compute partner compatibility for many relationships at once")
+    parser.add_argument("input", nargs="?", help="JSONL file, one relationship per line ('-' for stdin)")
+    parser.add_argument("output", nargs="?", default="-", help="JSONL results ('-' for stdout)")
+    parser.add_argument("--mode", choices=MODES, default=MODE_EDGE,
+                        help="edge: create-compatibility-score function; client: src/lib/compatibility.ts")
+    parser.add_argument("--batch-size", type=int, default=2048, help="Relationships per vectorized batch")
+    parser.add_argument("--synthetic", type=int, default=0, help="Score this many random relationships instead")
+    parser.add_argument("--compare", action="store_true",
+                        help="Also run the one-pair path; report throughput and check outputs match")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        records = synthetic_pairs(args.synthetic)
+    elif args.input:
+        source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+        records = list(read_pairs(source)) if args.compare else read_pairs(source)
+    else:
+        parser.error("an input file or --synthetic is required")
+
+    if args.compare:
+        summary = compare(list(records), args.mode, args.batch_size)
+        print(json.dumps(summary))
+        sys.exit(0 if summary["identical"] else 1)
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    written = 0
+    for line in score_stream(records, args.mode, args.batch_size):
+        out.write(line)
+        written += 1
+    out.flush()
+    logger.info("Scored %d relationships", written)
@@ -0,0 +1,14 @@
+"""
+pytest setup for the unit tests next to the service modules.
+
+The test_*_deployment.py and test_hybrid_system.py scripts check a running
+deployment over HTTP; run them directly (python test_hybrid_system.py), not
+under pytest.
+"""
+
+import os
+import sys
+
+collect_ignore = ["test_azure_deployment.py", "test_hybrid_system.py", "test_simple_deployment.py"]
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,229 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from context_selection import PrincipleChunks
+from index_snapshot import load_snapshot, write_snapshot
+from retrieval import RetrievalIndex
+from shared_index import attach_shared_index
+
+logger = logging.getLogger(__name__)
+
+CHAPTER_FIELDS = ("chapter_title", "chapter_excerpt", "recommendation_reason")
+
+DEFAULT_CONTENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "content", "book_chapters.json")
+DEFAULT_SNAPSHOT_DIR = os.path.join(tempfile.gettempdir(), "lovemirror-index")
+
+
+class ContentError(Exception):
+    """The content pack file is missing or malformed"""
+
+
+class ContentPack:
+    """One version of the book content together with its search index.
+
+    A pack is never modified after it is built; reloads produce a new pack,
+    so a request that took a reference keeps a consistent view throughout.
+    """
+
+    def __init__(self, version: str, chapters: Dict[str, Dict[str, str]], index: RetrievalIndex, digest: str):
+        self.version = version
+        self.chapters = chapters
+        self.index = index
+        self.digest = digest
+        self.loaded_at = time.time()
+
+    @property
+    def documents(self) -> List[Dict[str, str]]:
+        return self.index.documents
+
+    @functools.cached_property
+    def principles(self) -> PrincipleChunks:
+        """Principle-level chunks, split on first use and kept for this version"""
+        return PrincipleChunks(self.documents)
+
+
+def parse_content_pack(raw: bytes) -> Dict[str, Any]:
+    """Validate a content pack file: {"version": str, "chapters": {category: {title, excerpt, reason}}}"""
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        raise ContentError(f"Content pack is not valid JSON: {e}")
+    if not isinstance(data, dict) or not isinstance(data.get("version"), str) or not data["version"]:
+        raise ContentError("Content pack needs a non-empty string 'version'")
+    chapters = data.get("chapters")
+    if not isinstance(chapters, dict) or not chapters:
+        raise ContentError("Content pack needs a non-empty 'chapters' object")
+    for category, chapter in chapters.items():
+        missing = [f for f in CHAPTER_FIELDS if not isinstance(chapter, dict) or not isinstance(chapter.get(f), str)]
+        if missing:
+            raise ContentError(f"Chapter '{category}' is missing {', '.join(missing)}")
+    if "communication" not in chapters:
+        raise ContentError("Content pack needs a 'communication' chapter, the default recommendation")
+    return {"version": data["version"],
+            "chapters": {category: {f: chapter[f] for f in CHAPTER_FIELDS} for category, chapter in chapters.items()}}
+
+
+class ContentStore:
+    """Serves the current content pack and reloads it when its file changes.
+
+    The file is polled rather than watched with OS notifications so it works
+    the same on App Service mounts. A reload rebuilds only the index postings
+    of changed chapters, then swaps the new pack in with a single reference
+    assignment; listeners are told which chapters changed so they can drop
+    dependent cache entries. A malformed file is logged and ignored, leaving
+    the previous version active.
+
+    At startup the index is attached from the gunicorn master's shared memory
+    segment when there is one for this content. Otherwise, with a
+    snapshot_dir, the snapshot written for this content's hash is mapped
+    instead of building the index, and one is written when none matches, so
+    later workers and restarts skip the build.
+    """
+
+    def __init__(self, path: str = DEFAULT_CONTENT_PATH, poll_seconds: float = 5.0,
+                 snapshot_dir: Optional[str] = None):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.snapshot_dir = snapshot_dir
+        self.index_load: Dict[str, Any] = {}
+        self._listeners: List[Callable[[ContentPack, ContentPack, Set[str]], None]] = []
+        self._lock = threading.Lock()
+        self._file_state = self._stat()
+        self._counters = {"reloads": 0, "failed_reloads": 0, "chapters_changed": 0}
+        self.last_error: Optional[str] = None
+        self.current = self._build(self._read(), previous=None)[0]
+
+    def on_change(self, listener: Callable[[ContentPack, ContentPack, Set[str]], None]) -> None:
+        """Call listener(old_pack, new_pack, changed_categories) after every swap"""
+        self._listeners.append(listener)
+
+    def start(self) -> Optional[threading.Thread]:
+        """Watch the file in the background; a poll interval of 0 disables watching"""
+        if self.poll_seconds <= 0:
+            return None
+        thread = threading.Thread(target=self._watch_loop, name="content-watch", daemon=True)
+        thread.start()
+        return thread
+
+    def reload(self) -> bool:
+        """Load the file if it changed since the last load; returns True when a new version was swapped in"""
+        with self._lock:
+            file_state = self._stat()
+            if file_state == self._file_state:
+                return False
+            self._file_state = file_state
+            try:
+                raw = self._read()
+                if hashlib.sha256(raw).hexdigest() == self.current.digest:
+                    return False
+                old = self.current
+                new, changed = self._build(raw, previous=old)
+            except (ContentError, OSError) as e:
+                self._counters["failed_reloads"] += 1
+                self.last_error = str(e)
+                logger.error(f"❌ Content reload failed, keeping version {self.current.version}: {str(e)}")
+                return False
+            self.current = new
+            self.last_error = None
+            self._counters["reloads"] += 1
+            self._counters["chapters_changed"] += len(changed)
+
+        logger.info(f"✅ Content {old.version} -> {new.version}, changed chapters: {', '.join(sorted(changed)) or 'none'}")
+        for listener in self._listeners:
+            try:
+                listener(old, new, changed)
+            except Exception as e:
+                logger.error(f"❌ Content change listener failed: {str(e)}")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.current.version,
+            "chapters": len(self.current.chapters),
+            "loaded_at": self.current.loaded_at,
+            "path": self.path,
+            "last_error": self.last_error,
+            "index_load": self.index_load,
+            **self._counters,
+        }
+
+    def _build(self, raw: bytes, previous: Optional[ContentPack]):
+        data = parse_content_pack(raw)
+        chapters = data["chapters"]
+        documents = list(chapters.values())
+        digest = hashlib.sha256(raw).hexdigest()
+        if previous is None:
+            return ContentPack(data["version"], chapters, self._startup_index(documents, digest), digest), set()
+
+        changed = {category for category in chapters.keys() | previous.chapters.keys()
+                   if chapters.get(category) != previous.chapters.get(category)}
+        if list(chapters) == list(previous.chapters):
+            categories = list(chapters)
+            index = previous.index.rebuild(documents, [categories.index(category) for category in changed])
+        else:
+            # Chapters were added, removed or reordered, so document ids moved
+            index = RetrievalIndex(documents)
+        self._write_snapshot(index, digest)
+        return ContentPack(data["version"], chapters, index, digest), changed
+
+    def _startup_index(self, documents: List[Dict[str, str]], digest: str) -> RetrievalIndex:
+        start = time.perf_counter()
+        index = attach_shared_index(documents, digest)
+        source = "shared_memory"
+        if index is None and self.snapshot_dir:
+            index = load_snapshot(self.snapshot_dir, documents, digest)
+            source = "snapshot"
+        if index is None:
+            index = RetrievalIndex(documents)
+            source = "built"
+            self._write_snapshot(index, digest)
+        self.index_load = {"source": source, "ms": round((time.perf_counter() - start) * 1000, 3)}
+        logger.info(f"Retrieval index {source} in {self.index_load['ms']}ms")
+        return index
+
+    def _write_snapshot(self, index: RetrievalIndex, digest: str) -> None:
+        if not self.snapshot_dir:
+            return
+        try:
+            write_snapshot(self.snapshot_dir, index, digest)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not write index snapshot: {str(e)}")
+
+    def _read(self) -> bytes:
+        try:
+            with open(self.path, "rb") as f:
+                return f.read()
+        except OSError as e:
+            raise ContentError(f"Cannot read content pack {self.path}: {e}")
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def _watch_loop(self) -> None:
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"❌ Content watcher error: {str(e)}")
+
+
+def content_store_from_env() -> ContentStore:
+    """ContentStore for AI_CONTENT_PATH, polled every AI_CONTENT_POLL_SECONDS (0 disables),
+    with index snapshots in AI_INDEX_SNAPSHOT_DIR (empty disables)"""
+    return ContentStore(
+        path=os.environ.get("AI_CONTENT_PATH") or DEFAULT_CONTENT_PATH,
+        poll_seconds=float(os.environ.get("AI_CONTENT_POLL_SECONDS", "5")),
+        snapshot_dir=os.environ.get("AI_INDEX_SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR) or None
+    )
@@ -0,0 +1,179 @@
+import re
+import threading
+from typing import Any, Dict, List, Sequence, Tuple
+
+from summarizer import estimate_tokens
+
+_BULLET_RE = re.compile(r"^\s*[•\-*]\s+")
+_WORD_RE = re.compile(r"[a-z']{4,}")
+
+# Two principles from different chapters whose longer words overlap this much say the same thing
+DUPLICATE_SIMILARITY = 0.5
+
+
+class Principle:
+    """One "Key Principles" bullet, with its chapter's title and summary line"""
+
+    __slots__ = ("chapter", "text", "lower", "tokens", "words")
+
+    def __init__(self, chapter: int, text: str):
+        self.chapter = chapter
+        self.text = text
+        self.lower = text.lower()
+        self.tokens = estimate_tokens(f"• {text}")
+        self.words = frozenset(_WORD_RE.findall(self.lower))
+
+
+class ChapterPrinciples:
+    """A chapter split into principle chunks plus the header and summary they share"""
+
+    def __init__(self, chapter: int, doc: Dict[str, Any]):
+        self.chapter = chapter
+        self.title = doc['chapter_title']
+        self.excerpt = doc['chapter_excerpt']
+        self.principles: List[Principle] = []
+        self.summary = ""
+        for line in doc['chapter_excerpt'].splitlines():
+            if _BULLET_RE.match(line):
+                self.principles.append(Principle(chapter, _BULLET_RE.sub("", line).strip()))
+            elif line.strip().lower().startswith("remember:"):
+                self.summary = line.strip()
+        if not self.principles:
+            # Free-form chapter: the whole excerpt is its one chunk
+            self.principles.append(Principle(chapter, doc['chapter_excerpt'].strip()))
+        self.context_lower = f"{self.title} {self.summary}".lower()
+        # Title and summary lines are paid once per chapter, however many of its principles are picked
+        self.overhead_tokens = estimate_tokens(f"{self.title}\n{self.summary}")
+        self.excerpt_tokens = estimate_tokens(doc['chapter_excerpt'])
+
+    def render(self, picked: Sequence[Principle]) -> str:
+        lines = [self.title] + [f"• {p.text}" for p in picked]
+        if self.summary:
+            lines.append(self.summary)
+        return "\n".join(lines)
+
+
+class PrincipleChunks:
+    """Principle-level chunks of every chapter, with token counts computed once per content version"""
+
+    def __init__(self, documents: List[Dict[str, Any]]):
+        self.chapters = [ChapterPrinciples(chapter, doc) for chapter, doc in enumerate(documents)]
+
+
+class ContextSelector:
+    """Picks book context at principle level as a token-budgeted knapsack.
+
+    Candidate chapters come from the keyword index. Each principle scores one
+    point per query word (of four letters or more) it contains and half a point per query word in its
+    chapter's title or summary line. Near-duplicate principles from different
+    chapters are dropped in favour of the higher-scoring one, then the set
+    with the highest total score that fits the budget is chosen, charging
+    each chapter's title and summary once. When no principle scores (e.g. a
+    query with no word of four letters or more), the top candidate chapters
+    are used whole, as chapter retrieval would.
+    """
+
+    def __init__(self, token_budget: int = 200, candidate_chapters: int = 4, baseline_chunks: int = 2):
+        self.token_budget = token_budget
+        self.candidate_chapters = candidate_chapters
+        self.baseline_chunks = baseline_chunks
+        self._lock = threading.Lock()
+        self._counters = {"selections": 0, "selected_tokens": 0, "whole_chapter_tokens": 0, "duplicates_dropped": 0,
+                          "whole_chapter_fallbacks": 0}
+
+    def select(self, query: str, index: Any, chunks: PrincipleChunks) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+        """Return (context chunks for the prompt, token report against whole-chapter retrieval)"""
+        # Longer words only: "i", "how" or "my" match almost every principle
+        words = set(_WORD_RE.findall(query.lower()))
+        candidates = index.search_ids(query, max(self.candidate_chapters, self.baseline_chunks))
+        chapters = [chunks.chapters[doc_id] for doc_id in candidates]
+        whole_chapter_tokens = sum(chapter.excerpt_tokens for chapter in chapters[:self.baseline_chunks])
+
+        scored = []
+        for chapter in chapters:
+            context_hits = sum(1 for word in words if word in chapter.context_lower)
+            for principle in chapter.principles:
+                score = sum(1 for word in words if word in principle.lower) + 0.5 * context_hits
+                if score > 0:
+                    scored.append((score, principle))
+        scored.sort(key=lambda item: -item[0])
+
+        kept: List[Tuple[float, Principle]] = []
+        duplicates = 0
+        for score, principle in scored:
+            if any(other.chapter != principle.chapter and _similarity(other.words, principle.words) >= DUPLICATE_SIMILARITY
+                   for _, other in kept):
+                duplicates += 1
+                continue
+            kept.append((score, principle))
+
+        groups = []
+        for chapter in chapters:
+            items = [(p.tokens, score, (p,)) for score, p in kept if p.chapter == chapter.chapter]
+            if not items:
+                continue
+            # Best subsets of this chapter's principles, then the chapter's shared lines on top
+            frontier = _frontier([[(0, 0.0, ()), item] for item in items], self.token_budget - chapter.overhead_tokens)
+            groups.append([(0, 0.0, ())] + [(cost + chapter.overhead_tokens, value, ((chapter, picks),))
+                                            for cost, value, picks in frontier if picks])
+        # Highest total score; on ties the cheaper selection, which the frontier lists first
+        _, _, selection = max(_frontier(groups, self.token_budget), key=lambda state: state[1])
+
+        context = []
+        selected_tokens = 0
+        for chapter, picks in selection:
+            ordered = [p for p in chapter.principles if p in picks]
+            context.append({"chapter_title": chapter.title, "chapter_excerpt": chapter.render(ordered)})
+            selected_tokens += chapter.overhead_tokens + sum(p.tokens for p in ordered)
+        fallback = not context and bool(chapters)
+        if fallback:
+            context = [{"chapter_title": chapter.title, "chapter_excerpt": chapter.excerpt}
+                       for chapter in chapters[:self.baseline_chunks]]
+            selected_tokens = whole_chapter_tokens
+
+        report = {"selected_tokens": selected_tokens, "whole_chapter_tokens": whole_chapter_tokens,
+                  "saved_tokens": whole_chapter_tokens - selected_tokens}
+        with self._lock:
+            self._counters["selections"] += 1
+            # Savings only count against a baseline that had context to save on
+            if whole_chapter_tokens:
+                self._counters["selected_tokens"] += selected_tokens
+                self._counters["whole_chapter_tokens"] += whole_chapter_tokens
+            self._counters["duplicates_dropped"] += duplicates
+            self._counters["whole_chapter_fallbacks"] += 1 if fallback else 0
+        return context, report
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        counters["token_budget"] = self.token_budget
+        counters["saved_tokens"] = counters["whole_chapter_tokens"] - counters["selected_tokens"]
+        counters["saved_ratio"] = (round(counters["saved_tokens"] / counters["whole_chapter_tokens"], 3)
+                                   if counters["whole_chapter_tokens"] else 0.0)
+        return counters
+
+
+def _frontier(groups: List[List[Tuple[int, float, tuple]]], budget: int) -> List[Tuple[int, float, tuple]]:
+    """Exact knapsack over groups of alternative (cost, value, picks) options, one option taken
+    per group (each group offers an empty one); returns the Pareto-optimal combinations within budget"""
+    frontier: List[Tuple[int, float, tuple]] = [(0, 0.0, ())]
+    for options in groups:
+        merged: Dict[int, Tuple[float, tuple]] = {}
+        for cost, value, picks in frontier:
+            for option_cost, option_value, option_picks in options:
+                total = cost + option_cost
+                if total <= budget and (total not in merged or value + option_value > merged[total][0]):
+                    merged[total] = (value + option_value, picks + option_picks)
+        frontier, best = [], -1.0
+        for cost in sorted(merged):
+            value, picks = merged[cost]
+            if value > best:
+                frontier.append((cost, value, picks))
+                best = value
+    return frontier
+
+
+def _similarity(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+Delusional scores (self-assessment vs how others rated the user) for many users at once:
+
+    python delusional.py assessments.jsonl scores.jsonl
+    python delusional.py assessments.jsonl --compare
+
+Each input line is one assessment row, from assessment_history ("self") or
+external_assessment_results ("external"):
+
+    {"source": "external", "user_id": "u1", "assessment_type": "wife-material",
+     "completed_at": "2025-05-01T10:00:00Z", "category_scores": [{"category": ..., "percentage": ...}]}
+
+Output is one line per (user, assessment type) with both kinds of rows, in
+the shape calculateDelusionalScore (src/lib/delusionalScore.ts) returns.
+--compare also runs every user through a line-by-line port of that function,
+checks that both give identical results, and times single-assessment
+updates against recomputing the user.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("delusional")
+
+# Gap (percentage points) up to which a category or overall score gets each status
+SELF_AWARE_MAX_GAP = 10
+BLIND_SPOT_MAX_GAP = 25
+
+Key = Tuple[str, str]
+
+
+def gap_status(gap: float) -> str:
+    if gap <= SELF_AWARE_MAX_GAP:
+        return "self-aware"
+    if gap <= BLIND_SPOT_MAX_GAP:
+        return "blind-spot"
+    return "delusional"
+
+
+def completed_timestamp(value: Any) -> float:
+    """Sort key for completed_at; rows without a readable one sort oldest"""
+    if not isinstance(value, str):
+        return 0.0
+    try:
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def category_entries(category_scores: Any) -> List[Tuple[str, float]]:
+    """(category, percentage) pairs in row order; entries without a numeric percentage are ignored"""
+    if not isinstance(category_scores, list):
+        return []
+    return [(entry["category"], float(entry["percentage"])) for entry in category_scores
+            if type(entry) is dict and type(entry.get("category")) is str
+            and type(entry.get("percentage")) in (int, float)]
+
+
+def first_entries(entries: List[Tuple[str, float]]) -> Dict[str, float]:
+    """Array.find per category: the first entry for a category is the one that counts"""
+    return dict(reversed(entries))
+
+
+def delusional_score(self_assessments: List[Dict[str, Any]], external_results: List[Dict[str, Any]]
+                     ) -> Optional[Dict[str, Any]]:
+    """One user and assessment type, computed the way calculateDelusionalScore does it.
+
+    self_assessments and external_results are the user's rows of that type;
+    external_results in the order the browser fetches them (newest first).
+    """
+    if not self_assessments or not external_results:
+        return None
+    latest = max(completed_timestamp(row.get("completed_at")) for row in self_assessments)
+    self_row = next(row for row in self_assessments if completed_timestamp(row.get("completed_at")) == latest)
+
+    externals = [first_entries(category_entries(row.get("category_scores"))) for row in external_results]
+    category_gaps = []
+    for category, self_score in category_entries(self_row.get("category_scores")):
+        total, count = 0.0, 0
+        for external in externals:
+            if category in external:
+                total += external[category]
+                count += 1
+        if count > 0:
+            category_gaps.append(_category_gap(category, self_score, total / count))
+    return _result(category_gaps, len(external_results))
+
+
+def _category_gap(category: str, self_score: float, external_score: float) -> Dict[str, Any]:
+    gap = abs(self_score - external_score)
+    return {"category": category, "self_score": self_score, "external_score": external_score, "gap": gap,
+            "status": gap_status(gap)}
+
+
+def _result(category_gaps: List[Dict[str, Any]], external_count: int) -> Dict[str, Any]:
+    total = 0.0
+    for category_gap in category_gaps:
+        total += category_gap["gap"]
+    overall = total / len(category_gaps) if category_gaps else 0
+    return {"overall_score": overall, "status": gap_status(overall), "category_gaps": category_gaps,
+            "external_assessment_count": external_count}
+
+
+class _UserGaps:
+    """Running state for one user and assessment type: enough to redo the result in O(categories)"""
+
+    __slots__ = ("self_scores", "self_completed_at", "_sums", "_packed", "external_count", "result")
+
+    def __init__(self):
+        self.self_scores: List[Tuple[str, float]] = []
+        self.self_completed_at: Optional[float] = None
+        self._sums: Optional[Dict[str, List[float]]] = {}
+        # After rebuild(): (category names, group columns, sums, counts, start, end) in the batch's
+        # arrays, unpacked on first update
+        self._packed: Optional[Tuple[List[str], List[int], np.ndarray, np.ndarray, int, int]] = None
+        self.external_count = 0
+        self.result: Optional[Dict[str, Any]] = None
+
+    @property
+    def sums(self) -> Dict[str, List[float]]:
+        """category -> [sum of external percentages, number of external assessments rating it]"""
+        if self._packed is not None:
+            names, columns, sums, counts, start, end = self._packed
+            self._sums = {names[columns[group]]: [sums[group].item(), counts[group].item()]
+                          for group in range(start, end)}
+            self._packed = None
+        return self._sums
+
+    @sums.setter
+    def sums(self, value: Dict[str, List[float]]) -> None:
+        self._sums, self._packed = value, None
+
+    def render(self) -> Optional[Dict[str, Any]]:
+        if self.self_completed_at is None or not self.external_count:
+            return None
+        category_gaps = []
+        sums = self.sums
+        for category, self_score in self.self_scores:
+            running = sums.get(category)
+            if running is not None:
+                category_gaps.append(_category_gap(category, self_score, running[0] / running[1]))
+        return _result(category_gaps, self.external_count)
+
+
+def _sequential_sums(groups: np.ndarray, positions: np.ndarray, values: np.ndarray, group_count: int) -> np.ndarray:
+    """Per-group sums, each added in position order like a JS loop (so float results match it exactly).
+
+    Within one position every group appears at most once, so each step is a plain scatter-add.
+    """
+    sums = np.zeros(group_count)
+    order = np.lexsort((groups, positions))
+    positions, groups, values = positions[order], groups[order], values[order]
+    bounds = np.flatnonzero(np.diff(positions)) + 1
+    for start, end in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(positions)]))):
+        sums[groups[start:end]] += values[start:end]
+    return sums
+
+
+class DelusionalScores:
+    """Delusional scores for many users, built in one vectorized pass and then kept current.
+
+    rebuild() takes streamed assessment rows, groups every external rating by
+    (user, assessment type, category) and sums them with NumPy, newest first
+    as the browser does, then derives gaps and statuses for all users at
+    once. Per user it keeps the latest self-assessment and a running sum and
+    count per category, so add() folds a new external assessment (or a newer
+    self-assessment) into one user's result in O(categories). Running sums
+    add new ratings last rather than first, so after updates an average can
+    differ from a full rebuild in the last bit.
+
+    Holds at most max_users (user, assessment type) entries, least recently
+    updated evicted first. Optionally snapshots to disk.
+    """
+
+    def __init__(self, max_users: int = 200000, persist_path: Optional[str] = None, persist_interval: int = 300):
+        self.max_users = max_users
+        self.persist_path = persist_path
+        self.persist_interval = persist_interval
+        self._lock = threading.Lock()
+        self._users: "OrderedDict[Key, _UserGaps]" = OrderedDict()
+        self._dirty = False
+        self._last_persisted_at: Optional[float] = None
+        self._counters = {"rebuilds": 0, "rows_rebuilt": 0, "incremental_updates": 0, "stale_self_rows": 0,
+                          "invalid_rows": 0, "evicted": 0}
+
+        if self.persist_path:
+            self.load()
+            flusher = threading.Thread(target=self._flush_loop, name="delusional-flush", daemon=True)
+            flusher.start()
+
+    def get(self, user_id: str, assessment_type: str) -> Optional[Dict[str, Any]]:
+        """The user's current result, or None without both a self and an external assessment"""
+        with self._lock:
+            state = self._users.get((user_id, assessment_type))
+            return state.result if state is not None else None
+
+    def add(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Fold one new assessment row into its user's result; returns the updated result"""
+        key = _row_key(row)
+        if key is None:
+            self._count("invalid_rows")
+            return None
+        entries = category_entries(row.get("category_scores"))
+        completed_at = completed_timestamp(row.get("completed_at"))
+        with self._lock:
+            state = self._users.get(key)
+            if state is None:
+                state = self._users[key] = _UserGaps()
+                self._evict()
+            else:
+                self._users.move_to_end(key)
+            if row.get("source") == "self":
+                if state.self_completed_at is not None and completed_at <= state.self_completed_at:
+                    self._counters["stale_self_rows"] += 1
+                    return state.result
+                state.self_scores, state.self_completed_at = entries, completed_at
+            else:
+                for category, percentage in first_entries(entries).items():
+                    running = state.sums.setdefault(category, [0.0, 0])
+                    running[0] += percentage
+                    running[1] += 1
+                state.external_count += 1
+            state.result = state.render()
+            self._counters["incremental_updates"] += 1
+            self._dirty = True
+            return state.result
+
+    def rebuild(self, rows: Iterable[Dict[str, Any]]) -> Dict[Key, Optional[Dict[str, Any]]]:
+        """Recompute every user in `rows` from scratch; returns their results"""
+        keys: Dict[Key, int] = {}
+        categories: Dict[str, int] = {}
+        selves: Dict[int, Tuple[float, List[Tuple[str, float]]]] = {}
+        external_counts: Dict[int, int] = {}
+        ext_keys, ext_categories, ext_times, ext_values = [], [], [], []
+        row_count = invalid = 0
+        for row in rows:
+            row_count += 1
+            key = _row_key(row)
+            if key is None:
+                invalid += 1
+                continue
+            index = keys.setdefault(key, len(keys))
+            entries = category_entries(row.get("category_scores"))
+            completed_at = completed_timestamp(row.get("completed_at"))
+            if row.get("source") == "self":
+                # The newest self-assessment counts; the first one listed wins a tie
+                if index not in selves or completed_at > selves[index][0]:
+                    selves[index] = (completed_at, entries)
+                continue
+            external_counts[index] = external_counts.get(index, 0) + 1
+            firsts = first_entries(entries)
+            ext_keys += [index] * len(firsts)
+            ext_categories += [categories.setdefault(category, len(categories)) for category in firsts]
+            ext_times += [completed_at] * len(firsts)
+            ext_values += firsts.values()
+
+        # One group per (user, category) that has ratings, numbered in (user, category) order
+        category_count = max(len(categories), 1)
+        group_keys, groups = np.unique(
+            np.array(ext_keys, dtype=np.int64) * category_count + np.array(ext_categories, dtype=np.int64),
+            return_inverse=True)
+        groups = groups.reshape(-1)
+        values = np.array(ext_values, dtype=float)
+        # Ratings are added newest first, in input (fetch) order on ties: lexsort is stable
+        order = np.lexsort((-np.array(ext_times), groups))
+        starts = np.searchsorted(groups[order], np.arange(len(group_keys)))
+        positions = np.empty(len(groups), dtype=np.int64)
+        positions[order] = np.arange(len(groups)) - starts[groups[order]]
+        sums = _sequential_sums(groups, positions, values, len(group_keys))
+        counts = np.bincount(groups, minlength=len(group_keys))
+
+        # Gaps for every self category of every user at once
+        self_keys, self_positions, self_groups, self_values = [], [], [], []
+        for index, (_, entries) in selves.items():
+            for position, (category, percentage) in enumerate(entries):
+                column = categories.get(category)
+                if column is not None:
+                    self_keys.append(index), self_positions.append(position)
+                    self_groups.append(index * category_count + column), self_values.append(percentage)
+        found = np.searchsorted(group_keys, np.array(self_groups, dtype=np.int64))
+        found = np.minimum(found, max(len(group_keys) - 1, 0))
+        rated = group_keys[found] == self_groups if len(group_keys) else np.zeros(len(self_groups), dtype=bool)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            external_scores = sums[found] / counts[found] if len(group_keys) else np.zeros(len(self_groups))
+        gaps = np.abs(np.array(self_values, dtype=float) - external_scores)
+        statuses = np.select([gaps <= SELF_AWARE_MAX_GAP, gaps <= BLIND_SPOT_MAX_GAP],
+                             ["self-aware", "blind-spot"], "delusional")
+        gap_keys = np.array(self_keys, dtype=np.int64)[rated]
+        gap_positions = np.array(self_positions, dtype=np.int64)[rated]
+        overall_sums = _sequential_sums(gap_keys, gap_positions, gaps[rated], len(keys))
+        gap_counts = np.bincount(gap_keys, minlength=len(keys))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            overall = np.where(gap_counts > 0, overall_sums / gap_counts, 0.0)
+        overall_statuses = np.select([overall <= SELF_AWARE_MAX_GAP, overall <= BLIND_SPOT_MAX_GAP],
+                                     ["self-aware", "blind-spot"], "delusional")
+
+        # Back to per-user state: running sums for later updates, and the rendered results
+        names = list(categories)
+        key_list = list(keys)
+        states = [_UserGaps() for _ in key_list]
+        # Each user's groups are a contiguous run of group_keys
+        bounds = np.searchsorted(group_keys, np.arange(len(key_list) + 1) * category_count).tolist()
+        packed_columns = (group_keys % category_count).tolist()
+        for index, state in enumerate(states):
+            state._packed = (names, packed_columns, sums, counts, bounds[index], bounds[index + 1])
+        for index, (completed_at, entries) in selves.items():
+            states[index].self_scores, states[index].self_completed_at = entries, completed_at
+        for index, count in external_counts.items():
+            states[index].external_count = count
+
+        per_user_gaps: List[List[Dict[str, Any]]] = [[] for _ in key_list]
+        rated_list = rated.tolist()
+        gap_rows = zip(self_keys, self_groups, self_values, external_scores.tolist(), gaps.tolist(),
+                       statuses.tolist(), rated_list)
+        for index, group, self_score, external_score, gap, status, is_rated in gap_rows:
+            if is_rated:
+                per_user_gaps[index].append({"category": names[group % category_count], "self_score": self_score,
+                                             "external_score": external_score, "gap": gap, "status": status})
+        overall_values, overall_status_values = overall.tolist(), overall_statuses.tolist()
+        results: Dict[Key, Optional[Dict[str, Any]]] = {}
+        for index, key in enumerate(key_list):
+            state = states[index]
+            if state.self_completed_at is not None and state.external_count:
+                state.result = {"overall_score": overall_values[index] if per_user_gaps[index] else 0,
+                                "status": overall_status_values[index], "category_gaps": per_user_gaps[index],
+                                "external_assessment_count": state.external_count}
+            results[key] = state.result
+
+        with self._lock:
+            for key, state in zip(key_list, states):
+                self._users[key] = state
+                self._users.move_to_end(key)
+            self._evict()
+            self._counters["rebuilds"] += 1
+            self._counters["rows_rebuilt"] += row_count
+            self._counters["invalid_rows"] += invalid
+            self._dirty = True
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "max_users": self.max_users,
+                "persistence": bool(self.persist_path),
+                "last_persisted_at": self._last_persisted_at,
+                **self._counters,
+            }
+
+    def save(self) -> None:
+        """Atomically write every user's running state to persist_path"""
+        if not self.persist_path:
+            return
+        with self._lock:
+            snapshot = [[user_id, assessment_type, state.self_completed_at, state.self_scores, state.sums,
+                         state.external_count] for (user_id, assessment_type), state in self._users.items()]
+            self._dirty = False
+        tmp_path = f"{self.persist_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.persist_path)
+        self._last_persisted_at = time.time()
+
+    def load(self) -> None:
+        """Restore running state from persist_path, if a snapshot exists"""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Could not load delusional score snapshot: {str(e)}")
+            return
+        with self._lock:
+            for user_id, assessment_type, self_completed_at, self_scores, sums, external_count in snapshot[-self.max_users:]:
+                state = _UserGaps()
+                state.self_completed_at = self_completed_at
+                state.self_scores = [tuple(entry) for entry in self_scores]
+                state.sums = sums
+                state.external_count = external_count
+                state.result = state.render()
+                self._users[(user_id, assessment_type)] = state
+        logger.info(f"✅ Restored delusional scores for {len(snapshot)} users from disk")
+
+    def _evict(self) -> None:
+        # Caller must hold self._lock
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+            self._counters["evicted"] += 1
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.persist_interval)
+            if not self._dirty:
+                continue
+            try:
+                self.save()
+            except OSError as e:
+                logger.error(f"❌ Delusional score snapshot failed: {str(e)}")
+
+
+def _row_key(row: Any) -> Optional[Key]:
+    if not isinstance(row, dict) or row.get("source") not in ("self", "external"):
+        return None
+    user_id, assessment_type = row.get("user_id"), row.get("assessment_type")
+    if not isinstance(user_id, str) or not isinstance(assessment_type, str):
+        return None
+    return user_id, assessment_type
+
+
+def read_rows(lines: Iterable[Any]) -> Iterator[Dict[str, Any]]:
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if line.strip():
+            yield json.loads(line)
+
+
+def compare(rows: List[Dict[str, Any]], held_out: int = 2000) -> Dict[str, Any]:
+    """Check the vectorized pass and incremental updates against the per-user port, and time all three"""
+    started = time.perf_counter()
+    by_user: Dict[Key, Tuple[list, list]] = {}
+    for row in rows:
+        key = _row_key(row)
+        if key is not None:
+            by_user.setdefault(key, ([], []))[0 if row["source"] == "self" else 1].append(row)
+    one_by_one = {key: _port(self_rows, external_rows) for key, (self_rows, external_rows) in by_user.items()}
+    per_user_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched = DelusionalScores(max_users=len(by_user) + 1).rebuild(rows)
+    batch_seconds = time.perf_counter() - started
+    mismatches = sum(1 for key, result in one_by_one.items() if json.dumps(result) != json.dumps(batched.get(key)))
+
+    # Hold back each of some users' last external row, then fold it in with add()
+    last_rows = {}
+    for row in rows:
+        key = _row_key(row)
+        if key is not None and row["source"] == "external" and by_user[key][0]:
+            last_rows[key] = row
+    last_rows = dict(list(last_rows.items())[:held_out])
+    held = {id(row) for row in last_rows.values()}
+    engine = DelusionalScores(max_users=len(by_user) + 1)
+    engine.rebuild(row for row in rows if id(row) not in held)
+    started = time.perf_counter()
+    for row in last_rows.values():
+        engine.add(row)
+    add_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    for key in last_rows:
+        _port(*by_user[key])
+    recompute_seconds = time.perf_counter() - started
+    drift = max((abs(engine.get(*key)["overall_score"] - one_by_one[key]["overall_score"]) for key in last_rows),
+                default=0.0)
+    status_mismatches = sum(1 for key in last_rows if engine.get(*key)["status"] != one_by_one[key]["status"])
+
+    return {
+        "rows": len(rows),
+        "users": len(by_user),
+        "identical": mismatches == 0,
+        "mismatches": mismatches,
+        "per_user_rows_per_second": round(len(rows) / per_user_seconds),
+        "batch_rows_per_second": round(len(rows) / batch_seconds),
+        "incremental_updates": len(last_rows),
+        "incremental_update_us": round(add_seconds / max(len(last_rows), 1) * 1e6, 1),
+        "per_user_recompute_us": round(recompute_seconds / max(len(last_rows), 1) * 1e6, 1),
+        "incremental_max_drift": drift,
+        "incremental_status_mismatches": status_mismatches,
+    }
+
+
+def _port(self_rows: List[Dict[str, Any]], external_rows: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    # The browser fetches external results newest first
+    return delusional_score(self_rows, sorted(external_rows, key=lambda row: -completed_timestamp(row.get("completed_at"))))
+
+
+def build_delusional_scores_from_env() -> DelusionalScores:
+    """Delusional scores configured from AI_DELUSIONAL_* (AI_DELUSIONAL_PERSIST_PATH enables snapshots)"""
+    return DelusionalScores(
+        max_users=int(os.environ.get("AI_DELUSIONAL_MAX_USERS", "200000")),
+        persist_path=os.environ.get("AI_DELUSIONAL_PERSIST_PATH") or None,
+        persist_interval=int(os.environ.get("AI_DELUSIONAL_PERSIST_INTERVAL", "300"))
+    )
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Compute delusional scores for many users from assessment rows")
+    parser.add_argument("input", help="JSONL assessment rows ('-' for stdin)")
+    parser.add_argument("output", nargs="?", default="-", help="JSONL results ('-' for stdout)")
+    parser.add_argument("--compare", action="store_true",
+                        help="Check against the per-user port and time full and incremental updates")
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    if args.compare:
+        summary = compare(list(read_rows(source)))
+        print(json.dumps(summary))
+        sys.exit(0 if summary["identical"] and not summary["incremental_status_mismatches"] else 1)
+
+    engine = DelusionalScores(max_users=sys.maxsize)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    written = 0
+    for (user_id, assessment_type), result in engine.rebuild(read_rows(source)).items():
+        if result is not None:
+            out.write(json.dumps({"user_id": user_id, "assessment_type": assessment_type, **result}) + "\n")
+            written += 1
+    out.flush()
+    logger.info("Scored %d users", written)
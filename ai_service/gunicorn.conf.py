@@ -0,0 +1,29 @@
+"""
+Gunicorn server hooks. Gunicorn loads this file automatically from the working
+directory; bind, workers and threads still come from the startup command.
+
+With AI_SHARED_INDEX=true the master publishes the read-only retrieval index
+in a shared memory segment before forking, and every worker (including ones
+restarted later) attaches to it instead of holding its own copy.
+"""
+
+import os
+
+_shared_segment = None
+
+
+def on_starting(server):
+    global _shared_segment
+    if os.environ.get("AI_SHARED_INDEX", "false").lower() != "true":
+        return
+    from shared_index import publish_content_index
+    try:
+        _shared_segment = publish_content_index()
+    except Exception as e:
+        # Workers fall back to the on-disk snapshot or their own build
+        server.log.warning(f"Shared retrieval index not published: {e}")
+
+
+def on_exit(server):
+    from shared_index import release_shared_index
+    release_shared_index(_shared_segment)
@@ -0,0 +1,185 @@
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+from typing import Any, Collection, Dict, List, Optional, Tuple
+
+from retrieval import RetrievalIndex
+
+logger = logging.getLogger(__name__)
+
+# Layout (little-endian, every section 4-byte aligned):
+#   header        magic, sha256 of the content pack, doc/term/posting counts, blob sizes
+#   term_offsets  u32[n_terms + 1]  into term_blob; terms sorted by UTF-8 bytes
+#   post_offsets  u32[n_terms + 1]  into postings
+#   text_offsets  u32[n_docs + 1]   into text_blob
+#   postings      u32[n_postings]   document ids, ascending per term
+#   term_blob     UTF-8 corpus terms
+#   text_blob     UTF-8 lowercased document texts, for substring scans of other query words
+MAGIC = b"LMIDX001"
+HEADER = struct.Struct("<8s32sIIII")
+
+
+def _aligned(size: int) -> int:
+    return (size + 3) & ~3
+
+
+def serialize_index(index: RetrievalIndex, digest: str) -> bytes:
+    """Flat binary image of an index's corpus postings and texts"""
+    terms = sorted((term.encode("utf-8"), term) for term in list(index._postings)[:index._corpus_terms])
+    term_offsets, post_offsets, postings = [0], [0], []
+    for encoded, term in terms:
+        term_offsets.append(term_offsets[-1] + len(encoded))
+        postings.extend(index._postings[term])
+        post_offsets.append(len(postings))
+    texts = [text.encode("utf-8") for text in index.texts]
+    text_offsets = [0]
+    for text in texts:
+        text_offsets.append(text_offsets[-1] + len(text))
+
+    term_blob = b"".join(encoded for encoded, _ in terms)
+    text_blob = b"".join(texts)
+    parts = [
+        HEADER.pack(MAGIC, bytes.fromhex(digest), len(texts), len(terms), len(postings), len(term_blob)),
+        struct.pack(f"<{len(term_offsets)}I", *term_offsets),
+        struct.pack(f"<{len(post_offsets)}I", *post_offsets),
+        struct.pack(f"<{len(text_offsets)}I", *text_offsets),
+        struct.pack(f"<{len(postings)}I", *postings),
+        term_blob + b"\0" * (_aligned(len(term_blob)) - len(term_blob)),
+        text_blob,
+    ]
+    return b"".join(parts)
+
+
+class FlatRetrievalIndex(RetrievalIndex):
+    """RetrievalIndex read in place from a flat snapshot buffer (an mmap or shared memory).
+
+    Opening it only validates the header and takes typed views over the
+    buffer, so it costs the same whatever the corpus size. Corpus terms are
+    found by binary search over the sorted term table; other query words are
+    scanned in the text blob and memoized, as in RetrievalIndex.
+    """
+
+    def __init__(self, buffer: Any, documents: List[Dict[str, Any]], digest: str,
+                 max_cached_terms: int = 10000, owner: Any = None):
+        magic, raw_digest, n_docs, n_terms, n_postings, term_blob_len = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or raw_digest.hex() != digest or n_docs != len(documents) or sys.byteorder != "little":
+            raise ValueError("Index snapshot does not match this content")
+        self.documents = documents
+        self.max_cached_terms = max_cached_terms
+        self.n_terms = n_terms
+        self._buffer = buffer
+        self._owner = owner
+        view = memoryview(buffer)
+        self._view = view
+        position = HEADER.size
+
+        def u32_array(count: int):
+            nonlocal position
+            array = view[position:position + 4 * count].cast("I")
+            position += 4 * count
+            return array
+
+        self._term_offsets = u32_array(n_terms + 1)
+        self._post_offsets = u32_array(n_terms + 1)
+        self._text_offsets = u32_array(n_docs + 1)
+        self._postings_view = u32_array(n_postings)
+        self._term_base = position
+        self._text_base = position + _aligned(term_blob_len)
+        self._memo: Dict[str, Tuple[int, ...]] = {}
+        self._lock = threading.Lock()
+
+    def postings(self, term: str) -> Tuple[int, ...]:
+        encoded = term.encode("utf-8")
+        position = self._find_term(encoded)
+        if position is not None:
+            return tuple(self._postings_view[self._post_offsets[position]:self._post_offsets[position + 1]])
+        doc_ids = self._memo.get(term)
+        if doc_ids is None:
+            doc_ids = self._scan_bytes(encoded)
+            with self._lock:
+                if len(self._memo) >= self.max_cached_terms:
+                    self._memo.clear()
+                self._memo[term] = doc_ids
+        return doc_ids
+
+    def rebuild(self, documents: List[Dict[str, Any]], changed_ids: Collection[int]) -> RetrievalIndex:
+        """Reloaded content gets an in-memory index; its snapshot is written for the next boot"""
+        return RetrievalIndex(documents, self.max_cached_terms)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self.documents),
+            "corpus_terms": self.n_terms,
+            "cached_query_terms": len(self._memo),
+            "snapshot_bytes": self._view.nbytes,
+        }
+
+    def _find_term(self, encoded: bytes) -> Optional[int]:
+        low, high = 0, self.n_terms
+        base = self._term_base
+        while low < high:
+            middle = (low + high) // 2
+            candidate = bytes(self._view[base + self._term_offsets[middle]:base + self._term_offsets[middle + 1]])
+            if candidate < encoded:
+                low = middle + 1
+            elif candidate > encoded:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def _scan_bytes(self, encoded: bytes) -> Tuple[int, ...]:
+        # A UTF-8 byte substring match is exactly a character substring match
+        base = self._text_base
+        offsets = self._text_offsets
+        if not hasattr(self._buffer, "find"):
+            # Shared memory buffers are plain memoryviews, which cannot search in place
+            return tuple(doc_id for doc_id in range(len(self.documents))
+                         if encoded in self._view[base + offsets[doc_id]:base + offsets[doc_id + 1]].tobytes())
+        return tuple(doc_id for doc_id in range(len(self.documents))
+                     if self._buffer.find(encoded, base + offsets[doc_id], base + offsets[doc_id + 1]) != -1)
+
+    def image(self) -> bytes:
+        """The snapshot bytes this index reads from"""
+        return self._view.tobytes()
+
+
+def snapshot_path(directory: str, digest: str) -> str:
+    return os.path.join(directory, f"index-{digest[:16]}.bin")
+
+
+def load_snapshot(directory: str, documents: List[Dict[str, Any]], digest: str) -> Optional[FlatRetrievalIndex]:
+    """Memory-map the snapshot for this content, or None if there is no valid one"""
+    path = snapshot_path(directory, digest)
+    try:
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        return FlatRetrievalIndex(mapped, documents, digest, owner=mapped)
+    except (ValueError, struct.error) as e:
+        mapped.close()
+        logger.warning(f"⚠️ Ignoring index snapshot {path}: {str(e)}")
+        return None
+
+
+def write_snapshot(directory: str, index: RetrievalIndex, digest: str) -> str:
+    """Atomically write the snapshot for this content and remove snapshots of other versions"""
+    os.makedirs(directory, exist_ok=True)
+    path = snapshot_path(directory, digest)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(serialize_index(index, digest))
+    os.replace(tmp_path, path)
+    for name in os.listdir(directory):
+        if name.startswith("index-") and name.endswith(".bin") and os.path.join(directory, name) != path:
+            try:
+                # Workers that still map an old snapshot keep reading it until they unmap it
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    return path
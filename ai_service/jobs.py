@@ -0,0 +1,169 @@
+import contextvars
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Job lifecycle states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another pending job"""
+
+
+class Job:
+    """A single unit of background AI generation"""
+
+    def __init__(self, job_id: str, fingerprint: str, payload: Dict[str, Any]):
+        self.id = job_id
+        self.fingerprint = fingerprint
+        self.payload = payload
+        self.status = JOB_QUEUED
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done = threading.Event()
+
+    def to_dict(self) -> Dict[str, Any]:
+        job = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == JOB_COMPLETED:
+            job["result"] = self.result
+        elif self.status == JOB_FAILED:
+            job["error"] = self.error
+        return job
+
+
+def fingerprint_payload(payload: Dict[str, Any]) -> str:
+    """Stable hash of a request payload, used to detect duplicate submissions"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class JobQueue:
+    """Local worker pool that runs AI generation jobs and keeps results for a TTL"""
+
+    def __init__(self, handler: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 max_workers: int = 4, result_ttl: int = 600, max_pending: int = 100):
+        self.handler = handler
+        self.max_workers = max_workers
+        self.result_ttl = result_ttl
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ai-job")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+        self._by_fingerprint: Dict[str, str] = {}
+        self._counters = {
+            "submitted": 0,
+            "deduplicated": 0,
+            "rejected": 0,
+            "completed": 0,
+            "failed": 0,
+            "expired": 0,
+        }
+
+    def submit(self, payload: Dict[str, Any]) -> Tuple[Job, bool]:
+        """Queue a job, or return the live job for an identical payload.
+
+        Returns the job and whether it was deduplicated against an existing one.
+        """
+        fingerprint = fingerprint_payload(payload)
+        with self._lock:
+            self._purge_expired()
+
+            # Failed jobs are not reused so that a resubmission gets a fresh attempt
+            existing = self._jobs.get(self._by_fingerprint.get(fingerprint, ""))
+            if existing is not None and existing.status != JOB_FAILED:
+                self._counters["deduplicated"] += 1
+                return existing, True
+
+            if self._pending_count() >= self.max_pending:
+                self._counters["rejected"] += 1
+                raise QueueFullError(f"Job queue is full ({self.max_pending} pending jobs)")
+
+            job = Job(uuid.uuid4().hex, fingerprint, payload)
+            self._jobs[job.id] = job
+            self._by_fingerprint[fingerprint] = job.id
+            self._counters["submitted"] += 1
+
+        # The job runs in the submitting request's context, so its spans and log
+        # records belong to that request's trace and sampling decision
+        self._executor.submit(contextvars.copy_context().run, self._run, job)
+        return job, False
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by id; expired jobs are treated as missing"""
+        with self._lock:
+            self._purge_expired()
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Long-poll: block up to timeout seconds for the job to finish"""
+        job = self.get(job_id)
+        if job is not None and timeout > 0:
+            job.done.wait(timeout)
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and lifetime counters"""
+        with self._lock:
+            self._purge_expired()
+            queued = sum(1 for job in self._jobs.values() if job.status == JOB_QUEUED)
+            running = sum(1 for job in self._jobs.values() if job.status == JOB_RUNNING)
+            return {
+                "queue_depth": queued,
+                "running": running,
+                "stored_jobs": len(self._jobs),
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "result_ttl_seconds": self.result_ttl,
+                **self._counters,
+            }
+
+    def _run(self, job: Job) -> None:
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = self.handler(job.payload)
+            job.status = JOB_COMPLETED
+            outcome = "completed"
+        except Exception as e:
+            logger.error(f"❌ Job {job.id} failed: {str(e)}")
+            job.error = str(e)
+            job.status = JOB_FAILED
+            outcome = "failed"
+        job.finished_at = time.time()
+        with self._lock:
+            self._counters[outcome] += 1
+        job.done.set()
+
+    def _pending_count(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status in (JOB_QUEUED, JOB_RUNNING))
+
+    def _purge_expired(self) -> None:
+        # Caller must hold self._lock
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if self._by_fingerprint.get(job.fingerprint) == job_id:
+                del self._by_fingerprint[job.fingerprint]
+            self._counters["expired"] += 1
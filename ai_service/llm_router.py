@@ -0,0 +1,305 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import openai
+
+from retry import (Deadline, RetryBudget, RetryPolicy, attempt_record, is_endpoint_error, is_retryable,
+                   retry_after_seconds)
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Model tiers an endpoint can serve; "fast" endpoints take simple questions
+TIER_STANDARD = "standard"
+TIER_FAST = "fast"
+
+
+class NoBackendAvailableError(Exception):
+    """Raised when no configured LLM endpoint could serve a request"""
+
+
+class Backend:
+    """One LLM deployment with its rolling latency and error scores"""
+
+    def __init__(self, name: str, model: str, client: Any, tier: str = TIER_STANDARD,
+                 alpha: float = 0.3, failure_threshold: int = 3, cooldown_seconds: float = 30.0):
+        self.name = name
+        self.model = model
+        self.client = client
+        self.tier = tier
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.ewma_latency = 0.0
+        self.ewma_error = 0.0
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def score(self) -> float:
+        """Lower is better: expected latency inflated by load and recent errors"""
+        return (self.ewma_latency + 0.05) * (1 + self.in_flight) * (1 + 4 * self.ewma_error)
+
+    def started(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+
+    def succeeded(self, latency: float) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.ewma_latency = latency if self.ewma_latency == 0 else (
+                self.alpha * latency + (1 - self.alpha) * self.ewma_latency)
+            self.ewma_error = (1 - self.alpha) * self.ewma_error
+            self.consecutive_failures = 0
+
+    def failed(self, latency: float) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.failures += 1
+            self.ewma_error = self.alpha + (1 - self.alpha) * self.ewma_error
+            # Slow failures (timeouts) should also push latency up
+            self.ewma_latency = max(self.ewma_latency, self.alpha * latency + (1 - self.alpha) * self.ewma_latency)
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.cooldown_until = time.time() + self.cooldown_seconds
+                logger.warning(f"⚠️ LLM backend {self.name} marked unhealthy for {self.cooldown_seconds:.0f}s")
+
+    def disable(self) -> None:
+        """Take the endpoint out of rotation for a cooldown without waiting for repeated failures"""
+        with self._lock:
+            self.cooldown_until = time.time() + self.cooldown_seconds
+        logger.warning(f"⚠️ LLM backend {self.name} marked unhealthy for {self.cooldown_seconds:.0f}s")
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "tier": self.tier,
+            "healthy": self.healthy(now),
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 1),
+            "ewma_error_rate": round(self.ewma_error, 3),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class LLMRouter:
+    """Spreads chat completions across LLM deployments.
+
+    Picks between two random healthy candidates by EWMA score (power of two
+    choices) and fails over to another deployment when a call errors. Retries
+    of transient errors back off with jitter, stay within the request's
+    deadline and draw on a shared retry budget. An endpoint that rejects its
+    credentials or model (401/403/404) is marked unhealthy and skipped; only
+    errors in the request itself (e.g. 400/422) end the call at once.
+    """
+
+    def __init__(self, backends: List[Backend], simple_max_words: int = 0,
+                 retry_policy: Optional[RetryPolicy] = None, retry_budget: Optional[RetryBudget] = None,
+                 default_deadline: float = 30.0):
+        self.backends = backends
+        self.simple_max_words = simple_max_words
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.default_deadline = default_deadline
+        self._rng = random.Random()
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0,
+            "retries": 0,
+            "failovers": 0,
+            "budget_exhausted": 0,
+            "deadline_exhausted": 0,
+            "non_retryable": 0,
+            "endpoint_errors": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.backends)
+
+    def is_simple(self, user_input: str, chat_history: list) -> bool:
+        """Short, standalone questions can go to a cheaper/faster model"""
+        if not self.simple_max_words or chat_history:
+            return False
+        return len(user_input.split()) <= self.simple_max_words
+
+    def pick(self, tier: str = TIER_STANDARD, exclude: Optional[set] = None) -> Optional[Backend]:
+        exclude = exclude or set()
+        now = time.time()
+        remaining = [b for b in self.backends if b.name not in exclude]
+        if not remaining:
+            return None
+        candidates = ([b for b in remaining if b.tier == tier and b.healthy(now)]
+                      or [b for b in remaining if b.healthy(now)]
+                      or remaining)
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = self._rng.sample(candidates, 2)
+        return first if first.score() <= second.score() else second
+
+    def complete(self, messages: List[Dict[str, str]], tier: str = TIER_STANDARD,
+                 deadline: Optional[Deadline] = None, attempts: Optional[list] = None,
+                 **kwargs: Any) -> Tuple[Any, Backend]:
+        """Run a chat completion with failover and retries; returns (response, backend).
+
+        Per-attempt timings are appended to `attempts` when a list is given.
+        """
+        deadline = deadline or Deadline(self.default_deadline)
+        attempts = attempts if attempts is not None else []
+        policy = self.retry_policy
+        max_timeout = kwargs.pop("timeout", None)
+        self.retry_budget.deposit()
+        self._count("calls")
+
+        tried: set = set()
+        # Endpoints that failed on their own configuration are not tried again for this request
+        broken: set = set()
+        last_error: Optional[Exception] = None
+        for attempt in range(1, policy.max_attempts + 1):
+            remaining = deadline.remaining()
+            if remaining < policy.min_attempt_seconds:
+                self._count("deadline_exhausted")
+                break
+
+            # Fail over to an untried endpoint first; only then retry one already used
+            backend = self.pick(tier, exclude=tried | broken) or self.pick(tier, exclude=broken)
+            if backend is None:
+                break
+            tried.add(backend.name)
+
+            timeout = min(remaining, max_timeout) if max_timeout else remaining
+            backend.started()
+            start = time.perf_counter()
+            try:
+                with tracer.span("llm_attempt", attempt=attempt, backend=backend.name):
+                    response = backend.client.chat.completions.create(
+                        model=backend.model, messages=messages, timeout=timeout, **kwargs)
+            except Exception as e:
+                backend.failed(time.perf_counter() - start)
+                attempts.append(attempt_record(attempt, backend.name, start, e))
+                last_error = e
+                if is_endpoint_error(e):
+                    self._count("endpoint_errors")
+                    backend.disable()
+                    broken.add(backend.name)
+                elif not is_retryable(e):
+                    self._count("non_retryable")
+                    break
+                if attempt == policy.max_attempts:
+                    break
+                if not self.retry_budget.withdraw():
+                    self._count("budget_exhausted")
+                    logger.warning("⚠️ LLM retry budget exhausted, not retrying")
+                    break
+
+                switching = len(tried) < len(self.backends)
+                delay = 0.0 if switching else policy.backoff(attempt, retry_after_seconds(e))
+                if deadline.remaining() - delay < policy.min_attempt_seconds:
+                    self._count("deadline_exhausted")
+                    break
+                self._count("failovers" if switching else "retries")
+                logger.warning(f"⚠️ LLM backend {backend.name} failed ({str(e)}), "
+                               f"{'failing over' if switching else f'retrying in {delay:.2f}s'}")
+                if delay:
+                    time.sleep(delay)
+                continue
+
+            backend.succeeded(time.perf_counter() - start)
+            attempts.append(attempt_record(attempt, backend.name, start))
+            return response, backend
+        raise NoBackendAvailableError(f"All LLM attempts failed: {last_error}") from last_error
+
+    def warm(self, timeout: float = 5.0) -> int:
+        """Open a pooled connection (DNS, TLS) to every endpoint; returns how many answered"""
+        warmed = 0
+        for backend in self.backends:
+            try:
+                backend.client.models.list(timeout=timeout)
+                warmed += 1
+            except Exception as e:
+                logger.warning(f"⚠️ Could not warm LLM backend {backend.name}: {str(e)}")
+        if self.backends and not warmed:
+            raise NoBackendAvailableError("No LLM backend answered during warm-up")
+        return warmed
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            "backends": [b.stats(now) for b in self.backends],
+            "simple_max_words": self.simple_max_words,
+            "retry_budget_tokens": self.retry_budget.available(),
+            **counters,
+        }
+
+
+def make_client(config: Dict[str, Any]) -> Any:
+    """OpenAI or Azure OpenAI client for one endpoint config.
+
+    SDK-level retries are disabled; the router fails over to another endpoint instead.
+    """
+    api_key = os.environ.get(config.get("api_key_env", "OPENAI_API_KEY"), config.get("api_key", ""))
+    if config.get("azure"):
+        return openai.AzureOpenAI(
+            azure_endpoint=config["base_url"],
+            api_key=api_key,
+            api_version=config.get("api_version", "2024-02-01"),
+            max_retries=0
+        )
+    return openai.OpenAI(api_key=api_key, base_url=config.get("base_url"), max_retries=0)
+
+
+def build_router_from_env() -> LLMRouter:
+    """Router from AI_LLM_ENDPOINTS (JSON list), or the single OPENAI_API_KEY endpoint.
+
+    Each endpoint: {"name", "model", "base_url", "api_key_env", "azure", "api_version", "tier"}
+    """
+    raw = os.environ.get("AI_LLM_ENDPOINTS")
+    if raw:
+        configs = json.loads(raw)
+    elif os.environ.get("OPENAI_API_KEY"):
+        configs = [{"name": "openai", "model": os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo")}]
+    else:
+        configs = []
+
+    backends = [
+        Backend(
+            name=config.get("name", f"endpoint-{index}"),
+            model=config.get("model", "gpt-3.5-turbo"),
+            client=make_client(config),
+            tier=config.get("tier", TIER_STANDARD)
+        )
+        for index, config in enumerate(configs)
+    ]
+    if backends:
+        logger.info(f"✅ LLM router configured with {len(backends)} endpoint(s): {', '.join(b.name for b in backends)}")
+    return LLMRouter(
+        backends,
+        simple_max_words=int(os.environ.get("AI_LLM_SIMPLE_MAX_WORDS", "0")),
+        retry_policy=RetryPolicy(
+            max_attempts=int(os.environ.get("AI_LLM_MAX_ATTEMPTS", "3")),
+            base_delay=float(os.environ.get("AI_LLM_RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.environ.get("AI_LLM_RETRY_MAX_DELAY", "8"))
+        ),
+        retry_budget=RetryBudget(ratio=float(os.environ.get("AI_LLM_RETRY_BUDGET_RATIO", "0.2"))),
+        default_deadline=float(os.environ.get("AI_REQUEST_DEADLINE_SECONDS", "30"))
+    )
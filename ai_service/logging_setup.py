@@ -0,0 +1,191 @@
+import atexit
+import contextvars
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from typing import Any, Dict, Optional
+
+# Attributes every LogRecord has; anything else was passed via `extra=`
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+# Extra fields that identify a person; hashed (or dropped) before output
+PII_FIELDS = ("user", "user_name", "email", "user_id")
+
+_endpoint = contextvars.ContextVar("log_endpoint", default=None)
+_sampled = contextvars.ContextVar("log_sampled", default=True)
+
+
+def parse_sample_rates(raw: str) -> Dict[str, float]:
+    """'chat=0.1,get_chapter_recommendation=0.05' -> {endpoint: rate}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in raw.split(","))):
+        endpoint, _, rate = item.partition("=")
+        rates[endpoint.strip()] = float(rate)
+    return rates
+
+
+class RequestSampler:
+    """Decides once per request whether its INFO/DEBUG logs are kept"""
+
+    def __init__(self, rates: Dict[str, float]):
+        self.rates = rates
+
+    def begin_request(self, endpoint: Optional[str]) -> None:
+        _endpoint.set(endpoint)
+        _sampled.set(random.random() < self.rates.get(endpoint, 1.0))
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps the endpoint on records and drops low-severity logs of unsampled requests"""
+
+    def __init__(self):
+        super().__init__()
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.endpoint = _endpoint.get()
+        if record.levelno < logging.WARNING and not _sampled.get():
+            self.sampled_out += 1
+            return False
+        return True
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a background listener without formatting them.
+
+    Records are formatted lazily on the listener thread. When the queue is
+    full the record is dropped and counted rather than blocking the request.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener runs in-process, so the record needs no pickling-safe copy
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with PII fields hashed"""
+
+    def __init__(self, hash_salt: str = "", redact_only: bool = False):
+        super().__init__()
+        self.hash_salt = hash_salt
+        self.redact_only = redact_only
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key in _RESERVED_ATTRS or value is None:
+                continue
+            entry[key] = self.redact(value) if key in PII_FIELDS else value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+    def redact(self, value: Any) -> str:
+        if self.redact_only:
+            return "[redacted]"
+        digest = hashlib.sha256(f"{self.hash_salt}{value}".encode("utf-8")).hexdigest()
+        return f"sha256:{digest[:12]}"
+
+
+class LogPipeline:
+    """Background JSON logging: queue handler on the hot path, listener thread for output"""
+
+    def __init__(self, max_queue: int, sample_rates: Dict[str, float], hash_salt: str, redact_only: bool):
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.handler = BoundedQueueHandler(self.queue)
+        self.context_filter = RequestContextFilter()
+        self.handler.addFilter(self.context_filter)
+        self.sampler = RequestSampler(sample_rates)
+
+        output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonFormatter(hash_salt, redact_only))
+        self.listener = logging.handlers.QueueListener(self.queue, output, respect_handler_level=True)
+        self._running = False
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        self.listener.start()
+        self._running = True
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """Flush queued records and stop the listener thread"""
+        with self._lock:
+            if self._running:
+                self.listener.stop()
+                self._running = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": "json_async",
+            "queue_size": self.queue.qsize(),
+            "queue_max": self.queue.maxsize,
+            "enqueued": self.handler.enqueued,
+            "dropped": self.handler.dropped,
+            "sampled_out": self.context_filter.sampled_out,
+            "sample_rates": self.sampler.rates,
+        }
+
+
+class PlainLogging:
+    """Default synchronous logging; supports the same per-request sampling"""
+
+    def __init__(self, sample_rates: Dict[str, float]):
+        self.sampler = RequestSampler(sample_rates)
+        self.context_filter = RequestContextFilter()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": "plain", "sampled_out": self.context_filter.sampled_out,
+                "sample_rates": self.sampler.rates}
+
+
+def configure_logging():
+    """Set up root logging from AI_LOG_* environment variables.
+
+    AI_LOG_MODE=json_async formats JSON records off-thread through a bounded
+    queue; the default "plain" mode keeps synchronous text logs.
+    """
+    level = getattr(logging, os.environ.get("AI_LOG_LEVEL", "INFO").upper(), logging.INFO)
+    sample_rates = parse_sample_rates(os.environ.get("AI_LOG_SAMPLE_RATES", ""))
+
+    if os.environ.get("AI_LOG_MODE", "plain") != "json_async":
+        logging.basicConfig(level=level)
+        pipeline = PlainLogging(sample_rates)
+        for handler in logging.getLogger().handlers:
+            handler.addFilter(pipeline.context_filter)
+        return pipeline
+
+    pipeline = LogPipeline(
+        max_queue=int(os.environ.get("AI_LOG_QUEUE_SIZE", "10000")),
+        sample_rates=sample_rates,
+        hash_salt=os.environ.get("AI_LOG_HASH_SALT", ""),
+        redact_only=os.environ.get("AI_LOG_PII", "hash") == "redact"
+    )
+    root = logging.getLogger()
+    root.handlers = [pipeline.handler]
+    root.setLevel(level)
+    pipeline.start()
+    return pipeline
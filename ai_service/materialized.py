@@ -0,0 +1,234 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Canonical questions (the mentor page's suggested prompts) and common rephrasings of them
+CANONICAL_QUESTIONS: Dict[str, Tuple[str, ...]] = {
+    "focus": ("What should I focus on based on my assessment?", "What should I work on?",
+              "What should I work on in my relationship?", "What should I focus on?",
+              "What should I improve?", "Where should I start?"),
+    "communication": ("How can I improve communication with my partner?", "How can I communicate better?",
+                      "How do I improve communication?"),
+    "trust": ("How can I build more trust?", "How do I build trust?", "How can I build trust?"),
+    "conflict": ("How do I handle conflicts better?", "How can I handle conflict better?",
+                 "How do I handle conflict?"),
+    "healthy_signs": ("What are signs of a healthy relationship?", "What does a healthy relationship look like?"),
+    "delusional_score": ("What does my delusional score mean?", "Explain my delusional score"),
+}
+
+# Scores outside the assessment categories that also shape the answer
+EXTRA_SCORE_FIELDS = ("delusional_score", "compatibility_score")
+
+_NON_WORD_RE = re.compile(r"[^a-z0-9 ]+")
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(_NON_WORD_RE.sub(" ", text.lower()).split())
+
+
+class ScoreQuantizer:
+    """Maps a 0-100 score vector to one integer bucket key.
+
+    Each dimension is cut into buckets of bucket_size points, with one extra
+    bucket for a missing score; the per-dimension indices are packed into a
+    single mixed-radix integer.
+    """
+
+    def __init__(self, categories: List[str], bucket_size: int = 20):
+        self.dimensions = list(categories) + list(EXTRA_SCORE_FIELDS)
+        self.bucket_size = bucket_size
+        self.buckets = math.ceil(100 / bucket_size)
+        self.radix = self.buckets + 1
+
+    def key(self, user_context: Dict[str, Any]) -> int:
+        scores = user_context.get('assessment_scores', {})
+        key = 0
+        for dimension in self.dimensions:
+            value = scores.get(dimension) if dimension not in EXTRA_SCORE_FIELDS else user_context.get(dimension)
+            key = key * self.radix + self._bucket(value)
+        return key
+
+    def representative(self, key: int) -> Dict[str, Any]:
+        """A user_context with each score at its bucket's midpoint"""
+        indices = []
+        for _ in self.dimensions:
+            key, index = divmod(key, self.radix)
+            indices.append(index)
+        user_context: Dict[str, Any] = {"assessment_scores": {}}
+        for dimension, index in zip(self.dimensions, reversed(indices)):
+            if index == self.buckets:
+                continue
+            midpoint = min(100, index * self.bucket_size + self.bucket_size // 2)
+            if dimension in EXTRA_SCORE_FIELDS:
+                user_context[dimension] = midpoint
+            else:
+                user_context["assessment_scores"][dimension] = midpoint
+        return user_context
+
+    def _bucket(self, value: Any) -> int:
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return self.buckets
+        return min(self.buckets - 1, max(0, int(value // self.bucket_size)))
+
+
+class MaterializedAnswers:
+    """Answer table per (score bucket, canonical question), filled lazily in the background.
+
+    A lookup is a question normalization, a quantization over a handful of
+    score dimensions and one dict probe. On a miss or a stale entry the
+    caller answers live while the entry is generated for the bucket's
+    representative profile, so answers are generic to the score profile and
+    never carry a user's name. Entries older than max_age_seconds, or built
+    from another content version, are never served.
+
+    At most max_pending fills wait or run at once; further misses are
+    answered live without scheduling one. With persist_path set, the table
+    is written every save_interval seconds while it has new entries, or as
+    soon as save_every new entries are waiting.
+    """
+
+    def __init__(self, categories: List[str], generate: Callable[[str, Dict[str, Any]], str],
+                 bucket_size: int = 20, max_age_seconds: float = 86400, max_entries: int = 50000,
+                 persist_path: Optional[str] = None, max_pending: int = 100, save_interval: int = 60,
+                 save_every: int = 100):
+        self.quantizer = ScoreQuantizer(categories, bucket_size)
+        self.generate = generate
+        self.max_age_seconds = max_age_seconds
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.max_pending = max_pending
+        self.save_interval = save_interval
+        self.save_every = save_every
+        self._question_ids = {normalize_question(text): qid
+                              for qid, phrasings in CANONICAL_QUESTIONS.items() for text in phrasings}
+        # (bucket key, question id) -> (answer, created_at, content_version)
+        self._table: Dict[Tuple[int, str], Tuple[str, float, str]] = {}
+        self._lock = threading.Lock()
+        self._in_flight: set = set()
+        # Entries filled since the table was last written
+        self._unsaved = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="materializer")
+        self._counters = {"hits": 0, "misses": 0, "stale": 0, "ineligible": 0, "filled": 0, "failed": 0,
+                          "fills_dropped": 0, "saves": 0}
+        if persist_path:
+            self.load()
+            saver = threading.Thread(target=self._save_loop, name="materializer-save", daemon=True)
+            saver.start()
+
+    def lookup(self, user_input: str, user_context: Dict[str, Any], content_version: str) -> Optional[str]:
+        """The materialized answer for this question and score profile, or None to answer live"""
+        question_id = self._question_ids.get(normalize_question(user_input))
+        if question_id is None:
+            self._count("ineligible")
+            return None
+        slot = (self.quantizer.key(user_context), question_id)
+        entry = self._table.get(slot)
+        if entry is not None and entry[2] == content_version and time.time() - entry[1] <= self.max_age_seconds:
+            self._count("hits")
+            return entry[0]
+        self._count("stale" if entry is not None else "misses")
+        self._schedule(slot, content_version)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._table),
+                "in_flight": len(self._in_flight),
+                "max_pending": self.max_pending,
+                "unsaved": self._unsaved,
+                "bucket_size": self.quantizer.bucket_size,
+                "max_age_seconds": self.max_age_seconds,
+                **self._counters,
+            }
+
+    def save(self) -> None:
+        """Atomically write the table to persist_path"""
+        if not self.persist_path:
+            return
+        with self._lock:
+            snapshot = [[key, qid, answer, created_at, version]
+                        for (key, qid), (answer, created_at, version) in self._table.items()]
+            self._unsaved = 0
+            self._counters["saves"] += 1
+        tmp_path = f"{self.persist_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"bucket_size": self.quantizer.bucket_size, "dimensions": self.quantizer.dimensions,
+                       "entries": snapshot}, f)
+        os.replace(tmp_path, self.persist_path)
+
+    def load(self) -> None:
+        """Restore a saved table if it was built with the same quantization"""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Could not load materialized answers: {str(e)}")
+            return
+        if (snapshot.get("bucket_size") != self.quantizer.bucket_size
+                or snapshot.get("dimensions") != self.quantizer.dimensions):
+            logger.info("Materialized answers were built with other buckets, starting empty")
+            return
+        with self._lock:
+            for key, qid, answer, created_at, version in snapshot["entries"][-self.max_entries:]:
+                self._table[(key, qid)] = (answer, created_at, version)
+        logger.info(f"✅ Restored {len(self._table)} materialized answers from disk")
+
+    def _schedule(self, slot: Tuple[int, str], content_version: str) -> None:
+        with self._lock:
+            if slot in self._in_flight:
+                return
+            if len(self._in_flight) >= self.max_pending:
+                self._counters["fills_dropped"] += 1
+                return
+            self._in_flight.add(slot)
+        self._executor.submit(self._fill, slot, content_version)
+
+    def _fill(self, slot: Tuple[int, str], content_version: str) -> None:
+        key, question_id = slot
+        outcome = "filled"
+        try:
+            answer = self.generate(CANONICAL_QUESTIONS[question_id][0], self.quantizer.representative(key))
+            with self._lock:
+                if slot not in self._table and len(self._table) >= self.max_entries:
+                    # Evict the oldest entry; dicts keep insertion order
+                    del self._table[next(iter(self._table))]
+                self._table.pop(slot, None)
+                self._table[slot] = (answer, time.time(), content_version)
+        except Exception as e:
+            logger.error(f"❌ Materializing answer failed: {str(e)}")
+            outcome = "failed"
+        with self._lock:
+            self._in_flight.discard(slot)
+            self._counters[outcome] += 1
+            if outcome == "filled":
+                self._unsaved += 1
+            save_now = bool(self.persist_path) and self._unsaved >= self.save_every
+        if save_now:
+            self._save_logged()
+
+    def _save_loop(self) -> None:
+        while True:
+            time.sleep(self.save_interval)
+            if self._unsaved:
+                self._save_logged()
+
+    def _save_logged(self) -> None:
+        try:
+            self.save()
+        except OSError as e:
+            logger.error(f"❌ Saving materialized answers failed: {str(e)}")
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
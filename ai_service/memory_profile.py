@@ -0,0 +1,267 @@
+"""
+Memory diagnostics for one worker process: RSS/PSS/USS and GC statistics
+sampled over time, and tracemalloc allocation snapshots and diffs on demand.
+
+tracemalloc is only running between start() and stop(); while it is off
+nothing is traced or hooked, and the only cost is reading /proc once per
+sample interval. Process figures come from /proc (Linux, as on App Service);
+elsewhere only the peak RSS is known.
+"""
+
+import collections
+import gc
+import itertools
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("memory_profile")
+
+KEY_TYPES = ("lineno", "filename", "traceback")
+
+# Allocations made by the profiler itself and by imports are not interesting
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def _read_kb_fields(path: str, fields: List[str]) -> Dict[str, int]:
+    """Sum of each named "Field:  123 kB" line in a /proc file; empty when unreadable"""
+    values: Dict[str, int] = {}
+    try:
+        with open(path, encoding="ascii") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in fields:
+                    values[name] = values.get(name, 0) + int(rest.split()[0])
+    except (OSError, ValueError, IndexError):
+        return {}
+    return values
+
+
+def process_memory() -> Dict[str, Any]:
+    """This process's memory in kB. USS is what it would free on exit; RSS also counts shared pages
+    such as the shared retrieval index."""
+    status = _read_kb_fields("/proc/self/status", ["VmRSS", "VmHWM"])
+    rollup = _read_kb_fields("/proc/self/smaps_rollup", ["Pss", "Private_Clean", "Private_Dirty", "Private_Hugetlb"])
+    peak_kb = status.get("VmHWM")
+    if peak_kb is None:
+        # ru_maxrss is in bytes on macOS, kB elsewhere
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+    try:
+        open_files: Optional[int] = len(os.listdir("/proc/self/fd"))
+    except OSError:
+        open_files = None
+    return {
+        "pid": os.getpid(),
+        "rss_kb": status.get("VmRSS"),
+        "peak_rss_kb": peak_kb,
+        "pss_kb": rollup.get("Pss"),
+        "uss_kb": sum(rollup.get(name, 0) for name in ("Private_Clean", "Private_Dirty", "Private_Hugetlb"))
+        if rollup else None,
+        "threads": threading.active_count(),
+        "open_files": open_files,
+    }
+
+
+def gc_stats() -> Dict[str, Any]:
+    """Per-generation pending counts, thresholds and lifetime collection totals"""
+    return {
+        "counts": list(gc.get_count()),
+        "thresholds": list(gc.get_threshold()),
+        "generations": gc.get_stats(),
+        "garbage": len(gc.garbage),
+        "enabled": gc.isenabled(),
+    }
+
+
+def object_counts(limit: int = 25) -> List[Dict[str, Any]]:
+    """Live objects tracked by the GC, by type; walks every object, so only on request"""
+    counts = collections.Counter(f"{type(obj).__module__}.{type(obj).__qualname__}" for obj in gc.get_objects())
+    return [{"type": name, "count": count} for name, count in counts.most_common(limit)]
+
+
+def _short_path(filename: str) -> str:
+    for marker in ("site-packages/", "dist-packages/"):
+        if marker in filename:
+            return filename.split(marker, 1)[1]
+    for prefix in (os.path.dirname(os.path.abspath(__file__)), os.path.dirname(os.__file__)):
+        if filename.startswith(prefix + os.sep):
+            return filename[len(prefix) + 1:]
+    return filename
+
+
+def _site(stat: Any, key_type: str) -> Any:
+    if key_type == "traceback":
+        return [f"{_short_path(frame.filename)}:{frame.lineno}" for frame in stat.traceback]
+    frame = stat.traceback[0]
+    return _short_path(frame.filename) if key_type == "filename" else f"{_short_path(frame.filename)}:{frame.lineno}"
+
+
+class MemoryProfiler:
+    """Samples process memory and GC stats into a bounded history, and manages tracemalloc.
+
+    Snapshots are kept by id, at most max_snapshots (oldest dropped), plus the
+    baseline taken when tracing starts. All of them are discarded on stop().
+    """
+
+    def __init__(self, sample_interval: int = 60, history_size: int = 1440, max_snapshots: int = 4):
+        self.sample_interval = sample_interval
+        self.max_snapshots = max_snapshots
+        self._lock = threading.Lock()
+        self._history: "collections.deque[Dict[str, Any]]" = collections.deque(maxlen=history_size)
+        self._snapshots: "collections.OrderedDict[str, Dict[str, Any]]" = collections.OrderedDict()
+        self._ids = itertools.count(1)
+        self._started_at: Optional[float] = None
+        self._frames = 1
+
+        if self.sample_interval > 0:
+            sampler = threading.Thread(target=self._sample_loop, name="memory-sampler", daemon=True)
+            sampler.start()
+
+    def start(self, frames: int = 1) -> Dict[str, Any]:
+        """Start tracing with `frames` frames per allocation and take the baseline snapshot"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self._frames = frames
+                self._started_at = time.time()
+                self._snapshots.clear()
+                self._snapshots["baseline"] = self._take("baseline")
+                logger.info(f"🔬 tracemalloc started ({frames} frames)")
+        return self.tracing_status()
+
+    def stop(self) -> Dict[str, Any]:
+        """Stop tracing and free its memory and every snapshot"""
+        with self._lock:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+                logger.info("🔬 tracemalloc stopped")
+            self._snapshots.clear()
+            self._started_at = None
+        return self.tracing_status()
+
+    def snapshot(self, key_type: str = "lineno", limit: int = 25, collect: bool = False) -> Dict[str, Any]:
+        """Take a snapshot and return its id with the top allocation sites"""
+        if collect:
+            gc.collect()
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("tracemalloc is not running")
+            snapshot_id = f"s{next(self._ids)}"
+            taken = self._take(snapshot_id)
+            self._snapshots[snapshot_id] = taken
+            while len(self._snapshots) > self.max_snapshots + 1:
+                oldest = next(key for key in self._snapshots if key != "baseline")
+                del self._snapshots[oldest]
+        stats = taken["snapshot"].statistics(key_type)
+        return {
+            "id": snapshot_id,
+            "taken_at": taken["taken_at"],
+            "traced_kb": round(sum(stat.size for stat in stats) / 1024, 1),
+            "top": [{"site": _site(stat, key_type), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+                    for stat in stats[:limit]],
+        }
+
+    def diff(self, older: str = "baseline", newer: Optional[str] = None, key_type: str = "lineno",
+             limit: int = 25) -> Dict[str, Any]:
+        """Allocation sites that grew most between two snapshots; without `newer`, a fresh one"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("tracemalloc is not running")
+            if older not in self._snapshots or (newer is not None and newer not in self._snapshots):
+                raise KeyError(f"Unknown snapshot; have {', '.join(self._snapshots)}")
+            before = self._snapshots[older]
+            after = self._snapshots[newer] if newer is not None else self._take("now")
+        stats = after["snapshot"].compare_to(before["snapshot"], key_type)
+        return {
+            "from": older,
+            "to": newer or "now",
+            "seconds": round(after["taken_at"] - before["taken_at"], 1),
+            "size_diff_kb": round(sum(stat.size_diff for stat in stats) / 1024, 1),
+            "top": [{"site": _site(stat, key_type), "size_diff_kb": round(stat.size_diff / 1024, 1),
+                     "count_diff": stat.count_diff, "size_kb": round(stat.size / 1024, 1)}
+                    for stat in stats[:limit]],
+        }
+
+    def tracing_status(self) -> Dict[str, Any]:
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {
+            "tracing": tracing,
+            "frames": self._frames if tracing else None,
+            "started_at": self._started_at,
+            "traced_kb": round(current / 1024, 1),
+            "traced_peak_kb": round(peak / 1024, 1),
+            "tracemalloc_overhead_kb": round(tracemalloc.get_tracemalloc_memory() / 1024, 1) if tracing else 0,
+            "snapshots": list(self._snapshots),
+        }
+
+    def _take(self, snapshot_id: str) -> Dict[str, Any]:
+        return {"id": snapshot_id, "taken_at": time.time(),
+                "snapshot": tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)}
+
+    def sample(self) -> Dict[str, Any]:
+        memory = process_memory()
+        counts = gc.get_count()
+        point = {
+            "t": round(time.time(), 1),
+            "rss_kb": memory["rss_kb"],
+            "uss_kb": memory["uss_kb"],
+            "threads": memory["threads"],
+            "open_files": memory["open_files"],
+            "gc_counts": list(counts),
+            "gc_collections": [generation["collections"] for generation in gc.get_stats()],
+        }
+        if tracemalloc.is_tracing():
+            point["traced_kb"] = round(tracemalloc.get_traced_memory()[0] / 1024, 1)
+        with self._lock:
+            self._history.append(point)
+        return point
+
+    def history(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._history)
+
+    def report(self, objects: int = 0) -> Dict[str, Any]:
+        """Current memory, GC stats, tracing status and the sampled history"""
+        report = {
+            "process": process_memory(),
+            "gc": gc_stats(),
+            "tracemalloc": self.tracing_status(),
+            "sample_interval": self.sample_interval,
+            "history": self.history(),
+        }
+        if objects:
+            report["objects"] = object_counts(objects)
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        memory = process_memory()
+        return {"enabled": True, "rss_kb": memory["rss_kb"], "uss_kb": memory["uss_kb"],
+                "tracing": tracemalloc.is_tracing(), "samples": len(self._history)}
+
+    def _sample_loop(self) -> None:
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.warning(f"⚠️ Memory sample failed: {str(e)}")
+            time.sleep(self.sample_interval)
+
+
+def build_memory_profiler_from_env() -> MemoryProfiler:
+    """Memory profiler configured from AI_MEMORY_* (AI_MEMORY_SAMPLE_INTERVAL=0 turns off the history)"""
+    return MemoryProfiler(
+        sample_interval=int(os.environ.get("AI_MEMORY_SAMPLE_INTERVAL", "60")),
+        history_size=int(os.environ.get("AI_MEMORY_HISTORY_SIZE", "1440")),
+        max_snapshots=int(os.environ.get("AI_MEMORY_MAX_SNAPSHOTS", "4"))
+    )
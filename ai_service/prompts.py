@@ -0,0 +1,181 @@
+import json
+import string
+import threading
+from typing import Any, Dict, List, Tuple
+
+from summarizer import estimate_tokens
+
+# ─── STATIC PREAMBLE ─────────────────────────────────────────────────────────
+# Identical for every request, so it forms the start of the cacheable prompt prefix
+PERSONA_PREAMBLE = """
+You are an AI Relationship Mentor based on "The Cog Effect" book knowledge.
+
+You will receive relevant excerpts from the book, then the user's profile, assessment data,
+conversation so far and their question.
+
+Please provide personalized relationship advice based on:
+1. The user's specific assessment data and profile
+2. Relevant knowledge from "The Cog Effect" book
+3. Best practices for healthy relationships
+4. Cultural sensitivity for their region and background
+
+Provide practical, actionable advice that addresses their specific situation.
+""".strip()
+
+NO_BOOK_CONTEXT = "No specific book context found."
+
+
+class PromptTemplate:
+    """A str.format-style template parsed once at import time"""
+
+    def __init__(self, template: str):
+        self.segments: List[Tuple[str, str]] = [
+            (literal, field or "") for literal, field, _, _ in string.Formatter().parse(template)
+        ]
+
+    def render(self, **fields: Any) -> str:
+        parts = []
+        for literal, field in self.segments:
+            parts.append(literal)
+            if field:
+                parts.append(str(fields[field]))
+        return "".join(parts)
+
+
+BOOK_CONTEXT_TEMPLATE = PromptTemplate("""Book Knowledge Context:
+{book_context}""")
+
+# Per-user and per-request fields come last so they never break the shared prefix
+USER_TEMPLATE = PromptTemplate("""User Context:
+- Name: {name}
+- Gender: {gender}
+- Region: {region}
+- Cultural Context: {cultural_context}
+
+Assessment Data:
+- Assessment Scores: {assessment_scores}{optional_scores}
+
+Conversation Summary:
+{summary}
+
+Recent Conversation:
+{recent_history}
+
+User Question: {user_input}""")
+
+
+def _optional_score_lines(user_context: Dict[str, Any]) -> str:
+    """Delusional and compatibility score lines, leaving out scores the client sent as null or not at all"""
+    lines = []
+    if user_context.get('delusional_score') is not None:
+        lines.append(f"\n- Delusional Score: {user_context['delusional_score']}")
+    if user_context.get('compatibility_score') is not None:
+        lines.append(f"\n- Compatibility Score: {user_context['compatibility_score']}%")
+    return "".join(lines)
+
+
+class PromptBuilder:
+    """Builds chat messages as a stable system prefix followed by per-user content.
+
+    Tracks how much of each prompt is stable prefix so upstream prompt caching
+    can be measured.
+    """
+
+    def __init__(self):
+        self.preamble_tokens = estimate_tokens(PERSONA_PREAMBLE)
+        self._book_context_cache: Dict[Tuple[str, ...], Tuple[str, int]] = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "built": 0,
+            "stable_prefix_tokens": 0,
+            "total_tokens": 0,
+            "upstream_prompt_tokens": 0,
+            "upstream_cached_tokens": 0,
+        }
+
+    def build(self, user_input: str, user_context: Dict[str, Any], book_chunks: List[Dict[str, str]],
+              summary: str, recent_history: str) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+        """Return (messages, prompt_stats) for a chat completion request"""
+        book_message, book_tokens = self._book_context(book_chunks)
+        profile = user_context.get('profile', {})
+        user_message = USER_TEMPLATE.render(
+            name=profile.get('name', 'User'),
+            gender=profile.get('gender', 'Not specified'),
+            region=profile.get('region', 'Not specified'),
+            cultural_context=profile.get('cultural_context', 'global'),
+            assessment_scores=json.dumps(user_context.get('assessment_scores', {})),
+            optional_scores=_optional_score_lines(user_context),
+            summary=summary or "No earlier conversation.",
+            recent_history=recent_history or "No previous messages.",
+            user_input=user_input
+        )
+        messages = [
+            {"role": "system", "content": PERSONA_PREAMBLE},
+            {"role": "system", "content": book_message},
+            {"role": "user", "content": user_message},
+        ]
+
+        stable_tokens = self.preamble_tokens + book_tokens
+        total_tokens = stable_tokens + estimate_tokens(user_message)
+        prompt_stats = {
+            "stable_prefix_tokens": stable_tokens,
+            "total_tokens": total_tokens,
+            "stable_prefix_ratio": round(stable_tokens / total_tokens, 3),
+        }
+        with self._lock:
+            self._counters["built"] += 1
+            self._counters["stable_prefix_tokens"] += stable_tokens
+            self._counters["total_tokens"] += total_tokens
+        return messages, prompt_stats
+
+    def warm(self, book_chunks: List[Dict[str, str]]) -> None:
+        """Pre-render the book context message for each single chapter"""
+        for chunk in book_chunks:
+            self._book_context([chunk])
+
+    def invalidate(self, excerpts: List[str]) -> int:
+        """Drop cached book context messages that include any of the given chapter excerpts"""
+        stale = set(excerpts)
+        with self._lock:
+            keys = [key for key in self._book_context_cache if stale.intersection(key)]
+            for key in keys:
+                del self._book_context_cache[key]
+        return len(keys)
+
+    def record_usage(self, usage: Any) -> None:
+        """Track how many prompt tokens the provider served from its prefix cache"""
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", 0) or 0
+        with self._lock:
+            self._counters["upstream_prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            self._counters["upstream_cached_tokens"] += cached
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        counters["avg_stable_prefix_ratio"] = (
+            round(counters["stable_prefix_tokens"] / counters["total_tokens"], 3)
+            if counters["total_tokens"] else 0.0
+        )
+        counters["upstream_cached_ratio"] = (
+            round(counters["upstream_cached_tokens"] / counters["upstream_prompt_tokens"], 3)
+            if counters["upstream_prompt_tokens"] else 0.0
+        )
+        return counters
+
+    def _book_context(self, book_chunks: List[Dict[str, str]]) -> Tuple[str, int]:
+        # Chapters are emitted in a fixed order so the same selection always renders
+        # to the same text, whatever order retrieval ranked them in
+        key = tuple(sorted(chunk["chapter_excerpt"] for chunk in book_chunks))
+        cached = self._book_context_cache.get(key)
+        if cached is None:
+            book_context = "\n\n".join(key) if key else NO_BOOK_CONTEXT
+            message = BOOK_CONTEXT_TEMPLATE.render(book_context=book_context)
+            cached = (message, estimate_tokens(message))
+            with self._lock:
+                if len(self._book_context_cache) >= 256:
+                    self._book_context_cache.clear()
+                self._book_context_cache[key] = cached
+        return cached
@@ -0,0 +1,505 @@
+import collections
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from flask import request
+
+from auth import AuthError, token_subscription_tier, verify_access_token
+from tracing import tracer
+from validation import MAX_USER_INPUT_CHARS, ValidationError, decode_channel_open, decode_user_context, decode_user_input
+
+try:
+    from flask_sock import Sock
+except ImportError:  # flask-sock is optional; without it the WebSocket endpoint is not registered
+    Sock = None
+
+logger = logging.getLogger(__name__)
+
+# WebSocket close codes; 4000-4999 are left to applications
+CLOSE_NORMAL = 1000
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TRY_AGAIN_LATER = 1013
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN = 4403
+CLOSE_REPLACED = 4409
+
+MAX_MESSAGE_ID_CHARS = 64
+
+
+class OutboundQueue:
+    """Frames waiting to be written to one client, bounded so a slow reader cannot grow server memory.
+
+    Token deltas are appended to the newest queued token frame of the same
+    message while it waits, so a client that reads slowly gets fewer, larger
+    frames rather than a backlog; streaming never waits on it. Other frames
+    wait for space, and the caller treats a timeout as a stalled client.
+    """
+
+    def __init__(self, max_frames: int = 32):
+        self.max_frames = max_frames
+        self.coalesced = 0
+        self.close_code: Optional[Tuple[int, str]] = None
+        self._frames: collections.deque = collections.deque()
+        self._cond = threading.Condition()
+
+    def put(self, frame: Dict[str, Any], timeout: float) -> bool:
+        """Queue a frame; False if the queue stayed full for timeout seconds or is closed"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self._frames) >= self.max_frames and self.close_code is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            if self.close_code is not None:
+                return False
+            self._frames.append(frame)
+            self._cond.notify_all()
+            return True
+
+    def put_delta(self, message_id: str, delta: str, timeout: float) -> bool:
+        with self._cond:
+            if self.close_code is not None:
+                return False
+            if self._frames:
+                tail = self._frames[-1]
+                if tail["type"] == "token" and tail["id"] == message_id:
+                    tail["delta"] += delta
+                    self.coalesced += 1
+                    return True
+        return self.put({"type": "token", "id": message_id, "delta": delta}, timeout)
+
+    def get(self) -> Optional[Dict[str, Any]]:
+        """Next frame to write; None once the queue is closed and drained"""
+        with self._cond:
+            while not self._frames and self.close_code is None:
+                self._cond.wait()
+            if not self._frames:
+                return None
+            frame = self._frames.popleft()
+            self._cond.notify_all()
+            return frame
+
+    def close(self, code: int, reason: str, discard: bool = False) -> None:
+        """Accept no more frames; the writer sends what is queued (unless discarded), then closes"""
+        with self._cond:
+            if self.close_code is None:
+                self.close_code = (code, reason)
+            if discard:
+                self._frames.clear()
+            self._cond.notify_all()
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+
+class Conversation:
+    """Server-side state of one open channel: who is talking and their current context"""
+
+    def __init__(self, conversation_id: str, user_id: Optional[str], user_context: Dict[str, Any],
+                 subscription_tier: Optional[str] = None):
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.user_context = user_context
+        self.subscription_tier = subscription_tier
+
+
+class ChannelHub:
+    """Serves WebSocket chat channels.
+
+    A client opens one authenticated channel per conversation and then sends
+    only new messages and context changes; history and context stay on the
+    server for the life of the channel (history in the session store, so a
+    reconnect resumes it). Replies stream back as token frames. A second
+    channel for the same conversation replaces the first.
+
+    `open_conversation(conversation_id, chat_history, history_turns)` returns
+    False when the client expects history the server no longer has.
+    `respond(conversation, user_input, emit)` generates one reply, calling
+    `emit(delta)` for each piece of text (emit returns False to stop early),
+    and returns the fields of the closing "done" frame.
+    """
+
+    def __init__(self, open_conversation: Callable[[str, list, int], bool],
+                 respond: Callable[[Conversation, str, Callable[[str], bool]], Dict[str, Any]],
+                 jwt_secret: str = "", allowed_origins: Iterable[str] = (), heartbeat_seconds: float = 20.0,
+                 idle_seconds: float = 300.0, send_timeout: float = 10.0, max_queued_frames: int = 32,
+                 max_connections: int = 2):
+        self.open_conversation = open_conversation
+        self.respond = respond
+        self.jwt_secret = jwt_secret
+        self.allowed_origins = set(allowed_origins)
+        self.heartbeat_seconds = heartbeat_seconds
+        self.idle_seconds = idle_seconds
+        self.send_timeout = send_timeout
+        self.max_queued_frames = max_queued_frames
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self._connections = 0
+        self._channels: Dict[str, "MentorChannel"] = {}
+        self._counters = {"opened": 0, "rejected_origin": 0, "rejected_capacity": 0, "auth_failures": 0,
+                          "replaced": 0, "messages": 0, "cancelled": 0, "token_frames": 0,
+                          "frames_coalesced": 0, "slow_clients": 0, "idle_closed": 0}
+
+    def serve(self, ws: Any, origin: Optional[str]) -> None:
+        """Run one connection until it closes; called on the request's thread"""
+        if origin and self.allowed_origins and origin not in self.allowed_origins:
+            self._count("rejected_origin")
+            ws.close(reason=CLOSE_POLICY_VIOLATION, message="Origin not allowed")
+            return
+        with self._lock:
+            if self._connections >= self.max_connections:
+                self._counters["rejected_capacity"] += 1
+                full = True
+            else:
+                self._connections += 1
+                full = False
+        if full:
+            # Each open channel holds a server thread; the client should retry later or use /api/chat
+            ws.close(reason=CLOSE_TRY_AGAIN_LATER, message="Too many open channels")
+            return
+        try:
+            MentorChannel(ws, self).run()
+        finally:
+            with self._lock:
+                self._connections -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": True,
+                "open_channels": self._connections,
+                "conversations": len(self._channels),
+                "max_connections": self.max_connections,
+                "authenticated": bool(self.jwt_secret),
+                **self._counters,
+            }
+
+    def _authenticate(self, access_token: str) -> Dict[str, Any]:
+        """The caller's verified token claims, or {} when authentication is not configured"""
+        if not self.jwt_secret:
+            return {}
+        return verify_access_token(access_token, self.jwt_secret)
+
+    def _register(self, channel: "MentorChannel") -> None:
+        conversation = channel.conversation
+        with self._lock:
+            previous = self._channels.get(conversation.conversation_id)
+            if previous is not None and previous.conversation.user_id != conversation.user_id:
+                raise AuthError("Conversation belongs to another user")
+            self._channels[conversation.conversation_id] = channel
+        if previous is not None:
+            self._count("replaced")
+            previous.close(CLOSE_REPLACED, "Conversation opened on another connection")
+
+    def _unregister(self, channel: "MentorChannel") -> None:
+        if channel.conversation is None:
+            return
+        with self._lock:
+            if self._channels.get(channel.conversation.conversation_id) is channel:
+                del self._channels[channel.conversation.conversation_id]
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+
+class MentorChannel:
+    """One open WebSocket: a receive loop on the request thread and a writer thread.
+
+    Replies are generated on the receive thread; between token frames it
+    checks for pings and cancels without blocking, so only one reply per
+    channel runs at a time and further messages are refused as busy.
+    """
+
+    def __init__(self, ws: Any, hub: ChannelHub):
+        self.ws = ws
+        self.hub = hub
+        self.conversation: Optional[Conversation] = None
+        self.outbound = OutboundQueue(hub.max_queued_frames)
+        self._closing = threading.Event()
+        self._send_started: Optional[float] = None
+        self._aborted = False
+        self._last_activity = time.monotonic()
+        self._streaming: Optional[str] = None
+        self._cancelled = False
+        self._draft: Tuple[Optional[str], str] = (None, "")
+        self._writer = threading.Thread(target=self._write_loop, name="ws-writer", daemon=True)
+
+    def run(self) -> None:
+        self._writer.start()
+        try:
+            if self._open():
+                self._receive_loop()
+        except Exception as e:
+            if self.ws.connected:
+                logger.error(f"❌ Chat channel error: {str(e)}")
+        finally:
+            self.hub._unregister(self)
+            self.hub._count("frames_coalesced", self.outbound.coalesced)
+            self.close(CLOSE_NORMAL, "")
+            self._writer.join(self.hub.send_timeout)
+
+    def close(self, code: int, reason: str) -> None:
+        """Close after the frames already queued; safe from any thread"""
+        self.outbound.close(code, reason)
+        self._closing.set()
+
+    # ─── Receiving ──────────────────────────────────────────────────────────
+    def _open(self) -> bool:
+        frame = self._next_frame(self.hub.heartbeat_seconds)
+        if frame is None or frame.get("type") != "open":
+            self._error("open_required", "The first frame must be {\"type\": \"open\", ...}")
+            self.close(CLOSE_POLICY_VIOLATION, "Open frame required")
+            return False
+        try:
+            request = decode_channel_open(frame)
+            claims = self.hub._authenticate(request.access_token)
+        except ValidationError as e:
+            self._error("invalid", str(e), field=e.field_name)
+            self.close(CLOSE_POLICY_VIOLATION, "Invalid open frame")
+            return False
+        except AuthError as e:
+            self.hub._count("auth_failures")
+            self._error("unauthorized", str(e))
+            self.close(CLOSE_UNAUTHORIZED, "Unauthorized")
+            return False
+
+        conversation_id = request.conversation_id or uuid.uuid4().hex
+        if not self.hub.open_conversation(conversation_id, request.chat_history, request.history_turns):
+            self._error("conversation_expired", "Conversation history not found on server, resend chat_history",
+                        conversation_id=conversation_id)
+            self.close(CLOSE_NORMAL, "Conversation expired")
+            return False
+        # With verified tokens only their tier claim counts; the declared tier is used only without them
+        tier = token_subscription_tier(claims) if self.hub.jwt_secret else request.subscription_tier
+        self.conversation = Conversation(conversation_id, claims.get("sub"), request.user_context, tier)
+        try:
+            self.hub._register(self)
+        except AuthError as e:
+            self.conversation = None
+            self.hub._count("auth_failures")
+            self._error("forbidden", str(e))
+            self.close(CLOSE_FORBIDDEN, "Forbidden")
+            return False
+
+        self.hub._count("opened")
+        self._send({
+            "type": "ready",
+            "conversation_id": conversation_id,
+            "heartbeat_seconds": self.hub.heartbeat_seconds,
+            "max_user_input_chars": MAX_USER_INPUT_CHARS,
+        })
+        return True
+
+    def _receive_loop(self) -> None:
+        while not self._closing.is_set():
+            frame = self._next_frame(self.hub.heartbeat_seconds)
+            if frame is None:
+                if self._writer_stalled():
+                    self._abort_slow_client()
+                elif time.monotonic() - self._last_activity > self.hub.idle_seconds:
+                    self.hub._count("idle_closed")
+                    self.close(CLOSE_NORMAL, "Idle timeout")
+                continue
+            self._handle(frame)
+
+    def _next_frame(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """The next client frame, or None if none arrived in time (ConnectionClosed once the client is gone)"""
+        raw = self.ws.receive(timeout=timeout)
+        if raw is None:
+            return None
+        self._last_activity = time.monotonic()
+        try:
+            frame = json.loads(raw)
+        except ValueError:
+            frame = None
+        if not isinstance(frame, dict):
+            self._error("invalid", "Frames must be JSON objects")
+            return None
+        return frame
+
+    def _handle(self, frame: Dict[str, Any]) -> None:
+        kind = frame.get("type")
+        if kind == "ping":
+            self._send({"type": "pong", "ts": frame.get("ts")})
+        elif kind == "message":
+            self._message(frame)
+        elif kind == "input_delta":
+            self._input_delta(frame)
+        elif kind == "context":
+            self._update_context(frame)
+        elif kind == "cancel":
+            if self._streaming is not None and frame.get("id") in (None, self._streaming):
+                self._cancelled = True
+        else:
+            self._error("invalid", f"Unknown frame type: {kind}")
+
+    def _message(self, frame: Dict[str, Any]) -> None:
+        message_id = self._message_id(frame)
+        if message_id is None:
+            return
+        if self._streaming is not None:
+            self._error("busy", "A reply is still streaming; wait for done or send cancel", id=message_id)
+            return
+        draft_id, draft = self._draft
+        user_input = frame.get("user_input")
+        if user_input is None and draft_id == message_id:
+            user_input = draft
+        self._draft = (None, "")
+        try:
+            user_input = decode_user_input(user_input if user_input is not None else "")
+        except ValidationError as e:
+            self._error("invalid", str(e), id=message_id, field=e.field_name)
+            return
+        self._respond(message_id, user_input, frame.get("traceparent"))
+
+    def _input_delta(self, frame: Dict[str, Any]) -> None:
+        """A piece of a message the user is still typing; "message" without user_input sends it"""
+        message_id = self._message_id(frame)
+        delta = frame.get("delta")
+        if message_id is None or not isinstance(delta, str):
+            return
+        draft_id, draft = self._draft
+        draft = (draft if draft_id == message_id else "") + delta
+        if len(draft) > MAX_USER_INPUT_CHARS:
+            self._draft = (None, "")
+            self._error("invalid", f"user_input exceeds {MAX_USER_INPUT_CHARS} characters", id=message_id)
+            return
+        self._draft = (message_id, draft)
+
+    def _update_context(self, frame: Dict[str, Any]) -> None:
+        """Merge changed profile fields and scores into the channel's user_context"""
+        try:
+            update = decode_user_context(frame.get("user_context"))
+        except ValidationError as e:
+            self._error("invalid", str(e), field=e.field_name)
+            return
+        current = self.conversation.user_context
+        merged = {
+            **current,
+            "profile": {**current.get("profile", {}), **update.get("profile", {})},
+            "assessment_scores": {**current.get("assessment_scores", {}), **update.get("assessment_scores", {})},
+        }
+        for key in ("delusional_score", "compatibility_score"):
+            if update.get(key) is not None:
+                merged[key] = update[key]
+        self.conversation.user_context = merged
+        self._send({"type": "context_updated"})
+
+    def _message_id(self, frame: Dict[str, Any]) -> Optional[str]:
+        message_id = frame.get("id", uuid.uuid4().hex)
+        if not isinstance(message_id, str) or not message_id or len(message_id) > MAX_MESSAGE_ID_CHARS:
+            self._error("invalid", f"id must be a string of at most {MAX_MESSAGE_ID_CHARS} characters", field="id")
+            return None
+        return message_id
+
+    # ─── Replying ───────────────────────────────────────────────────────────
+    def _respond(self, message_id: str, user_input: str, traceparent: Optional[str]) -> None:
+        self.hub._count("messages")
+        self._streaming, self._cancelled = message_id, False
+        span = tracer.begin_trace("WS /ws/chat message", traceparent if isinstance(traceparent, str) else None,
+                                  endpoint="chat_socket")
+        try:
+            self._send({"type": "start", "id": message_id, "traceparent": span.traceparent})
+            done = self.hub.respond(self.conversation, user_input, lambda delta: self._emit(message_id, delta))
+            if self._cancelled:
+                self.hub._count("cancelled")
+            self._send({"type": "done", "id": message_id, "conversation_id": self.conversation.conversation_id,
+                        **done})
+        except Exception as e:
+            span.status = "error"
+            logger.error(f"❌ Chat channel reply failed: {str(e)}")
+            self._error("internal", f"Internal server error: {str(e)}", id=message_id)
+        finally:
+            self._streaming = None
+            tracer.end(span)
+
+    def _emit(self, message_id: str, delta: str) -> bool:
+        """Queue a token delta; False tells the generator to stop"""
+        if not self.outbound.put_delta(message_id, delta, self.hub.send_timeout):
+            self._abort_slow_client()
+            return False
+        self.hub._count("token_frames")
+        self._poll_control()
+        return not self._cancelled and not self._closing.is_set()
+
+    def _poll_control(self) -> None:
+        """Handle frames that arrived mid-reply without waiting for more"""
+        while not self._closing.is_set():
+            raw = self.ws.receive(timeout=0)
+            if raw is None:
+                return
+            self._last_activity = time.monotonic()
+            try:
+                frame = json.loads(raw)
+            except ValueError:
+                frame = None
+            if isinstance(frame, dict):
+                self._handle(frame)
+            else:
+                self._error("invalid", "Frames must be JSON objects")
+
+    # ─── Sending ────────────────────────────────────────────────────────────
+    def _send(self, frame: Dict[str, Any]) -> None:
+        if not self.outbound.put(frame, self.hub.send_timeout) and not self._closing.is_set():
+            self._abort_slow_client()
+
+    def _error(self, code: str, message: str, **fields: Any) -> None:
+        self._send({"type": "error", "code": code, "error": message,
+                    **{key: value for key, value in fields.items() if value is not None}})
+
+    def _write_loop(self) -> None:
+        try:
+            while True:
+                frame = self.outbound.get()
+                if frame is None:
+                    break
+                self._send_started = time.monotonic()
+                self.ws.send(json.dumps(frame, ensure_ascii=False))
+                self._send_started = None
+            code, reason = self.outbound.close_code
+            self.ws.close(reason=code, message=reason or None)
+        except Exception:
+            pass  # The client went away; the receive loop sees the closed connection
+        finally:
+            self._closing.set()
+
+    def _writer_stalled(self) -> bool:
+        started = self._send_started
+        return started is not None and time.monotonic() - started > self.hub.send_timeout
+
+    def _abort_slow_client(self) -> None:
+        """Drop a client that stopped reading; unblocks a writer stuck in send"""
+        if self._aborted:
+            return
+        self._aborted = True
+        self.hub._count("slow_clients")
+        logger.warning("⚠️ Closing chat channel: client is not reading")
+        self.outbound.close(CLOSE_TRY_AGAIN_LATER, "Client too slow", discard=True)
+        self._closing.set()
+        try:
+            self.ws.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def register_chat_socket(app: Any, hub: ChannelHub, max_message_bytes: int, path: str = "/ws/chat") -> bool:
+    """Add the WebSocket route when flask-sock is installed; False if it is not"""
+    if Sock is None:
+        return False
+    # Protocol-level pings; a client that misses a pong is disconnected
+    app.config["SOCK_SERVER_OPTIONS"] = {"ping_interval": hub.heartbeat_seconds,
+                                         "max_message_size": max_message_bytes}
+    sock = Sock(app)
+
+    @sock.route(path)
+    def chat_socket(ws):
+        hub.serve(ws, request.headers.get("Origin"))
+
+    return True
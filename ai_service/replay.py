@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Replay captured traffic (AI_CAPTURE_DIR, see traffic_capture.py) against a
+running instance, at the captured pace and faster, to size capacity from the
+real mix of requests:
+
+    python replay.py captures/ --target http://localhost:8000 --speeds 1,5,10
+    python replay.py captures/capture-20250501-100000-42.jsonl.gz --limit 2000 --output curves.json
+
+Point the instance at stub_llm.py (AI_LLM_ENDPOINTS) so no real model is
+called. Each record becomes a request of the same shape: message and history
+lengths, score categories, conversation grouping and endpoint. The text is
+generated from the record's hashes, so a replay sends the same requests every
+time and a question asked twice in the capture is asked twice in the replay.
+
+Requests are sent open-loop at their captured offsets divided by the speed,
+whatever the instance's latency, and latency is measured from the scheduled
+send time. One JSON line is printed per speed: throughput, latency
+percentiles, status codes and the AI/fallback mix next to the captured one.
+A turn that reaches the server before its conversation's previous turn was
+stored gets a 409 and resends the full history, as the web client does; those
+are counted under "conversation_expired" and kept out of the latency samples
+when the resend fails too.
+"""
+
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from traffic_capture import read_captures
+from validation import MAX_BODY_BYTES, MAX_HISTORY_TURNS, MAX_MESSAGE_CHARS
+
+logger = logging.getLogger("replay")
+
+ENDPOINT_PATHS = {
+    "chat": "/api/chat",
+    "submit_chat_job": "/api/chat/jobs",
+    "get_chapter_recommendation": "/api/recommendation",
+}
+
+# Filler for generated questions and history; only lengths and repeats matter
+WORDS = ("how", "can", "we", "talk", "about", "trust", "when", "my", "partner", "feels", "distant", "and",
+         "what", "should", "i", "work", "on", "next", "to", "build", "better", "communication", "habits",
+         "together", "this", "week", "after", "an", "argument", "about", "money", "family", "time")
+
+
+def filler_text(seed: str, chars: int) -> str:
+    """Deterministic text of exactly `chars` characters"""
+    if chars <= 0:
+        return ""
+    rng = random.Random(seed)
+    words: List[str] = []
+    length = -1
+    while length < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:chars]
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def latency_summary(latencies_ms: List[float]) -> Dict[str, Optional[float]]:
+    values = sorted(latencies_ms)
+    return {
+        "p50_ms": percentile(values, 0.50),
+        "p90_ms": percentile(values, 0.90),
+        "p95_ms": percentile(values, 0.95),
+        "p99_ms": percentile(values, 0.99),
+        "max_ms": values[-1] if values else None,
+    }
+
+
+def build_request(record: Dict[str, Any], run_id: str,
+                  seeded: Dict[str, int]) -> Tuple[str, Dict[str, Any], Optional[List[Dict[str, str]]]]:
+    """(path, JSON body, history to resend on a 409) for a captured record.
+
+    `seeded` maps this run's conversations to the turns the server will hold
+    once their last planned request is answered.
+    """
+    seed = record.get("input_hash") or str(record.get("t"))
+    scores = {}
+    categories = list(record.get("categories") or [])
+    count = max(int(record.get("score_categories") or 0), len(categories))
+    rng = random.Random(f"scores-{seed}")
+    for category in categories:
+        scores[category] = rng.randint(20, 95)
+    # Slots the capture only counted get names outside the book's chapters so they never pick one
+    for index in range(len(scores), count):
+        scores[f"category_{index}"] = rng.randint(20, 95)
+
+    if record.get("endpoint") == "get_chapter_recommendation":
+        return ENDPOINT_PATHS["get_chapter_recommendation"], {"assessment_scores": scores, "user_context": {}}, None
+
+    # The run id keeps the job queue from answering one run's jobs with another's
+    user_context: Dict[str, Any] = {"profile": {"name": f"Replay {run_id}"}, "assessment_scores": scores}
+    if record.get("assessment_type") not in (None, "unknown", "other"):
+        user_context["assessment_type"] = record["assessment_type"]
+    # A server-side history can outgrow what a client may send; keep the seed within the request limits
+    history_messages = min(int(record.get("history_messages") or 0), MAX_HISTORY_TURNS)
+    per_message = min(int(record.get("history_chars") or 0) // max(history_messages, 1), MAX_MESSAGE_CHARS,
+                      (MAX_BODY_BYTES // 2) // max(history_messages, 1))
+    history = [{"role": "user" if i % 2 == 0 else "assistant",
+                "content": filler_text(f"history-{seed}-{i}", per_message) or "."}
+               for i in range(history_messages)]
+    body: Dict[str, Any] = {"user_input": filler_text(seed, int(record.get("input_chars") or 1)) or "?",
+                            "user_context": user_context}
+    path = ENDPOINT_PATHS.get(record.get("endpoint"), "/api/chat")
+    conversation = record.get("conversation")
+    if not conversation:
+        body["chat_history"] = history
+        return path, body, None
+
+    history_turns = int(record.get("history_turns") or history_messages)
+    body["conversation_id"] = f"replay-{run_id}-{conversation}"
+    body["history_turns"] = history_turns
+    # First sight in this run, or a gap left by sampled capture: send the history up front.
+    # Otherwise the server has it once the previous turn is answered, and a 409 resends it.
+    if seeded.get(conversation) != history_turns:
+        body["chat_history"] = history
+    seeded[conversation] = history_turns + 2
+    return path, body, history
+
+
+class Replayer:
+    """Sends one speed's worth of requests and collects their outcomes"""
+
+    def __init__(self, target: str, concurrency: int, timeout: float):
+        self.target = target.rstrip("/")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def send(self, path: str, body: Dict[str, Any], scheduled: float,
+             resend: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+        outcome: Dict[str, Any] = {"path": path}
+        try:
+            response = self._session().post(self.target + path, json=body, timeout=self.timeout)
+            outcome["status"] = response.status_code
+            data = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+            if response.status_code == 409 and data.get("code") == "conversation_expired" and resend is not None:
+                # The previous turn has not been stored yet (or was never captured); resend the
+                # full history like the web client does
+                outcome["resent_history"] = True
+                response = self._session().post(self.target + path, json={**body, "chat_history": resend},
+                                                timeout=self.timeout)
+                outcome["status"] = response.status_code
+                data = (response.json() if response.headers.get("content-type", "").startswith("application/json")
+                        else {})
+            if response.status_code == 202 and data.get("poll_url"):
+                # A job counts as done when its result is ready
+                while True:
+                    poll = self._session().get(f"{self.target}{data['poll_url']}", params={"wait": 30},
+                                               timeout=self.timeout)
+                    outcome["status"] = poll.status_code
+                    data = poll.json() if poll.status_code == 200 else {}
+                    if data.get("status") not in ("queued", "running"):
+                        break
+                data = data.get("result") or {}
+            outcome["response_type"] = data.get("response_type")
+        except (requests.RequestException, ValueError) as e:
+            outcome["status"] = "error"
+            outcome["error"] = type(e).__name__
+        outcome["latency_ms"] = (time.perf_counter() - scheduled) * 1000
+        return outcome
+
+    def run(self, records: List[Dict[str, Any]], speed: float) -> Dict[str, Any]:
+        run_id = uuid.uuid4().hex[:8]
+        seeded: Dict[str, int] = {}
+        planned = [build_request(record, run_id, seeded) for record in records]
+        first_t = records[0]["t"]
+        span = records[-1]["t"] - first_t
+        outcomes: List[Dict[str, Any]] = []
+        lock = threading.Lock()
+
+        def finish(future) -> None:
+            with lock:
+                outcomes.append(future.result())
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for record, (path, body, resend) in zip(records, planned):
+                scheduled = started + (record["t"] - first_t) / speed
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.send, path, body, scheduled, resend).add_done_callback(finish)
+        elapsed = time.perf_counter() - started
+
+        statuses = Counter(str(outcome["status"]) for outcome in outcomes)
+        succeeded = [outcome for outcome in outcomes if outcome["status"] in (200, 202)]
+        response_types = Counter(outcome.get("response_type") for outcome in succeeded)
+        # A conversation that is still 409 after resending says nothing about serving latency
+        answered = [outcome for outcome in outcomes if outcome["status"] != 409]
+        by_path: Dict[str, List[float]] = {}
+        for outcome in answered:
+            by_path.setdefault(outcome["path"], []).append(outcome["latency_ms"])
+        return {
+            "speed": speed,
+            "requests": len(outcomes),
+            "offered_rps": round(len(records) / (span / speed), 2) if span else None,
+            "achieved_rps": round(len(outcomes) / elapsed, 2),
+            "elapsed_s": round(elapsed, 2),
+            "statuses": dict(statuses),
+            "error_rate": round(1 - len(succeeded) / len(outcomes), 4) if outcomes else None,
+            "conversation_expired": {
+                "resent": sum(1 for outcome in outcomes if outcome.get("resent_history")),
+                "unresolved": statuses.get("409", 0),
+            },
+            "fallback_ratio": round(response_types["book_fallback"] / len(succeeded), 4) if succeeded else None,
+            "latency": {key: round(value, 1) if value is not None else None
+                        for key, value in latency_summary([o["latency_ms"] for o in answered]).items()},
+            "p95_ms_by_endpoint": {path: round(percentile(sorted(values), 0.95), 1)
+                                   for path, values in by_path.items()},
+        }
+
+
+def capture_profile(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """What the captured traffic looked like, to set the stub (e.g. --error-rate) and read the curves against"""
+    span = records[-1]["t"] - records[0]["t"] if records else 0
+    succeeded = [record for record in records if record.get("status") in (200, 202)]
+    fallbacks = sum(1 for record in succeeded if record.get("response_type") == "book_fallback")
+    input_chars = sorted(record.get("input_chars") or 0 for record in records)
+    history_messages = sorted(record.get("history_messages") or 0 for record in records)
+    return {
+        "requests": len(records),
+        "span_s": round(span, 1),
+        "rps": round(len(records) / span, 2) if span else None,
+        "endpoints": dict(Counter(record.get("endpoint") for record in records)),
+        "fallback_ratio": round(fallbacks / len(succeeded), 4) if succeeded else None,
+        "input_chars_p50": percentile(input_chars, 0.5),
+        "input_chars_p95": percentile(input_chars, 0.95),
+        "history_messages_p50": percentile(history_messages, 0.5),
+        "history_messages_p95": percentile(history_messages, 0.95),
+        "latency": latency_summary([record["duration_ms"] for record in records if "duration_ms" in record]),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay captured traffic against a running instance")
+    parser.add_argument("captures", nargs="+", help="Capture files, or directories of them")
+    parser.add_argument("--target", default="http://localhost:8000", help="Base URL of the instance")
+    parser.add_argument("--speeds", default="1,5,10", help="Comma-separated replay speeds")
+    parser.add_argument("--limit", type=int, default=0, help="Replay only the first N requests")
+    parser.add_argument("--concurrency", type=int, default=256, help="Most requests in flight at once")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds")
+    parser.add_argument("--cooldown", type=float, default=5, help="Seconds to wait between speeds")
+    parser.add_argument("--output", help="Also write the profile and curves to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    records = sorted((record for record in read_captures(args.captures) if "t" in record), key=lambda r: r["t"])
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print(json.dumps({"error": "No captured requests found"}))
+        sys.exit(1)
+
+    profile = capture_profile(records)
+    print(json.dumps({"captured": profile}))
+    replayer = Replayer(args.target, args.concurrency, args.timeout)
+    curves = []
+    for index, speed in enumerate(float(value) for value in args.speeds.split(",")):
+        if index:
+            time.sleep(args.cooldown)
+        curves.append(replayer.run(records, speed))
+        print(json.dumps(curves[-1]), flush=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"captured": profile, "curves": curves}, f, indent=2)
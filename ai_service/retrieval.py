@@ -0,0 +1,104 @@
+import re
+import threading
+from typing import Any, Collection, Dict, List, Tuple
+
+_TOKEN_RE = re.compile(r"\S+")
+
+
+def _document_text(doc: Dict[str, Any]) -> str:
+    return f"{doc['chapter_title']} {doc['chapter_excerpt']}".lower()
+
+
+class RetrievalIndex:
+    """Term -> matching document ids over the book content.
+
+    Scoring matches the original keyword relevance used by get_relevant_context:
+    a document scores one point per query word that occurs anywhere in its
+    lowercased title and text. Postings for every corpus token are built up
+    front; other query words are resolved by a substring scan once and memoized.
+    """
+
+    def __init__(self, documents: List[Dict[str, Any]], max_cached_terms: int = 10000):
+        self.documents = documents
+        self.max_cached_terms = max_cached_terms
+        self.texts = [_document_text(doc) for doc in documents]
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Tuple[int, ...]] = {term: self._scan(term) for term in self._vocabulary()}
+        self._corpus_terms = len(self._postings)
+
+    def rebuild(self, documents: List[Dict[str, Any]], changed_ids: Collection[int]) -> "RetrievalIndex":
+        """A new index over an updated document list, rescanning only the changed documents.
+
+        Documents keep their ids between versions, so postings of unchanged
+        documents carry over. If documents were added or removed, the new
+        index is built from scratch. This index is left untouched, so searches
+        in flight can keep using it.
+        """
+        if len(documents) != len(self.documents):
+            return RetrievalIndex(documents, self.max_cached_terms)
+        changed = sorted(changed_ids)
+        index = RetrievalIndex.__new__(RetrievalIndex)
+        index.documents = documents
+        index.max_cached_terms = self.max_cached_terms
+        index.texts = list(self.texts)
+        for doc_id in changed:
+            index.texts[doc_id] = _document_text(documents[doc_id])
+        index._lock = threading.Lock()
+        with self._lock:
+            previous = dict(self._postings)
+
+        def updated(term: str) -> Tuple[int, ...]:
+            doc_ids = previous.get(term)
+            if doc_ids is None:
+                return index._scan(term)
+            kept = set(doc_ids).difference(changed)
+            kept.update(doc_id for doc_id in changed if term in index.texts[doc_id])
+            return tuple(sorted(kept))
+
+        # Corpus vocabulary first, then previously memoized query terms, as __init__ lays them out
+        index._postings = {term: updated(term) for term in index._vocabulary()}
+        index._corpus_terms = len(index._postings)
+        for term in previous:
+            if term not in index._postings:
+                index._postings[term] = updated(term)
+        return index
+
+    def postings(self, term: str) -> Tuple[int, ...]:
+        """Ids of documents whose text contains term"""
+        doc_ids = self._postings.get(term)
+        if doc_ids is None:
+            doc_ids = self._scan(term)
+            with self._lock:
+                if len(self._postings) - self._corpus_terms >= self.max_cached_terms:
+                    # Drop memoized query-only terms, keep the corpus vocabulary
+                    self._postings = dict(list(self._postings.items())[:self._corpus_terms])
+                self._postings[term] = doc_ids
+        return doc_ids
+
+    def search(self, query: str, max_chunks: int = 2) -> List[Dict[str, Any]]:
+        """Top documents by keyword relevance, best first"""
+        return [self.documents[doc_id] for doc_id in self.search_ids(query, max_chunks)]
+
+    def search_ids(self, query: str, max_chunks: int = 2) -> List[int]:
+        """Ids of the top documents by keyword relevance, best first"""
+        scores: Dict[int, int] = {}
+        for word in query.lower().split():
+            for doc_id in self.postings(word):
+                scores[doc_id] = scores.get(doc_id, 0) + 1
+        # Ties keep document order, as the original stable sort did
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [doc_id for doc_id, _ in ranked[:max_chunks]]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self.documents),
+            "corpus_terms": self._corpus_terms,
+            "cached_query_terms": len(self._postings) - self._corpus_terms,
+        }
+
+    def _vocabulary(self) -> Dict[str, None]:
+        """Distinct corpus tokens in first-seen order"""
+        return dict.fromkeys(term for text in self.texts for term in _TOKEN_RE.findall(text))
+
+    def _scan(self, term: str) -> Tuple[int, ...]:
+        return tuple(doc_id for doc_id, text in enumerate(self.texts) if term in text)
@@ -0,0 +1,132 @@
+import email.utils
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import openai
+
+
+class Deadline:
+    """Overall time budget for one request, shared by all of its attempts"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+class RetryBudget:
+    """Caps retries to a fraction of request volume so outages are not amplified.
+
+    Every request deposits `ratio` tokens and every retry withdraws one, with a
+    small floor of tokens per second so low traffic can still retry.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 20.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill()
+            return round(self._tokens, 2)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._updated_at) * self.min_per_second)
+        self._updated_at = now
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, bounded by the request deadline"""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0,
+                 min_attempt_seconds: float = 2.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Don't start an attempt that has less than this long to run
+        self.min_attempt_seconds = min_attempt_seconds
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Delay before the next attempt; Retry-After from the server wins if longer"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+def is_retryable(error: Exception) -> bool:
+    """Transient upstream failures: rate limits, 5xx, timeouts and dropped connections"""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 408 or error.status_code >= 500
+    return False
+
+
+def is_endpoint_error(error: Exception) -> bool:
+    """Errors that fault the endpoint rather than the request: bad key, no access, unknown model or deployment"""
+    return isinstance(error, openai.APIStatusError) and error.status_code in (401, 403, 404)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Parse Retry-After (seconds or HTTP date) or retry-after-ms from an API error"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+def attempt_record(attempt: int, backend: str, started: float, error: Optional[Exception] = None) -> Dict[str, Any]:
+    """Timing entry for one upstream attempt"""
+    record = {
+        "attempt": attempt,
+        "backend": backend,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "outcome": "ok" if error is None else type(error).__name__,
+    }
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        record["status"] = status
+    return record
@@ -0,0 +1,223 @@
+import bisect
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from retry import Deadline
+
+logger = logging.getLogger(__name__)
+
+# Wait-time histogram bucket upper bounds, in milliseconds
+WAIT_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+DEFAULT_TIERS = {
+    # weight: share of contended capacity; reserved: slots no other tier may use;
+    # queue_seconds: longest wait before the request degrades to the book fallback
+    "premium": {"weight": 8, "reserved": 2, "max_queue": 100, "queue_seconds": 15},
+    "free": {"weight": 2, "reserved": 0, "max_queue": 20, "queue_seconds": 2},
+    # Materialized answer fills: only what the others leave over
+    "background": {"weight": 1, "reserved": 0, "max_queue": 10, "queue_seconds": 30},
+}
+
+
+class CapacityUnavailable(Exception):
+    """No model capacity for this tier within its queue limits; callers answer with the fallback"""
+
+    def __init__(self, message: str, tier: str, reason: str):
+        super().__init__(message)
+        self.tier = tier
+        self.reason = reason
+
+
+class WaitHistogram:
+    """Cumulative wait-time histogram over fixed millisecond buckets, Prometheus style"""
+
+    def __init__(self, bounds_ms=WAIT_BUCKETS_MS):
+        self.bounds_ms = bounds_ms
+        self.counts = [0] * (len(bounds_ms) + 1)
+        self.total_ms = 0.0
+
+    def observe(self, seconds: float) -> None:
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.bounds_ms, ms)] += 1
+        self.total_ms += ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        buckets, running = {}, 0
+        for bound, count in zip(list(self.bounds_ms) + ["+Inf"], self.counts):
+            running += count
+            buckets[str(bound)] = running
+        return {"buckets_ms": buckets, "count": running, "sum_ms": round(self.total_ms, 1)}
+
+
+class TierPolicy:
+    def __init__(self, name: str, weight: float = 1, reserved: int = 0, max_queue: int = 50,
+                 queue_seconds: float = 5):
+        if weight <= 0:
+            raise ValueError(f"Tier {name}: weight must be positive")
+        self.name = name
+        self.weight = weight
+        self.reserved = reserved
+        self.max_queue = max_queue
+        self.queue_seconds = queue_seconds
+
+
+class _Waiter:
+    __slots__ = ("tier", "tag", "event", "admitted")
+
+    def __init__(self, tier: str, tag: float):
+        self.tier = tier
+        self.tag = tag
+        self.event = threading.Event()
+        self.admitted = False
+
+
+class TierScheduler:
+    """Admission control for model calls, by subscription tier.
+
+    At most `capacity` calls run at once. Each tier's reserved slots are
+    usable only by that tier; the rest are shared. When callers have to
+    wait, freed slots go to waiting tiers by weighted fair queuing: each
+    waiter is tagged with a virtual finish time that advances by 1/weight
+    per request of its tier, and the smallest admissible tag runs next, so
+    under contention tiers get capacity in proportion to their weights.
+    A request that cannot be admitted within its tier's queue length or
+    queue_seconds (or its own deadline) raises CapacityUnavailable, and
+    with short free-tier limits those degrade to the fallback first.
+    """
+
+    def __init__(self, capacity: int, tiers: List[TierPolicy], default_tier: str = "free"):
+        self.capacity = capacity
+        self.tiers = {tier.name: tier for tier in tiers}
+        if default_tier not in self.tiers:
+            raise ValueError(f"Default tier {default_tier} is not configured")
+        self.default_tier = default_tier
+        self.shared_capacity = capacity - sum(tier.reserved for tier in tiers)
+        if self.shared_capacity < 0:
+            raise ValueError("Tier reservations exceed scheduler capacity")
+        self._lock = threading.Lock()
+        self._queues: Dict[str, collections.deque] = {name: collections.deque() for name in self.tiers}
+        self._in_flight = {name: 0 for name in self.tiers}
+        self._last_tag = {name: 0.0 for name in self.tiers}
+        self._virtual_time = 0.0
+        self._waits = {name: WaitHistogram() for name in self.tiers}
+        self._counters = {name: {"admitted": 0, "queued": 0, "degraded_timeout": 0, "degraded_queue_full": 0}
+                          for name in self.tiers}
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def tier_for(self, name: Optional[str]) -> str:
+        return name if name in self.tiers else self.default_tier
+
+    @contextmanager
+    def slot(self, tier: Optional[str], deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """Hold one model-call slot for the block; yields the tier actually used"""
+        if not self.enabled:
+            yield self.tier_for(tier)
+            return
+        tier = self.tier_for(tier)
+        self._acquire(tier, deadline)
+        try:
+            yield tier
+        finally:
+            with self._lock:
+                self._in_flight[tier] -= 1
+                self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "capacity": self.capacity,
+                "shared_capacity": self.shared_capacity,
+                "tiers": {
+                    name: {
+                        "weight": policy.weight,
+                        "reserved": policy.reserved,
+                        "in_flight": self._in_flight[name],
+                        "waiting": len(self._queues[name]),
+                        **self._counters[name],
+                        "wait": self._waits[name].snapshot(),
+                    }
+                    for name, policy in self.tiers.items()
+                },
+            }
+
+    def _acquire(self, tier: str, deadline: Optional[Deadline]) -> None:
+        policy = self.tiers[tier]
+        started = time.perf_counter()
+        with self._lock:
+            if not self._queues[tier] and self._can_run(tier):
+                self._in_flight[tier] += 1
+                self._counters[tier]["admitted"] += 1
+                self._waits[tier].observe(0.0)
+                return
+            if len(self._queues[tier]) >= policy.max_queue:
+                self._counters[tier]["degraded_queue_full"] += 1
+                raise CapacityUnavailable(f"Model capacity queue for {tier} is full", tier, "queue_full")
+            tag = max(self._virtual_time, self._last_tag[tier]) + 1.0 / policy.weight
+            self._last_tag[tier] = tag
+            waiter = _Waiter(tier, tag)
+            self._queues[tier].append(waiter)
+            self._counters[tier]["queued"] += 1
+
+        timeout = policy.queue_seconds
+        if deadline is not None:
+            timeout = min(timeout, deadline.remaining())
+        waiter.event.wait(max(0.0, timeout))
+        with self._lock:
+            if not waiter.admitted:
+                self._queues[tier].remove(waiter)
+                self._counters[tier]["degraded_timeout"] += 1
+                raise CapacityUnavailable(f"No model capacity for {tier} within {timeout:.1f}s", tier, "timeout")
+            self._waits[tier].observe(time.perf_counter() - started)
+
+    def _can_run(self, tier: str) -> bool:
+        if self._in_flight[tier] < self.tiers[tier].reserved:
+            return True
+        shared_in_use = sum(max(0, count - self.tiers[name].reserved) for name, count in self._in_flight.items())
+        return shared_in_use < self.shared_capacity
+
+    def _dispatch(self) -> None:
+        """Admit waiters, smallest virtual finish tag first, while slots allow"""
+        while True:
+            best: Optional[_Waiter] = None
+            for name, queue in self._queues.items():
+                if queue and (best is None or queue[0].tag < best.tag) and self._can_run(name):
+                    best = queue[0]
+            if best is None:
+                return
+            self._queues[best.tier].popleft()
+            self._in_flight[best.tier] += 1
+            self._counters[best.tier]["admitted"] += 1
+            self._virtual_time = best.tag
+            best.admitted = True
+            best.event.set()
+
+
+def build_scheduler_from_env() -> TierScheduler:
+    """Scheduler from AI_SCHEDULER_CAPACITY (0 disables) and AI_SCHEDULER_TIERS.
+
+    AI_SCHEDULER_TIERS is a JSON object of per-tier settings merged over DEFAULT_TIERS:
+    {"premium": {"weight", "reserved", "max_queue", "queue_seconds"}, ...}
+    """
+    capacity = int(os.environ.get("AI_SCHEDULER_CAPACITY", "8"))
+    tiers = {name: dict(policy) for name, policy in DEFAULT_TIERS.items()}
+    for name, policy in json.loads(os.environ.get("AI_SCHEDULER_TIERS") or "{}").items():
+        tiers.setdefault(name, {}).update(policy)
+    policies = [TierPolicy(name, **policy) for name, policy in tiers.items()]
+
+    reserved = sum(policy.reserved for policy in policies)
+    if 0 < capacity <= reserved:
+        logger.warning(f"⚠️ Tier reservations ({reserved}) leave no shared slot in AI_SCHEDULER_CAPACITY={capacity}, "
+                       "ignoring reservations")
+        for policy in policies:
+            policy.reserved = 0
+    return TierScheduler(capacity, policies, os.environ.get("AI_SCHEDULER_DEFAULT_TIER", "free"))
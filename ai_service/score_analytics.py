@@ -0,0 +1,412 @@
+import bisect
+import fcntl
+import glob
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Stands for "every value" in a key's assessment type or region, e.g. (category, ALL, ALL)
+ALL = "all"
+UNKNOWN = "unknown"
+
+_SHARD_RE = re.compile(r"scores-(\d+)\.json$")
+
+Key = Tuple[str, str, str]
+
+
+class KllSketch:
+    """Mergeable streaming quantile sketch (Karnin, Lang and Liberty).
+
+    Items live in levels of compactors; an item at level h stands for 2**h
+    observations. When the sketch is full, the lowest full level is sorted
+    and every other item (from a random offset) is promoted one level up,
+    so memory stays O(k) however many values are seen, and rank error is
+    about 1.7/k of the count. Two sketches merge by concatenating levels.
+    """
+
+    def __init__(self, k: int = 200):
+        self.k = k
+        self.n = 0
+        self.levels: List[List[float]] = [[]]
+        self._size = 0
+        self._max_size = self._total_capacity()
+
+    def update(self, value: float) -> None:
+        self.levels[0].append(value)
+        self.n += 1
+        self._size += 1
+        if self._size >= self._max_size:
+            self._compress()
+
+    def merge(self, other: "KllSketch") -> None:
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.n += other.n
+        self._size = sum(len(items) for items in self.levels)
+        self._max_size = self._total_capacity()
+        while self._size >= self._max_size:
+            self._compress()
+
+    def weighted_items(self) -> Iterable[Tuple[float, int]]:
+        for level, items in enumerate(self.levels):
+            weight = 1 << level
+            for value in items:
+                yield value, weight
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"k": self.k, "n": self.n, "levels": self.levels}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "KllSketch":
+        sketch = cls(data["k"])
+        sketch.n = data["n"]
+        sketch.levels = [list(items) for items in data["levels"]] or [[]]
+        sketch._size = sum(len(items) for items in sketch.levels)
+        sketch._max_size = sketch._total_capacity()
+        return sketch
+
+    def _capacity(self, level: int) -> int:
+        # The top level holds k items; each level below holds 2/3 as many
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+
+    def _total_capacity(self) -> int:
+        return sum(self._capacity(level) for level in range(len(self.levels)))
+
+    def _compress(self) -> None:
+        for level, items in enumerate(self.levels):
+            if len(items) < self._capacity(level):
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            items.sort()
+            # An odd item out stays behind so no observation's weight is lost
+            kept = [items.pop(random.randrange(len(items)))] if len(items) % 2 else []
+            self.levels[level + 1].extend(items[random.getrandbits(1)::2])
+            self.levels[level] = kept
+            break
+        self._size = sum(len(items) for items in self.levels)
+        self._max_size = self._total_capacity()
+
+
+class Distribution:
+    """Read-only cumulative view of one or more sketches, for bisect lookups"""
+
+    __slots__ = ("values", "cumulative", "count", "built_at")
+
+    def __init__(self, sketches: Iterable[KllSketch]):
+        weights: Dict[float, int] = {}
+        count = 0
+        for sketch in sketches:
+            count += sketch.n
+            for value, weight in sketch.weighted_items():
+                weights[value] = weights.get(value, 0) + weight
+        self.values = sorted(weights)
+        # cumulative[i] is the weight of the first i values
+        self.cumulative = [0]
+        for value in self.values:
+            self.cumulative.append(self.cumulative[-1] + weights[value])
+        self.count = count
+        self.built_at = time.monotonic()
+
+    def percentile(self, score: float) -> Optional[float]:
+        """Percentile rank of a score: share below it plus half the share equal to it, 0-100"""
+        total = self.cumulative[-1]
+        if not total:
+            return None
+        below = self.cumulative[bisect.bisect_left(self.values, score)]
+        at_or_below = self.cumulative[bisect.bisect_right(self.values, score)]
+        return 100.0 * (below + at_or_below) / (2 * total)
+
+    def quantile(self, q: float) -> Optional[float]:
+        total = self.cumulative[-1]
+        if not total:
+            return None
+        index = bisect.bisect_left(self.cumulative, q * total, 1) - 1
+        return self.values[min(index, len(self.values) - 1)]
+
+
+def assessment_type(user_context: Dict[str, Any]) -> str:
+    """The assessment a set of scores came from, as the web client picks it (src/lib/assessmentType.ts)"""
+    declared = user_context.get("assessment_type")
+    if declared:
+        return declared
+    profile = user_context.get("profile") or {}
+    if profile.get("gender") == "male":
+        return "high-value-man"
+    if profile.get("gender") == "female":
+        if profile.get("region") == "africa" and profile.get("cultural_context") == "african":
+            return "bridal-price"
+        return "wife-material"
+    return UNKNOWN
+
+
+class ScoreAnalytics:
+    """Population distribution of assessment scores, from the scores requests carry.
+
+    Every category score updates a KLL sketch per (category, assessment type,
+    region), plus roll-ups with ALL in place of the type, the region or both,
+    so any lookup reads a single key. At most max_keys sketches are kept.
+
+    Request scores are whatever the client sends, so only signed-in callers
+    contribute: the caller passes the verified token's user id, and scores
+    without one are not counted. Each user counts once per assessment type
+    (the same user chatting, or resending edited scores) while they stay in
+    a bounded LRU of fingerprints, so one account moves a distribution by
+    one sample. Someone holding many accounts can still skew it.
+
+    Lookups bisect a cached cumulative view of the sketch, rebuilt at most
+    once per max_staleness seconds while the key is receiving scores.
+
+    With shard_dir set, each process snapshots its sketches to
+    scores-<pid>.json every persist_interval seconds and reads the other
+    processes' shards back, so every gunicorn worker answers from the merged
+    distribution. A starting process adopts the shards of processes that are
+    no longer running (including its own pid's from before a restart).
+    """
+
+    def __init__(self, k: int = 200, max_keys: int = 2000, dedup_entries: int = 100000,
+                 max_staleness: float = 1.0, min_samples: int = 30, shard_dir: Optional[str] = None,
+                 persist_interval: int = 60):
+        self.k = k
+        self.max_keys = max_keys
+        self.dedup_entries = dedup_entries
+        self.max_staleness = max_staleness
+        self.min_samples = min_samples
+        self.shard_dir = shard_dir
+        self.persist_interval = persist_interval
+        self._lock = threading.Lock()
+        self._sketches: Dict[Key, KllSketch] = {}
+        self._peers: Dict[Key, List[KllSketch]] = {}
+        self._views: Dict[Key, Distribution] = {}
+        self._changed: set = set()
+        self._fingerprints: "OrderedDict[int, None]" = OrderedDict()
+        self._dirty = False
+        self._last_persisted_at: Optional[float] = None
+        self._counters = {"score_sets": 0, "duplicates": 0, "unverified": 0, "scores": 0, "rejected_scores": 0,
+                          "keys_dropped": 0, "lookups": 0, "views_built": 0}
+
+        if self.shard_dir:
+            os.makedirs(self.shard_dir, exist_ok=True)
+            self._adopt_orphaned_shards()
+            self._load_peers()
+            flusher = threading.Thread(target=self._flush_loop, name="score-analytics-flush", daemon=True)
+            flusher.start()
+
+    @property
+    def shard_path(self) -> str:
+        return os.path.join(self.shard_dir, f"scores-{os.getpid()}.json")
+
+    def ingest(self, assessment_scores: Any, user_context: Dict[str, Any], contributor: Optional[str]) -> bool:
+        """Record one verified user's category scores; False when unverified, already counted or unusable"""
+        if not isinstance(assessment_scores, dict) or not assessment_scores:
+            return False
+        if not contributor:
+            self._count("unverified")
+            return False
+        profile = user_context.get("profile") or {}
+        kind = _label(assessment_type(user_context))
+        region = _label(profile.get("region"))
+        scores = [(category, float(score)) for category, score in assessment_scores.items()
+                  if isinstance(category, str) and _is_score(score)]
+        if not scores:
+            self._count("rejected_scores", len(assessment_scores))
+            return False
+        fingerprint = hash((contributor, kind))
+        with self._lock:
+            self._counters["rejected_scores"] += len(assessment_scores) - len(scores)
+            if fingerprint in self._fingerprints:
+                self._fingerprints.move_to_end(fingerprint)
+                self._counters["duplicates"] += 1
+                return False
+            self._fingerprints[fingerprint] = None
+            if len(self._fingerprints) > self.dedup_entries:
+                self._fingerprints.popitem(last=False)
+            self._counters["score_sets"] += 1
+            for category, score in scores:
+                category = category[:100]
+                for key in ((category, kind, region), (category, kind, ALL),
+                            (category, ALL, region), (category, ALL, ALL)):
+                    sketch = self._sketches.get(key)
+                    if sketch is None:
+                        if len(self._sketches) >= self.max_keys:
+                            self._counters["keys_dropped"] += 1
+                            continue
+                        sketch = self._sketches[key] = KllSketch(self.k)
+                    sketch.update(score)
+                    self._changed.add(key)
+                self._counters["scores"] += 1
+            self._dirty = True
+        return True
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] += amount
+
+    def distribution(self, category: str, kind: Optional[str] = None, region: Optional[str] = None) -> Distribution:
+        """Cached distribution for a category, optionally narrowed to one assessment type and/or region"""
+        key = (category, _label(kind, ALL), _label(region, ALL))
+        self._counters["lookups"] += 1
+        view = self._views.get(key)
+        if view is not None and (key not in self._changed or time.monotonic() - view.built_at < self.max_staleness):
+            return view
+        with self._lock:
+            own = self._sketches.get(key)
+            view = Distribution(([own] if own is not None else []) + self._peers.get(key, []))
+            self._views[key] = view
+            self._changed.discard(key)
+            self._counters["views_built"] += 1
+        return view
+
+    def percentile(self, category: str, score: float, kind: Optional[str] = None,
+                   region: Optional[str] = None) -> Dict[str, Any]:
+        """Where a score sits in its population; withheld until min_samples scores are known"""
+        view = self.distribution(category, kind, region)
+        enough = view.count >= self.min_samples
+        return {"percentile": round(view.percentile(score), 1) if enough else None, "sample_size": view.count}
+
+    def quantiles(self, category: str, kind: Optional[str] = None, region: Optional[str] = None,
+                  points: Iterable[int] = (5, 10, 25, 50, 75, 90, 95)) -> Dict[str, Any]:
+        """Score at each percentile point, for drift monitoring; withheld like percentile()"""
+        view = self.distribution(category, kind, region)
+        enough = view.count >= self.min_samples
+        return {"quantiles": {f"p{point}": view.quantile(point / 100) if enough else None for point in points},
+                "sample_size": view.count}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "keys": len(self._sketches),
+                "max_keys": self.max_keys,
+                "retained_items": sum(sketch._size for sketch in self._sketches.values()),
+                "peer_keys": len(self._peers),
+                "k": self.k,
+                "persistence": bool(self.shard_dir),
+                "last_persisted_at": self._last_persisted_at,
+                **self._counters,
+            }
+
+    def save(self) -> None:
+        """Atomically write this process's sketches to its shard"""
+        if not self.shard_dir:
+            return
+        with self._lock:
+            snapshot = [[*key, sketch.to_dict()] for key, sketch in self._sketches.items()]
+            self._dirty = False
+        tmp_path = f"{self.shard_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"pid": os.getpid(), "saved_at": time.time(), "sketches": snapshot}, f)
+        os.replace(tmp_path, self.shard_path)
+        self._last_persisted_at = time.time()
+
+    def _adopt_orphaned_shards(self) -> None:
+        """Merge in the shards of processes that have exited, then delete them once ours is saved"""
+        with open(os.path.join(self.shard_dir, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            adopted = []
+            for path, pid in _shards(self.shard_dir):
+                if pid != os.getpid() and _process_alive(pid):
+                    continue
+                sketches = _read_shard(path)
+                if sketches is None:
+                    continue
+                with self._lock:
+                    for key, sketch in sketches.items():
+                        own = self._sketches.get(key)
+                        if own is None:
+                            self._sketches[key] = sketch
+                        else:
+                            own.merge(sketch)
+                adopted.append(path)
+            if adopted:
+                self.save()
+                for path in adopted:
+                    if path != self.shard_path:
+                        os.remove(path)
+                logger.info(f"✅ Adopted {len(adopted)} score analytics shards")
+
+    def _load_peers(self) -> None:
+        """Re-read every other process's shard; their sketches join our lookups"""
+        peers: Dict[Key, List[KllSketch]] = {}
+        for path, pid in _shards(self.shard_dir):
+            if pid == os.getpid():
+                continue
+            for key, sketch in (_read_shard(path) or {}).items():
+                peers.setdefault(key, []).append(sketch)
+        with self._lock:
+            self._peers = peers
+            self._views = {}
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.persist_interval)
+            try:
+                if self._dirty:
+                    self.save()
+                self._load_peers()
+            except OSError as e:
+                logger.error(f"❌ Score analytics snapshot failed: {str(e)}")
+
+
+def _label(value: Any, default: str = UNKNOWN) -> str:
+    if not isinstance(value, str) or not value.strip():
+        return default
+    return value.strip().lower()[:40]
+
+
+def _is_score(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _shards(shard_dir: str) -> List[Tuple[str, int]]:
+    shards = []
+    for path in glob.glob(os.path.join(shard_dir, "scores-*.json")):
+        match = _SHARD_RE.search(path)
+        if match:
+            shards.append((path, int(match.group(1))))
+    return shards
+
+
+def _read_shard(path: str) -> Optional[Dict[Key, KllSketch]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+        return {(category, kind, region): KllSketch.from_dict(data)
+                for category, kind, region, data in snapshot["sketches"]}
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"⚠️ Could not load score analytics shard {path}: {str(e)}")
+        return None
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def build_score_analytics_from_env() -> ScoreAnalytics:
+    """Score analytics configured from AI_ANALYTICS_* (AI_ANALYTICS_DIR enables snapshots and worker merging)"""
+    return ScoreAnalytics(
+        k=int(os.environ.get("AI_ANALYTICS_SKETCH_K", "200")),
+        max_keys=int(os.environ.get("AI_ANALYTICS_MAX_KEYS", "2000")),
+        dedup_entries=int(os.environ.get("AI_ANALYTICS_DEDUP_ENTRIES", "100000")),
+        max_staleness=float(os.environ.get("AI_ANALYTICS_MAX_STALENESS_SECONDS", "1")),
+        min_samples=int(os.environ.get("AI_ANALYTICS_MIN_SAMPLES", "30")),
+        shard_dir=os.environ.get("AI_ANALYTICS_DIR") or None,
+        persist_interval=int(os.environ.get("AI_ANALYTICS_PERSIST_INTERVAL", "60"))
+    )
@@ -0,0 +1,230 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    """Bounded chat history for a single conversation"""
+
+    def __init__(self, max_turns: int):
+        self.turns: deque = deque(maxlen=max_turns)
+        self.summary = ""
+        self.chars = 0
+        # Every turn ever added, including those dropped or folded into the summary
+        self.total_turns = 0
+        self.updated_at = time.time()
+
+
+class SessionStore:
+    """In-memory conversation history keyed by conversation id.
+
+    Each session is a ring buffer of the most recent turns; sessions are kept
+    in global LRU order and evicted when either the session count or the total
+    stored characters exceed their limits. Optionally snapshots to disk.
+    """
+
+    def __init__(self, max_sessions: int = 1000, max_turns: int = 50,
+                 max_total_chars: int = 20_000_000, persist_path: Optional[str] = None,
+                 persist_interval: int = 60):
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.max_total_chars = max_total_chars
+        self.persist_path = persist_path
+        self.persist_interval = persist_interval
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._total_chars = 0
+        self._dirty = False
+        self._last_persisted_at: Optional[float] = None
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "turns_appended": 0,
+            "turns_dropped": 0,
+            "turns_folded": 0,
+            "evicted_lru": 0,
+            "evicted_memory": 0,
+        }
+
+        if self.persist_path:
+            self.load()
+            flusher = threading.Thread(target=self._flush_loop, name="session-flush", daemon=True)
+            flusher.start()
+
+    def has(self, conversation_id: str) -> bool:
+        with self._lock:
+            return conversation_id in self._sessions
+
+    def turn_count(self, conversation_id: str) -> Optional[int]:
+        """How many turns the conversation has had in total, or None when it is not stored"""
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            return session.total_turns if session is not None else None
+
+    def history(self, conversation_id: str) -> List[Dict[str, str]]:
+        """Return a copy of the stored turns, oldest first"""
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            if session is None:
+                self._counters["misses"] += 1
+                return []
+            self._counters["hits"] += 1
+            self._sessions.move_to_end(conversation_id)
+            return list(session.turns)
+
+    def summary(self, conversation_id: str) -> str:
+        """Rolling summary of turns already folded out of the history"""
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            return session.summary if session is not None else ""
+
+    def fold(self, conversation_id: str, folded_turns: List[Dict[str, str]], summary: str) -> bool:
+        """Replace the oldest turns of a conversation with a summary.
+
+        folded_turns must be the turns that were summarized, as returned by
+        history(); if the head of the conversation changed in the meantime
+        (turns dropped or conversation deleted) nothing is folded.
+        """
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            if session is None or len(session.turns) < len(folded_turns):
+                return False
+            if any(session.turns[i] is not turn for i, turn in enumerate(folded_turns)):
+                return False
+            for _ in folded_turns:
+                dropped = session.turns.popleft()
+                session.chars -= len(dropped["content"])
+                self._total_chars -= len(dropped["content"])
+            session.chars += len(summary) - len(session.summary)
+            self._total_chars += len(summary) - len(session.summary)
+            session.summary = summary
+            self._counters["turns_folded"] += len(folded_turns)
+            self._dirty = True
+            return True
+
+    def append(self, conversation_id: str, role: str, content: str) -> None:
+        """Add a turn to a conversation, creating the session if needed"""
+        with self._lock:
+            self._append_locked(conversation_id, role, content)
+            self._evict()
+
+    def extend(self, conversation_id: str, turns: List[Dict[str, str]], total_turns: int = 0) -> None:
+        """Seed a conversation from a client-supplied history.
+
+        total_turns is how many turns the conversation has had when `turns` is only its tail.
+        """
+        with self._lock:
+            for turn in turns:
+                self._append_locked(conversation_id, turn.get('role', 'user'), turn.get('content', ''))
+            session = self._sessions.get(conversation_id)
+            if session is not None:
+                session.total_turns = max(session.total_turns, total_turns)
+            self._evict()
+
+    def delete(self, conversation_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(conversation_id, None)
+            if session is None:
+                return False
+            self._total_chars -= session.chars
+            self._dirty = True
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "total_turns": sum(len(s.turns) for s in self._sessions.values()),
+                "total_chars": self._total_chars,
+                "max_sessions": self.max_sessions,
+                "max_turns_per_session": self.max_turns,
+                "max_total_chars": self.max_total_chars,
+                "persistence": bool(self.persist_path),
+                "last_persisted_at": self._last_persisted_at,
+                **self._counters,
+            }
+
+    def save(self) -> None:
+        """Atomically write all sessions to persist_path"""
+        if not self.persist_path:
+            return
+        with self._lock:
+            snapshot = {cid: {"summary": s.summary, "turns": list(s.turns), "total_turns": s.total_turns}
+                        for cid, s in self._sessions.items()}
+            self._dirty = False
+        tmp_path = f"{self.persist_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.persist_path)
+        self._last_persisted_at = time.time()
+
+    def load(self) -> None:
+        """Restore sessions from persist_path, if a snapshot exists"""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Could not load session snapshot: {str(e)}")
+            return
+        for conversation_id, saved in snapshot.items():
+            self.extend(conversation_id, saved["turns"], saved.get("total_turns", 0))
+            with self._lock:
+                session = self._sessions.get(conversation_id)
+                if session is not None and saved["summary"]:
+                    session.summary = saved["summary"]
+                    session.chars += len(saved["summary"])
+                    self._total_chars += len(saved["summary"])
+        self._dirty = False
+        logger.info(f"✅ Restored {len(snapshot)} chat sessions from disk")
+
+    def _append_locked(self, conversation_id: str, role: str, content: str) -> None:
+        session = self._sessions.get(conversation_id)
+        if session is None:
+            session = Session(self.max_turns)
+            self._sessions[conversation_id] = session
+        else:
+            self._sessions.move_to_end(conversation_id)
+
+        if len(session.turns) == session.turns.maxlen:
+            dropped = session.turns[0]
+            session.chars -= len(dropped["content"])
+            self._total_chars -= len(dropped["content"])
+            self._counters["turns_dropped"] += 1
+
+        session.turns.append({"role": role, "content": content})
+        session.total_turns += 1
+        session.chars += len(content)
+        session.updated_at = time.time()
+        self._total_chars += len(content)
+        self._counters["turns_appended"] += 1
+        self._dirty = True
+
+    def _evict(self) -> None:
+        # Caller must hold self._lock; the most recently used session is never evicted
+        while len(self._sessions) > self.max_sessions:
+            self._pop_oldest("evicted_lru")
+        while self._total_chars > self.max_total_chars and len(self._sessions) > 1:
+            self._pop_oldest("evicted_memory")
+
+    def _pop_oldest(self, counter: str) -> None:
+        _, session = self._sessions.popitem(last=False)
+        self._total_chars -= session.chars
+        self._counters[counter] += 1
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.persist_interval)
+            if not self._dirty:
+                continue
+            try:
+                self.save()
+            except OSError as e:
+                logger.error(f"❌ Session snapshot failed: {str(e)}")
@@ -0,0 +1,64 @@
+import logging
+import os
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional
+
+from index_snapshot import FlatRetrievalIndex, serialize_index
+
+logger = logging.getLogger(__name__)
+
+# Set by the gunicorn master for its workers: the segment holding the flat index image
+SEGMENT_ENV = "AI_SHARED_INDEX_SEGMENT"
+
+
+def publish_content_index() -> Optional[shared_memory.SharedMemory]:
+    """Build (or map) the content index in the master and copy its flat image into shared memory.
+
+    Workers forked afterwards inherit the segment name through the
+    environment and attach to it read-only. The master owns the segment and
+    must unlink it on exit.
+    """
+    from content import content_store_from_env
+
+    # The master only needs the index once; workers do their own hot reloads
+    store = content_store_from_env()
+    index = store.current.index
+    image = index.image() if isinstance(index, FlatRetrievalIndex) else serialize_index(index, store.current.digest)
+
+    name = f"lovemirror_idx_{os.getpid()}_{store.current.digest[:12]}"
+    segment = shared_memory.SharedMemory(name=name, create=True, size=len(image))
+    segment.buf[:len(image)] = image
+    os.environ[SEGMENT_ENV] = name
+    logger.info(f"✅ Shared retrieval index {name}: {len(image)} bytes, content {store.current.version}")
+    return segment
+
+
+def attach_shared_index(documents: List[Dict[str, Any]], digest: str) -> Optional[FlatRetrievalIndex]:
+    """Attach to the master's segment without copying, or None if there is none for this content"""
+    name = os.environ.get(SEGMENT_ENV)
+    if not name:
+        return None
+    try:
+        segment = shared_memory.SharedMemory(name=name)
+    except (FileNotFoundError, OSError) as e:
+        logger.warning(f"⚠️ Shared retrieval index {name} unavailable: {str(e)}")
+        return None
+    try:
+        return FlatRetrievalIndex(segment.buf, documents, digest, owner=segment)
+    except ValueError:
+        # The content file changed after the master published; this worker builds its own
+        logger.info(f"Shared retrieval index {name} is for other content, not attaching")
+        segment.close()
+        return None
+
+
+def release_shared_index(segment: Optional[shared_memory.SharedMemory]) -> None:
+    """Close and unlink the master's segment"""
+    if segment is None:
+        return
+    os.environ.pop(SEGMENT_ENV, None)
+    segment.close()
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
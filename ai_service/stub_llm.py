@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Local stub of the OpenAI chat completions API.
+Point AI_LLM_ENDPOINTS at it to exercise routing, retries and load tests
+without calling a real model:
+
+    python stub_llm.py --port 9001 --latency-ms 400 --error-rate 0.1
+    AI_LLM_ENDPOINTS='[{"name": "stub", "base_url": "http://localhost:9001/v1", "api_key": "stub"}]'
+"""
+
+import argparse
+import json
+import random
+import time
+import uuid
+
+from flask import Flask, Response, request, jsonify
+
+app = Flask(__name__)
+app.config["STUB_LATENCY_MS"] = 200
+app.config["STUB_JITTER_MS"] = 50
+app.config["STUB_ERROR_RATE"] = 0.0
+app.config["STUB_THROTTLE_RATE"] = 0.0
+app.config["STUB_TOKEN_MS"] = 20
+
+
+@app.route('/v1/models', methods=['GET'])
+def list_models():
+    """Cheap call used by the AI service to warm its connection"""
+    return jsonify({"object": "list", "data": [{"id": "stub", "object": "model"}]}), 200
+
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    """Answer like the OpenAI API after a configurable delay, sometimes failing"""
+    data = request.get_json() or {}
+    latency = app.config["STUB_LATENCY_MS"] + random.uniform(0, app.config["STUB_JITTER_MS"])
+    time.sleep(latency / 1000)
+
+    if random.random() < app.config["STUB_THROTTLE_RATE"]:
+        response = jsonify({"error": {"message": "Stub rate limit", "type": "rate_limit_error"}})
+        response.headers["retry-after"] = "1"
+        return response, 429
+
+    if random.random() < app.config["STUB_ERROR_RATE"]:
+        return jsonify({"error": {"message": "Stub backend error", "type": "server_error"}}), 503
+
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in data.get("messages", [])) // 4
+    content = "This is a stub mentor response. Try one small, consistent step with your partner this week."
+    completion_tokens = len(content) // 4
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    if data.get("stream"):
+        return stream_completion(completion_id, data.get("model", "stub"), content)
+    response = jsonify({
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": data.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    })
+    response.headers["x-request-id"] = uuid.uuid4().hex
+    return response, 200
+
+
+def stream_completion(completion_id: str, model: str, content: str) -> Response:
+    """Server-sent chunks, one word per chunk, like the OpenAI streaming API"""
+    words = content.split(" ")
+
+    def chunks():
+        for i, word in enumerate(words):
+            time.sleep(app.config["STUB_TOKEN_MS"] / 1000)
+            delta = {"content": word if i == 0 else f" {word}"}
+            yield "data: " + json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}]
+            }) + "\n\n"
+        yield "data: " + json.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+        }) + "\n\n"
+        yield "data: [DONE]\n\n"
+
+    response = Response(chunks(), mimetype="text/event-stream")
+    response.headers["x-request-id"] = uuid.uuid4().hex
+    return response
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stub OpenAI chat completions endpoint")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of calls answered 429")
+    parser.add_argument("--token-ms", type=float, default=20, help="Delay between streamed chunks")
+    args = parser.parse_args()
+
+    app.config["STUB_LATENCY_MS"] = args.latency_ms
+    app.config["STUB_JITTER_MS"] = args.jitter_ms
+    app.config["STUB_ERROR_RATE"] = args.error_rate
+    app.config["STUB_THROTTLE_RATE"] = args.throttle_rate
+    app.config["STUB_TOKEN_MS"] = args.token_ms
+    app.run(host='127.0.0.1', port=args.port, threaded=True)
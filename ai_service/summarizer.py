@@ -0,0 +1,171 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from llm_router import TIER_FAST, LLMRouter
+from sessions import SessionStore
+from token_ledger import TokenLedger
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional; fall back to a character estimate
+    _ENCODING = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count for text, exact when tiktoken is installed"""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return len(text) // 4 + 1
+
+
+def history_tokens(turns: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(turn["content"]) + 4 for turn in turns)
+
+
+def recent_turns(turns: List[Dict[str, str]], max_tokens: int) -> List[Dict[str, str]]:
+    """Newest turns of a history that fit within max_tokens, oldest first"""
+    selected = []
+    used = 0
+    for turn in reversed(turns):
+        cost = estimate_tokens(turn["content"]) + 4
+        if selected and used + cost > max_tokens:
+            break
+        selected.append(turn)
+        used += cost
+    selected.reverse()
+    return selected
+
+
+def format_turns(turns: List[Dict[str, str]]) -> str:
+    return "\n".join(f"{turn['role'].capitalize()}: {turn['content']}" for turn in turns)
+
+
+SUMMARY_MAX_TOKENS = 250
+
+
+def summarize_with_llm(router: LLMRouter, previous_summary: str, turns: List[Dict[str, str]],
+                       ledger: Optional[TokenLedger] = None) -> str:
+    """Fold turns into the running summary using the chat model.
+
+    With a ledger the call draws on the service-wide token quota (raising
+    QuotaExceeded when it is used up) and is recorded with source "summary".
+    """
+    prompt = f"""
+Update the running summary of a relationship mentoring conversation.
+Keep facts about the user's situation, concerns, goals and advice already given.
+Write at most 150 words in the third person.
+
+Current summary:
+{previous_summary or "None yet."}
+
+New messages to fold in:
+{format_turns(turns)}
+"""
+    messages = [{"role": "user", "content": prompt}]
+    reservation = ledger.reserve(None, history_tokens(messages) + SUMMARY_MAX_TOKENS, "summary") if ledger else None
+    response, backend, error = None, None, None
+    try:
+        response, backend = router.complete(
+            messages,
+            tier=TIER_FAST,
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_TOKENS,
+            timeout=30
+        )
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        if reservation is not None:
+            usage = getattr(response, "usage", None)
+            model = backend.model if backend is not None else ""
+            if usage is None and error is None:
+                ledger.settle(reservation, history_tokens(messages), SUMMARY_MAX_TOKENS, kind=TIER_FAST, model=model,
+                              estimated=True)
+            else:
+                ledger.settle(reservation, getattr(usage, "prompt_tokens", None),
+                              getattr(usage, "completion_tokens", None), kind=TIER_FAST, model=model, error=error)
+
+
+def summarize_extractive(previous_summary: str, turns: List[Dict[str, str]], max_chars: int = 1200) -> str:
+    """Model-free fallback: keep the user's questions, newest last, within max_chars"""
+    questions = [turn["content"].strip().replace("\n", " ")[:200] for turn in turns if turn["role"] == "user"]
+    lines = ([previous_summary] if previous_summary else []) + [f"User asked: {q}" for q in questions]
+    summary = "\n".join(lines)
+    return summary[-max_chars:]
+
+
+def make_summarize(router: LLMRouter,
+                   ledger: Optional[TokenLedger] = None) -> Callable[[str, List[Dict[str, str]]], str]:
+    """Summarize with the model when one is configured, extractively otherwise (also when over quota)"""
+    def summarize(previous_summary: str, turns: List[Dict[str, str]]) -> str:
+        if router.enabled:
+            try:
+                return summarize_with_llm(router, previous_summary, turns, ledger)
+            except Exception as e:
+                logger.warning(f"⚠️ Summary generation failed, using extractive summary: {str(e)}")
+        return summarize_extractive(previous_summary, turns)
+    return summarize
+
+
+class RollingSummarizer:
+    """Folds older turns of long conversations into a per-conversation summary.
+
+    Folding runs on a background thread after a turn is recorded, so the chat
+    request never waits on summarization.
+    """
+
+    def __init__(self, store: SessionStore, threshold_tokens: int = 1500, keep_recent_turns: int = 6,
+                 summarize: Callable[[str, List[Dict[str, str]]], str] = summarize_extractive):
+        self.store = store
+        self.threshold_tokens = threshold_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.summarize = summarize
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+        self._lock = threading.Lock()
+        self._in_flight: set = set()
+        self._counters = {"scheduled": 0, "folds": 0, "stale": 0, "failed": 0}
+
+    def maybe_schedule(self, conversation_id: str) -> bool:
+        """Queue a fold if the conversation's history is over the token threshold"""
+        history = self.store.history(conversation_id)
+        if len(history) <= self.keep_recent_turns or history_tokens(history) <= self.threshold_tokens:
+            return False
+        with self._lock:
+            if conversation_id in self._in_flight:
+                return False
+            self._in_flight.add(conversation_id)
+            self._counters["scheduled"] += 1
+        self._executor.submit(self._fold, conversation_id)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "threshold_tokens": self.threshold_tokens,
+                "keep_recent_turns": self.keep_recent_turns,
+                "in_flight": len(self._in_flight),
+                **self._counters,
+            }
+
+    def _fold(self, conversation_id: str) -> None:
+        outcome = "folds"
+        try:
+            history = self.store.history(conversation_id)
+            older = history[:-self.keep_recent_turns]
+            if older:
+                summary = self.summarize(self.store.summary(conversation_id), older)
+                if not self.store.fold(conversation_id, older, summary):
+                    outcome = "stale"
+        except Exception as e:
+            logger.error(f"❌ Conversation summary failed: {str(e)}")
+            outcome = "failed"
+        with self._lock:
+            self._in_flight.discard(conversation_id)
+            self._counters[outcome] += 1
@@ -0,0 +1,92 @@
+import pytest
+
+import brownout
+from brownout import FALLBACK_ONLY, LEAN_PROMPT, BrownoutController
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Monotonic time the controller windows and steps by, advanced by hand"""
+    now = [1000.0]
+    monkeypatch.setattr(brownout.time, "monotonic", lambda: now[0])
+    return now
+
+
+def controller(**overrides):
+    settings = {"slo_ms": 1000, "window_seconds": 60, "min_samples": 5, "recover_ratio": 0.7,
+                "step_down_seconds": 10, "step_up_seconds": 30, "evaluate_interval": 1}
+    settings.update(overrides)
+    return BrownoutController(**settings)
+
+
+def serve(subject, clock, latency_ms, seconds):
+    """One request a second at this latency; returns the levels seen after each"""
+    levels = []
+    for _ in range(seconds):
+        clock[0] += 1
+        subject.observe(latency_ms / 1000)
+        levels.append(subject.current().level)
+    return levels
+
+
+def test_slow_p95_steps_down_once_per_step_down_interval(clock):
+    subject = controller(max_level=LEAN_PROMPT)
+    levels = serve(subject, clock, 2000, 40)
+    # A step at 10s, then each next one needs both step_down_seconds and a fresh window of samples
+    assert levels[8] == 0 and levels[9] == 1
+    assert levels[18] == 1 and levels[19] == 2
+    assert levels[-1] == LEAN_PROMPT
+    stats = subject.stats()
+    assert stats["steps_down"] == 2
+    assert stats["transitions"][0]["reason"] == "p95 2000ms over 1000ms"
+    assert subject.current().drop_context and not subject.current().fast_model
+
+
+def test_recovery_waits_for_p95_under_the_recover_ratio(clock):
+    subject = controller()
+    serve(subject, clock, 2000, 10)
+    assert subject.current().level == 1
+
+    # Under the SLO but above 0.7 x SLO: no step either way
+    assert set(serve(subject, clock, 800, 90)) == {1}
+    levels = serve(subject, clock, 500, 90)
+    assert levels[-1] == 0
+    # The 800ms samples have to age out of the window first
+    assert levels.index(0) >= 55
+    assert subject.stats()["transitions"][-1]["reason"] == "p95 500ms recovered"
+
+
+def test_thin_traffic_steps_up_after_a_full_quiet_window(clock):
+    subject = controller()
+    serve(subject, clock, 2000, 10)
+    assert subject.current().level == 1
+
+    clock[0] += 45
+    subject.observe(0.1)
+    assert subject.current().level == 1
+    clock[0] += 20
+    subject.observe(0.1)
+    assert subject.current().level == 0
+    assert subject.stats()["transitions"][-1]["reason"] == "quiet"
+
+
+def test_pinned_level_holds_until_unpinned(clock):
+    subject = controller()
+    assert subject.pin(FALLBACK_ONLY).fallback_only
+    serve(subject, clock, 100, 120)
+    assert subject.current().level == FALLBACK_ONLY
+    assert subject.stats()["pinned"]
+
+    # Samples kept arriving while pinned, so the first step up is immediate; the next waits step_up_seconds
+    subject.pin(None)
+    levels = serve(subject, clock, 100, 40)
+    assert levels[0] == FALLBACK_ONLY - 1
+    assert levels[29] == FALLBACK_ONLY - 1 and levels[30] == FALLBACK_ONLY - 2
+    assert subject.pin(99).level == FALLBACK_ONLY
+
+
+def test_disabled_controller_ignores_latency(clock):
+    subject = controller(slo_ms=0)
+    serve(subject, clock, 60000, 60)
+    assert subject.current().level == 0
+    assert subject.stats()["observed"] == 0
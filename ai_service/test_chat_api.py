@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+# No model endpoints: every answer is the book fallback, and nothing leaves the process
+os.environ.update({"AI_LLM_ENDPOINTS": "[]", "OPENAI_API_KEY": "", "AI_MATERIALIZED_ANSWERS": "false"})
+
+import app as service  # noqa: E402
+from test_llm_router import backend  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    return service.app.test_client()
+
+
+def test_null_assessment_score_answers_422(client):
+    response = client.post("/api/chat", json={"user_input": "How do I build trust?",
+                                              "user_context": {"assessment_scores": {"trust": None}}})
+    assert response.status_code == 422
+    assert response.json["field"] == "user_context.assessment_scores.trust"
+
+
+def test_fallback_recommendation_skips_null_scores(client):
+    response = client.post("/api/recommendation", json={"assessment_scores": {"trust": None, "communication": 30}})
+    assert response.status_code == 200
+    assert response.json["chapter_title"] == service.content_store.current.chapters["communication"]["chapter_title"]
+
+
+def test_chat_falls_back_to_the_lowest_scoring_chapter(client):
+    response = client.post("/api/chat", json={"user_input": "How do I build trust?",
+                                              "user_context": {"assessment_scores": {"trust": 20, "communication": 90},
+                                                               "delusional_score": None}})
+    assert response.status_code == 200
+    assert response.json["response_type"] == "book_fallback"
+
+
+def chat(client, conversation_id, history_turns, chat_history=None):
+    body = {"user_input": "What next?", "user_context": {}, "conversation_id": conversation_id,
+            "history_turns": history_turns}
+    if chat_history is not None:
+        body["chat_history"] = chat_history
+    return client.post("/api/chat", json=body)
+
+
+def test_unknown_conversation_with_prior_turns_answers_409(client):
+    response = chat(client, "unknown-conversation", 4)
+    assert response.status_code == 409
+    assert response.json["code"] == "conversation_expired"
+    assert service.load_conversation("unknown-conversation", [], 4) is None
+    # A first turn needs no history
+    assert service.load_conversation("new-conversation", [], 0) == []
+
+
+def test_stale_stored_history_answers_409_until_the_client_resends_it(client):
+    history = [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}]
+    assert chat(client, "stale-conversation", 2, history).status_code == 200
+    assert service.session_store.turn_count("stale-conversation") == 4
+
+    # The client has seen more turns than this worker stored
+    assert chat(client, "stale-conversation", 8).status_code == 409
+
+    resent = [{"role": "user", "content": f"m{i}"} for i in range(8)]
+    assert chat(client, "stale-conversation", 8, resent).status_code == 200
+    assert service.session_store.turn_count("stale-conversation") == 10
+    assert service.session_store.history("stale-conversation")[0]["content"] == "m0"
+
+
+def test_repeated_message_in_a_later_turn_is_a_new_job(client):
+    body = {"user_input": "Same question", "user_context": {}, "conversation_id": "job-conversation",
+            "chat_history": [{"role": "user", "content": "a"}], "history_turns": 1}
+    first = client.post("/api/chat/jobs", json=body).json
+    assert client.get(f"{first['poll_url']}?wait=5").json["status"] == "completed"
+    body.update(chat_history=[], history_turns=3)
+    second = client.post("/api/chat/jobs", json=body).json
+    assert not second["deduplicated"]
+    assert second["job_id"] != first["job_id"]
+
+
+def test_ai_answer_reports_the_model_that_wrote_it(client, monkeypatch):
+    monkeypatch.setattr(service.llm_router, "backends", [backend("primary", "Talk about it tonight.")])
+    response = client.post("/api/chat", json={"user_input": "How do I build trust?",
+                                              "user_context": {"assessment_scores": {"trust": 40}}})
+    assert response.status_code == 200
+    assert response.json["response_type"] == "ai_generated"
+    assert response.json["source"] == "model-primary"
+
+
+def test_unauthenticated_scores_do_not_reach_the_analytics(client):
+    before = service.score_analytics.stats()
+    client.post("/api/recommendation", json={"assessment_scores": {"trust": 1, "communication": 1}})
+    after = service.score_analytics.stats()
+    assert after["score_sets"] == before["score_sets"]
+    assert after["unverified"] == before["unverified"] + 1
@@ -0,0 +1,62 @@
+from context_selection import ContextSelector, PrincipleChunks
+from retrieval import RetrievalIndex
+
+DOCUMENTS = [
+    {"chapter_title": "Chapter 1: Communication",
+     "chapter_excerpt": "Talking well.\n\nKey Principles:\n"
+                        "• Practice active listening without interrupting\n"
+                        "• Take breaks during heated discussions\n"
+                        "• Express appreciation regularly\n\n"
+                        "Remember: Communication creates understanding."},
+    {"chapter_title": "Chapter 2: Trust",
+     "chapter_excerpt": "Trust is earned.\n\nKey Principles:\n"
+                        "• Keep small promises to build trust\n"
+                        "• Practice active listening without interrupting your partner\n"
+                        "• Be transparent about money\n\n"
+                        "Remember: Trust grows with consistency."},
+    {"chapter_title": "Chapter 3: Affection",
+     "chapter_excerpt": "Free-form chapter about affection and warmth without bullets."},
+]
+
+
+def select(query, token_budget=200):
+    selector = ContextSelector(token_budget=token_budget)
+    context, report = selector.select(query, RetrievalIndex(DOCUMENTS), PrincipleChunks(DOCUMENTS))
+    return selector, context, report
+
+
+def test_picks_matching_principles_with_the_chapter_title_and_summary():
+    _, context, report = select("How do we build trust and keep promises?")
+    assert context[0]["chapter_title"] == "Chapter 2: Trust"
+    excerpt = context[0]["chapter_excerpt"]
+    assert "• Keep small promises to build trust" in excerpt
+    assert excerpt.endswith("Remember: Trust grows with consistency.")
+    assert report["saved_tokens"] == report["whole_chapter_tokens"] - report["selected_tokens"] > 0
+
+
+def test_near_duplicate_principles_from_another_chapter_are_dropped():
+    selector, context, _ = select("active listening without interrupting")
+    lines = [line for chunk in context for line in chunk["chapter_excerpt"].splitlines() if "listening" in line]
+    assert len(lines) == 1
+    assert selector.stats()["duplicates_dropped"] == 1
+
+
+def test_selection_fits_the_token_budget():
+    _, _, report = select("trust promises money transparent listening breaks appreciation", token_budget=30)
+    assert 0 < report["selected_tokens"] <= 30
+
+
+def test_query_without_long_words_falls_back_to_whole_chapters():
+    # "is" matches chapter 2 in the index, but no principle has a word of four letters or more to match
+    selector, context, report = select("is it ok?")
+    assert context and context[0]["chapter_excerpt"] in [doc["chapter_excerpt"] for doc in DOCUMENTS]
+    assert report["saved_tokens"] == 0
+    assert selector.stats()["whole_chapter_fallbacks"] == 1
+
+
+def test_no_candidate_chapters_count_no_savings():
+    selector, context, report = select("zzzz")
+    assert context == []
+    assert report == {"selected_tokens": 0, "whole_chapter_tokens": 0, "saved_tokens": 0}
+    stats = selector.stats()
+    assert (stats["selections"], stats["whole_chapter_tokens"], stats["saved_ratio"]) == (1, 0, 0.0)
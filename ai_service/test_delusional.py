@@ -0,0 +1,92 @@
+import random
+
+import pytest
+
+from delusional import DelusionalScores, delusional_score
+
+CATEGORIES = ["communication", "trust", "empathy", "affection"]
+
+
+def row(source, user, day, scores, assessment_type="wife-material"):
+    return {"source": source, "user_id": user, "assessment_type": assessment_type,
+            "completed_at": f"2025-05-{day:02d}T10:00:00Z",
+            "category_scores": [{"category": category, "percentage": value} for category, value in scores.items()]}
+
+
+def random_rows(users=40, seed=7):
+    rng = random.Random(seed)
+    rows = []
+    for user in range(users):
+        for _ in range(rng.randint(0, 2)):
+            rows.append(row("self", f"u{user}", rng.randint(1, 28),
+                            {c: rng.randint(0, 100) for c in rng.sample(CATEGORIES, 3)}))
+        for _ in range(rng.randint(0, 4)):
+            rows.append(row("external", f"u{user}", rng.randint(1, 28),
+                            {c: rng.randint(0, 100) for c in rng.sample(CATEGORIES, 2)}))
+    return rows
+
+
+def port(rows, user, assessment_type="wife-material"):
+    mine = [r for r in rows if r["user_id"] == user and r["assessment_type"] == assessment_type]
+    externals = sorted((r for r in mine if r["source"] == "external"), key=lambda r: r["completed_at"], reverse=True)
+    return delusional_score([r for r in mine if r["source"] == "self"], externals)
+
+
+def test_gaps_and_statuses():
+    rows = [row("self", "u1", 1, {"trust": 80, "empathy": 50}),
+            row("external", "u1", 2, {"trust": 60, "empathy": 45}),
+            row("external", "u1", 3, {"trust": 40})]
+    result = delusional_score(rows[:1], rows[1:])
+    gaps = {gap["category"]: (gap["external_score"], gap["gap"], gap["status"]) for gap in result["category_gaps"]}
+    assert gaps == {"trust": (50.0, 30.0, "delusional"), "empathy": (45.0, 5.0, "self-aware")}
+    assert result["overall_score"] == 17.5
+    assert result["status"] == "blind-spot"
+    assert result["external_assessment_count"] == 2
+
+
+def test_no_result_without_both_kinds_of_assessment():
+    engine = DelusionalScores()
+    assert engine.add(row("self", "u1", 1, {"trust": 80})) is None
+    assert engine.get("u1", "wife-material") is None
+    assert engine.add(row("external", "u1", 2, {"trust": 70}))["overall_score"] == 10.0
+
+
+def test_rebuild_matches_the_per_user_port():
+    rows = random_rows()
+    results = DelusionalScores().rebuild(rows)
+    for (user, _), result in results.items():
+        assert result == port(rows, user)
+
+
+def test_incremental_adds_match_a_rebuild():
+    rows = random_rows(seed=11)
+    held_out = [r for r in rows if r["user_id"] in ("u3", "u4", "u5")]
+    engine = DelusionalScores()
+    engine.rebuild([r for r in rows if r not in held_out])
+    for added in held_out:
+        engine.add(added)
+    expected = DelusionalScores().rebuild(rows)
+    for key, result in expected.items():
+        current = engine.get(*key)
+        if result is None:
+            assert current is None
+            continue
+        assert current["overall_score"] == pytest.approx(result["overall_score"], abs=1e-9)
+        assert [gap["status"] for gap in current["category_gaps"]] == [gap["status"] for gap in result["category_gaps"]]
+
+
+def test_an_older_self_assessment_does_not_replace_the_newer_one():
+    engine = DelusionalScores()
+    engine.add(row("self", "u1", 10, {"trust": 80}))
+    engine.add(row("external", "u1", 11, {"trust": 70}))
+    assert engine.add(row("self", "u1", 5, {"trust": 10}))["overall_score"] == 10.0
+    assert engine.stats()["stale_self_rows"] == 1
+
+
+def test_least_recently_updated_users_are_evicted():
+    engine = DelusionalScores(max_users=2)
+    for user in ("u1", "u2", "u3"):
+        engine.add(row("self", user, 1, {"trust": 50}))
+        engine.add(row("external", user, 2, {"trust": 50}))
+    assert engine.get("u1", "wife-material") is None
+    assert engine.get("u3", "wife-material") is not None
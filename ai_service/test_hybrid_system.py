@@ -106,6 +106,58 @@ def test_hybrid_chat_endpoint():
         print(f"❌ Chat endpoint error: {e}")
         return False
 
+def test_chat_job_endpoint():
+    """Test the async chat job endpoint"""
+    print("\n🔍 Testing Chat Job Endpoint...")
+    
+    payload = {
+        "user_input": "How can I rebuild trust after an argument?",
+        "user_context": {
+            "profile": {
+                "name": "Test User",
+                "gender": "female",
+                "region": "Europe",
+                "cultural_context": "western"
+            },
+            "assessment_scores": {
+                "communication": 70,
+                "trust": 55,
+                "affection": 80
+            }
+        },
+        "chat_history": []
+    }
+    
+    try:
+        response = requests.post(
+            f"{BASE_URL}/api/chat/jobs",
+            json=payload,
+            headers={"Content-Type": "application/json"},
+            timeout=10
+        )
+        
+        if response.status_code != 202:
+            print(f"❌ Chat job submit failed: {response.status_code}")
+            print(f"   Error: {response.text}")
+            return False
+        
+        job_id = response.json().get('job_id')
+        print(f"✅ Chat job submitted: {job_id}")
+        
+        response = requests.get(f"{BASE_URL}/api/chat/jobs/{job_id}?wait=25", timeout=30)
+        if response.status_code == 200:
+            data = response.json()
+            print(f"   Status: {data.get('status')}")
+            print(f"   Response Type: {data.get('result', {}).get('response_type')}")
+            return data.get('status') == 'completed'
+        else:
+            print(f"❌ Chat job poll failed: {response.status_code}")
+            return False
+            
+    except Exception as e:
+        print(f"❌ Chat job error: {e}")
+        return False
+
 def test_fallback_recommendation_endpoint():
     """Test the fallback recommendation endpoint"""
     print("\n🔍 Testing Fallback Recommendation Endpoint...")
@@ -231,6 +283,7 @@ def main():
         ("Health Check", test_health_endpoint),
         ("Root Endpoint", test_root_endpoint),
         ("Hybrid Chat", test_hybrid_chat_endpoint),
+        ("Chat Jobs", test_chat_job_endpoint),
         ("Fallback Recommendation", test_fallback_recommendation_endpoint),
         ("Chapters Endpoint", test_chapters_endpoint),
         ("AI Failure Scenario", test_ai_failure_scenario),
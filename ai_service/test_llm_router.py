@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+
+import pytest
+
+import llm_router
+from llm_router import Backend, LLMRouter, NoBackendAvailableError
+from retry import Deadline, RetryBudget, RetryPolicy
+from test_retry import status_error
+
+
+class FakeClient:
+    """Chat completions client answering from a script of responses and errors; the last one repeats"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes) or ["ok"]
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=outcome))])
+
+
+def backend(name, *outcomes, latency=0.0):
+    result = Backend(name, f"model-{name}", FakeClient(*outcomes))
+    # Lower EWMA latency wins the power-of-two pick, so the order endpoints are tried in is fixed
+    result.ewma_latency = latency
+    return result
+
+
+def router(*backends, max_attempts=3, budget=None):
+    return LLMRouter(list(backends), retry_policy=RetryPolicy(max_attempts=max_attempts, min_attempt_seconds=0.5),
+                     retry_budget=budget or RetryBudget(), default_deadline=10)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff delays the router asked for, without waiting them out"""
+    delays = []
+    monkeypatch.setattr(llm_router.time, "sleep", delays.append)
+    return delays
+
+
+def test_transient_error_fails_over_to_the_next_endpoint(sleeps):
+    primary, secondary = backend("primary", status_error(503)), backend("secondary", "answer", latency=1.0)
+    attempts = []
+    response, chosen = router(primary, secondary).complete([], attempts=attempts)
+    assert response.choices[0].message.content == "answer"
+    assert chosen is secondary
+    assert [(a["backend"], a["outcome"]) for a in attempts] == [("primary", "InternalServerError"),
+                                                                 ("secondary", "ok")]
+    assert sleeps == []
+
+
+def test_auth_and_not_found_errors_bench_the_endpoint_and_fail_over(sleeps):
+    for status in (401, 403, 404):
+        primary, secondary = backend("primary", status_error(status)), backend("secondary", "answer", latency=1.0)
+        subject = router(primary, secondary)
+        _, chosen = subject.complete([])
+        assert chosen is secondary
+        assert not primary.healthy(llm_router.time.time())
+        assert subject.stats()["endpoint_errors"] == 1
+
+
+def test_misconfigured_endpoint_is_not_retried_within_the_request(sleeps):
+    only = backend("only", status_error(401))
+    with pytest.raises(NoBackendAvailableError):
+        router(only).complete([])
+    assert only.client.calls == 1
+
+
+def test_request_errors_stop_without_trying_other_endpoints(sleeps):
+    for status in (400, 422):
+        primary, secondary = backend("primary", status_error(status)), backend("secondary", "answer", latency=1.0)
+        subject = router(primary, secondary)
+        with pytest.raises(NoBackendAvailableError):
+            subject.complete([])
+        assert secondary.client.calls == 0
+        assert primary.healthy(llm_router.time.time())
+        assert subject.stats()["non_retryable"] == 1
+
+
+def test_same_endpoint_retry_waits_for_retry_after(sleeps):
+    only = backend("only", status_error(429, {"retry-after": "2"}), "answer")
+    subject = router(only)
+    subject.complete([])
+    assert sleeps == [2.0]
+    assert subject.stats()["retries"] == 1
+
+
+def test_retry_after_past_the_deadline_gives_up_without_sleeping(sleeps):
+    only = backend("only", status_error(429, {"retry-after": "30"}), "answer")
+    subject = router(only)
+    with pytest.raises(NoBackendAvailableError):
+        subject.complete([], deadline=Deadline(5))
+    assert sleeps == []
+    assert only.client.calls == 1
+    assert subject.stats()["deadline_exhausted"] == 1
+
+
+def test_no_attempt_starts_with_too_little_time_left(sleeps):
+    only = backend("only", "answer")
+    subject = router(only)
+    with pytest.raises(NoBackendAvailableError):
+        subject.complete([], deadline=Deadline(0.1))
+    assert only.client.calls == 0
+    assert subject.stats()["deadline_exhausted"] == 1
+
+
+def test_retries_stop_when_the_budget_is_spent(sleeps):
+    budget = RetryBudget(ratio=0, min_per_second=0, max_tokens=1)
+    subject = router(backend("only", status_error(503)), max_attempts=5, budget=budget)
+    with pytest.raises(NoBackendAvailableError):
+        subject.complete([])
+    stats = subject.stats()
+    assert stats["retries"] == 1
+    assert stats["budget_exhausted"] == 1
+    assert stats["retry_budget_tokens"] == 0
+
+
+def test_attempts_are_capped(sleeps):
+    only = backend("only", status_error(503))
+    with pytest.raises(NoBackendAvailableError):
+        router(only, max_attempts=3).complete([])
+    assert only.client.calls == 3
@@ -0,0 +1,79 @@
+import json
+import threading
+import time
+
+from materialized import MaterializedAnswers, ScoreQuantizer
+
+CATEGORIES = ["communication", "trust"]
+VERSION = "v1"
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def profile(trust):
+    return {"assessment_scores": {"communication": 50, "trust": trust}}
+
+
+def test_quantizer_representative_lands_in_its_own_bucket():
+    quantizer = ScoreQuantizer(CATEGORIES, bucket_size=20)
+    user_context = {"assessment_scores": {"communication": 95, "trust": 3}, "delusional_score": 41}
+    key = quantizer.key(user_context)
+    assert quantizer.key(quantizer.representative(key)) == key
+    assert quantizer.representative(key)["assessment_scores"] == {"communication": 90, "trust": 10}
+    assert quantizer.representative(key)["delusional_score"] == 50
+
+
+def test_miss_fills_in_the_background_and_then_hits():
+    answers = MaterializedAnswers(CATEGORIES, lambda question, user_context: f"answer to {question}")
+    assert answers.lookup("How can I build trust?", profile(30), VERSION) is None
+    wait_until(lambda: answers.stats()["filled"] == 1)
+    assert answers.lookup("how do i build trust", profile(35), VERSION) == "answer to How can I build more trust?"
+    assert answers.lookup("how do i build trust", profile(35), "v2") is None
+    assert answers.lookup("Tell me a joke", profile(35), VERSION) is None
+    stats = answers.stats()
+    assert (stats["hits"], stats["misses"], stats["stale"], stats["ineligible"]) == (1, 1, 1, 1)
+
+
+def test_pending_fills_are_bounded():
+    release = threading.Event()
+
+    def generate(question, user_context):
+        release.wait(5)
+        return "answer"
+
+    answers = MaterializedAnswers(CATEGORIES, generate, max_pending=2)
+    for trust in (10, 30, 50, 70):
+        answers.lookup("How can I build trust?", profile(trust), VERSION)
+    stats = answers.stats()
+    assert (stats["in_flight"], stats["fills_dropped"]) == (2, 2)
+
+    release.set()
+    wait_until(lambda: answers.stats()["in_flight"] == 0)
+    assert answers.stats()["filled"] == 2
+    answers.lookup("How can I build trust?", profile(90), VERSION)
+    wait_until(lambda: answers.stats()["filled"] == 3)
+
+
+def test_table_is_saved_in_batches_not_per_fill(tmp_path):
+    path = tmp_path / "answers.json"
+    answers = MaterializedAnswers(CATEGORIES, lambda question, user_context: "answer", persist_path=str(path),
+                                  save_interval=3600, save_every=3)
+    for trust in (10, 30):
+        answers.lookup("How can I build trust?", profile(trust), VERSION)
+    wait_until(lambda: answers.stats()["filled"] == 2)
+    assert not path.exists()
+    assert answers.stats()["unsaved"] == 2
+
+    answers.lookup("How can I build trust?", profile(50), VERSION)
+    wait_until(lambda: answers.stats()["saves"] == 1)
+    assert len(json.loads(path.read_text())["entries"]) == 3
+    assert answers.stats()["unsaved"] == 0
+
+    restored = MaterializedAnswers(CATEGORIES, lambda question, user_context: "other", persist_path=str(path),
+                                   save_interval=3600)
+    assert restored.lookup("How can I build trust?", profile(15), VERSION) == "answer"
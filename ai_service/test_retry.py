@@ -0,0 +1,69 @@
+import email.utils
+import time
+from types import SimpleNamespace
+
+import openai
+
+from retry import Deadline, RetryBudget, RetryPolicy, is_endpoint_error, is_retryable, retry_after_seconds
+
+STATUS_ERRORS = {
+    400: openai.BadRequestError,
+    401: openai.AuthenticationError,
+    403: openai.PermissionDeniedError,
+    404: openai.NotFoundError,
+    422: openai.UnprocessableEntityError,
+    429: openai.RateLimitError,
+    500: openai.InternalServerError,
+    503: openai.InternalServerError,
+}
+
+
+def status_error(status, headers=None):
+    """An SDK error as raised for an upstream response with this status"""
+    response = SimpleNamespace(status_code=status, headers=headers or {}, request=None)
+    return STATUS_ERRORS[status](f"upstream answered {status}", response=response, body=None)
+
+
+def test_transient_errors_are_retryable():
+    assert is_retryable(status_error(429))
+    assert is_retryable(status_error(503))
+    assert is_retryable(openai.APITimeoutError(request=None))
+    assert not is_retryable(status_error(400))
+    assert not is_retryable(status_error(401))
+    assert not is_retryable(ValueError("bad"))
+
+
+def test_endpoint_errors_are_auth_and_not_found():
+    assert [status for status in STATUS_ERRORS if is_endpoint_error(status_error(status))] == [401, 403, 404]
+
+
+def test_retry_after_in_seconds_milliseconds_and_http_date():
+    assert retry_after_seconds(status_error(429, {"retry-after": "3"})) == 3.0
+    assert retry_after_seconds(status_error(429, {"retry-after-ms": "250", "retry-after": "3"})) == 0.25
+    date = email.utils.formatdate(time.time() + 10, usegmt=True)
+    assert 8 <= retry_after_seconds(status_error(429, {"retry-after": date})) <= 10
+    assert retry_after_seconds(status_error(429, {"retry-after": "soon"})) is None
+    assert retry_after_seconds(status_error(429)) is None
+
+
+def test_backoff_waits_at_least_retry_after():
+    policy = RetryPolicy(base_delay=0.1, max_delay=0.2)
+    assert all(policy.backoff(attempt) <= 0.2 for attempt in range(1, 10))
+    assert policy.backoff(1, retry_after=5) == 5
+
+
+def test_retry_budget_refills_from_deposits():
+    budget = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=1)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+def test_deadline_remaining_never_goes_negative():
+    deadline = Deadline(0)
+    assert deadline.remaining() == 0
+    assert deadline.expired()
+    assert not Deadline(60).expired()
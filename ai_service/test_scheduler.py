@@ -0,0 +1,89 @@
+import threading
+import time
+from contextlib import ExitStack
+
+import pytest
+
+from retry import Deadline
+from scheduler import CapacityUnavailable, TierPolicy, TierScheduler
+
+
+def scheduler(capacity, **tiers):
+    return TierScheduler(capacity, [TierPolicy(name, **policy) for name, policy in tiers.items()])
+
+
+def waiting(subject):
+    return sum(tier["waiting"] for tier in subject.stats()["tiers"].values())
+
+
+def test_contended_capacity_is_shared_by_weight():
+    subject = scheduler(1, premium={"weight": 3, "queue_seconds": 10}, free={"weight": 1, "queue_seconds": 10})
+    order = []
+
+    def request(tier):
+        with subject.slot(tier):
+            order.append(tier)
+
+    holder = subject.slot("free")
+    holder.__enter__()
+    threads = [threading.Thread(target=request, args=(tier,)) for tier in ["premium", "free"] * 6]
+    for thread in threads:
+        thread.start()
+    while waiting(subject) < len(threads):
+        time.sleep(0.001)
+    holder.__exit__(None, None, None)
+    for thread in threads:
+        thread.join(5)
+
+    # Virtual finish tags advance by 1/weight, so premium gets three slots for every free one
+    assert order[:8].count("premium") == 6
+    assert order[:8].count("free") == 2
+    assert len(order) == 12
+
+
+def test_reserved_slots_are_kept_for_their_tier():
+    subject = scheduler(3, premium={"reserved": 1, "queue_seconds": 1}, free={"queue_seconds": 0.05})
+    with ExitStack() as stack:
+        stack.enter_context(subject.slot("free"))
+        stack.enter_context(subject.slot("free"))
+        with pytest.raises(CapacityUnavailable) as raised:
+            stack.enter_context(subject.slot("free"))
+        assert raised.value.reason == "timeout"
+        assert stack.enter_context(subject.slot("premium")) == "premium"
+    stats = subject.stats()["tiers"]
+    assert stats["free"]["degraded_timeout"] == 1
+    assert stats["premium"]["in_flight"] == stats["free"]["in_flight"] == 0
+
+
+def test_request_deadline_cuts_the_queue_wait_short():
+    subject = scheduler(1, free={"queue_seconds": 30})
+    with subject.slot("free"):
+        started = time.monotonic()
+        with pytest.raises(CapacityUnavailable) as raised:
+            with subject.slot("free", Deadline(0.05)):
+                pass
+        assert time.monotonic() - started < 5
+    assert raised.value.tier == "free"
+    assert raised.value.reason == "timeout"
+    assert subject.stats()["tiers"]["free"]["waiting"] == 0
+
+
+def test_full_queue_degrades_at_once():
+    subject = scheduler(1, free={"max_queue": 0})
+    with subject.slot("free"):
+        with pytest.raises(CapacityUnavailable) as raised:
+            with subject.slot("free"):
+                pass
+    assert raised.value.reason == "queue_full"
+
+
+def test_unknown_tiers_use_the_default_and_zero_capacity_admits_everything():
+    subject = scheduler(0, free={})
+    with subject.slot("enterprise") as tier:
+        assert tier == "free"
+    assert not subject.stats()["enabled"]
+
+
+def test_reservations_cannot_exceed_capacity():
+    with pytest.raises(ValueError):
+        scheduler(2, premium={"reserved": 3}, free={})
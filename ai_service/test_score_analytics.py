@@ -0,0 +1,123 @@
+import json
+import os
+import random
+
+import pytest
+
+from score_analytics import ALL, Distribution, KllSketch, ScoreAnalytics, _process_alive
+
+
+@pytest.fixture(autouse=True)
+def seeded_random():
+    # Compaction picks offsets with the module-level random; seed it so error bounds are reproducible
+    random.seed(1234)
+
+
+def rank_errors(sketch, values):
+    """Largest gap between each quantile's estimated and true rank, as a fraction of the count"""
+    view = Distribution([sketch])
+    ordered = sorted(values)
+    errors = []
+    for point in range(1, 100):
+        estimate = view.quantile(point / 100)
+        true_rank = sum(1 for value in ordered if value < estimate) / len(ordered)
+        errors.append(abs(true_rank - point / 100))
+    return max(errors)
+
+
+def test_rank_error_stays_within_bounds_in_bounded_memory():
+    values = [random.uniform(0, 100) for _ in range(50000)]
+    sketch = KllSketch(k=200)
+    for value in values:
+        sketch.update(value)
+    assert sketch.n == len(values)
+    assert sketch._size < 1000
+    # About 1.7/k for k=200; allow some slack for an unlucky compaction
+    assert rank_errors(sketch, values) < 0.02
+
+
+def test_merged_sketches_match_the_combined_stream():
+    low = [random.uniform(0, 50) for _ in range(20000)]
+    high = [random.uniform(50, 100) for _ in range(20000)]
+    left, right = KllSketch(k=200), KllSketch(k=200)
+    for value in low:
+        left.update(value)
+    for value in high:
+        right.update(value)
+    left.merge(right)
+    assert left.n == len(low) + len(high)
+    assert rank_errors(left, low + high) < 0.02
+    assert 45 < Distribution([left]).quantile(0.5) < 55
+
+
+def test_round_trip_keeps_weights():
+    sketch = KllSketch(k=50)
+    for value in range(5000):
+        sketch.update(value)
+    restored = KllSketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+    assert restored.n == sketch.n
+    assert sorted(restored.weighted_items()) == sorted(sketch.weighted_items())
+
+
+def test_percentile_rank_counts_half_of_ties():
+    sketch = KllSketch()
+    for value in (10, 20, 20, 30):
+        sketch.update(value)
+    view = Distribution([sketch])
+    assert view.percentile(20) == 50.0
+    assert view.percentile(5) == 0.0
+    assert view.percentile(40) == 100.0
+
+
+def test_only_verified_users_are_counted_once_per_assessment_type():
+    analytics = ScoreAnalytics(min_samples=1)
+    context = {"assessment_type": "wife-material", "profile": {"region": "Europe"}}
+    assert not analytics.ingest({"trust": 10}, context, None)
+    assert analytics.ingest({"trust": 60}, context, "user-1")
+    # Edited scores from the same account are not a second sample
+    assert not analytics.ingest({"trust": 5}, context, "user-1")
+    assert analytics.ingest({"trust": 5}, {"assessment_type": "high-value-man"}, "user-1")
+    assert analytics.ingest({"trust": 80, "communication": True}, context, "user-2")
+
+    stats = analytics.stats()
+    assert (stats["unverified"], stats["duplicates"], stats["score_sets"]) == (1, 1, 3)
+    assert stats["rejected_scores"] == 1
+    assert analytics.distribution("trust", "wife-material", "europe").count == 2
+    assert analytics.distribution("trust").count == 3
+
+
+def test_percentiles_are_withheld_below_min_samples():
+    analytics = ScoreAnalytics(min_samples=3)
+    for index in range(2):
+        analytics.ingest({"trust": 50}, {}, f"user-{index}")
+    assert analytics.percentile("trust", 50) == {"percentile": None, "sample_size": 2}
+
+
+def write_shard(shard_dir, pid, scores):
+    analytics = ScoreAnalytics()
+    for index, score in enumerate(scores):
+        analytics.ingest({"trust": score}, {}, f"user-{pid}-{index}")
+    sketches = [[*key, sketch.to_dict()] for key, sketch in analytics._sketches.items()]
+    path = os.path.join(shard_dir, f"scores-{pid}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"pid": pid, "saved_at": 0, "sketches": sketches}, f)
+    return path
+
+
+def test_workers_adopt_exited_shards_and_read_live_ones(tmp_path):
+    dead_pid = next(pid for pid in range(4_000_000, 4_100_000) if not _process_alive(pid))
+    live_pid = os.getppid()
+    dead_path = write_shard(tmp_path, dead_pid, range(0, 40))
+    live_path = write_shard(tmp_path, live_pid, range(40, 100))
+
+    analytics = ScoreAnalytics(shard_dir=str(tmp_path), persist_interval=3600)
+    analytics.ingest({"trust": 100}, {}, "user-own")
+
+    # The exited worker's scores now live in our own shard; the live worker's stay in theirs
+    assert not os.path.exists(dead_path)
+    assert os.path.exists(live_path)
+    assert os.path.exists(analytics.shard_path)
+    assert analytics._sketches[("trust", ALL, ALL)].n == 41
+    view = analytics.distribution("trust")
+    assert view.count == 101
+    assert 45 <= view.quantile(0.5) <= 55
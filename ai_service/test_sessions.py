@@ -0,0 +1,69 @@
+import json
+
+from sessions import SessionStore
+
+
+def turns(count, prefix="m"):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{prefix}{i}"} for i in range(count)]
+
+
+def test_history_is_a_ring_buffer_but_the_turn_count_keeps_growing():
+    store = SessionStore(max_turns=4)
+    for turn in turns(6):
+        store.append("c1", turn["role"], turn["content"])
+    assert [turn["content"] for turn in store.history("c1")] == ["m2", "m3", "m4", "m5"]
+    assert store.turn_count("c1") == 6
+    assert store.turn_count("missing") is None
+    assert store.stats()["turns_dropped"] == 2
+
+
+def test_extend_seeds_a_tail_with_the_client_turn_count():
+    store = SessionStore()
+    store.extend("c1", turns(2), total_turns=10)
+    assert store.turn_count("c1") == 10
+    store.append("c1", "user", "next")
+    assert store.turn_count("c1") == 11
+
+
+def test_fold_replaces_the_oldest_turns_with_a_summary():
+    store = SessionStore()
+    store.extend("c1", turns(4))
+    older = store.history("c1")[:2]
+    assert store.fold("c1", older, "summary")
+    assert [turn["content"] for turn in store.history("c1")] == ["m2", "m3"]
+    assert store.summary("c1") == "summary"
+    assert store.turn_count("c1") == 4
+    # The head changed since it was read: nothing is folded
+    assert not store.fold("c1", older, "other")
+
+
+def test_least_recently_used_sessions_are_evicted():
+    store = SessionStore(max_sessions=2)
+    store.append("a", "user", "1")
+    store.append("b", "user", "1")
+    store.history("a")
+    store.append("c", "user", "1")
+    assert store.has("a") and store.has("c") and not store.has("b")
+    assert store.stats()["evicted_lru"] == 1
+
+
+def test_sessions_over_the_character_budget_are_evicted():
+    store = SessionStore(max_total_chars=10)
+    store.append("a", "user", "x" * 6)
+    store.append("b", "user", "y" * 6)
+    assert not store.has("a") and store.has("b")
+    assert store.stats()["evicted_memory"] == 1
+
+
+def test_snapshot_round_trip_keeps_summary_and_turn_count(tmp_path):
+    path = str(tmp_path / "sessions.json")
+    store = SessionStore(max_turns=2, persist_path=path, persist_interval=3600)
+    store.extend("c1", turns(5))
+    store.fold("c1", store.history("c1")[:1], "earlier")
+    store.save()
+    assert set(json.load(open(path))["c1"]) == {"summary", "turns", "total_turns"}
+
+    restored = SessionStore(max_turns=2, persist_path=path, persist_interval=3600)
+    assert restored.history("c1") == store.history("c1")
+    assert restored.summary("c1") == "earlier"
+    assert restored.turn_count("c1") == 5
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+import token_ledger
+from token_ledger import QuotaExceeded, TokenLedger
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Monotonic time the buckets refill by, advanced by hand"""
+    now = [1000.0]
+    monkeypatch.setattr(token_ledger.time, "monotonic", lambda: now[0])
+    return now
+
+
+def available(ledger, account):
+    return ledger.quota(account)["account_available"]
+
+
+def test_settle_charges_actual_usage_against_the_reservation(clock):
+    ledger = TokenLedger(user_tpm=600, global_tpm=6000)
+    reservation = ledger.reserve("user:a", 100)
+    assert available(ledger, "user:a") == 500
+    ledger.settle(reservation, 30, 20, kind="standard", model="m")
+    assert available(ledger, "user:a") == 550
+    assert ledger.quota()["global_available"] == 5950
+    stats = ledger.stats()
+    assert (stats["calls"], stats["prompt_tokens"], stats["completion_tokens"]) == (1, 30, 20)
+
+
+def test_failed_call_gets_its_reservation_back(clock):
+    ledger = TokenLedger(user_tpm=600, global_tpm=6000)
+    ledger.settle(ledger.reserve("user:a", 100), None, None, error="APITimeoutError")
+    assert available(ledger, "user:a") == 600
+    assert ledger.stats()["errors"] == 1
+
+
+def test_usage_over_the_reservation_is_carried_as_debt(clock):
+    ledger = TokenLedger(user_tpm=600, global_tpm=0)
+    ledger.settle(ledger.reserve("user:a", 500), 600, 300)
+    assert available(ledger, "user:a") == -300
+
+    # 400 tokens short at 10 tokens a second
+    with pytest.raises(QuotaExceeded) as raised:
+        ledger.reserve("user:a", 100)
+    assert raised.value.scope == "user"
+    assert raised.value.retry_after == pytest.approx(40)
+    assert ledger.stats()["rejected_user"] == 1
+
+    clock[0] += 40
+    ledger.reserve("user:a", 100)
+
+
+def test_calls_without_an_account_draw_on_the_global_bucket_only(clock):
+    ledger = TokenLedger(user_tpm=50, global_tpm=100)
+    ledger.reserve(None, 80, source="materialized")
+    with pytest.raises(QuotaExceeded) as raised:
+        ledger.reserve("user:a", 40)
+    assert raised.value.scope == "global"
+    assert ledger.stats()["tracked_accounts"] == 1
+
+
+def test_least_recently_used_accounts_are_dropped(clock):
+    ledger = TokenLedger(user_tpm=600, global_tpm=0, max_accounts=2)
+    for account in ("user:a", "user:b", "user:a", "user:c"):
+        ledger.reserve(account, 100)
+    assert list(ledger._accounts) == ["user:a", "user:c"]
+    # A dropped account starts again with a full bucket
+    assert available(ledger, "user:b") == 600
+    ledger.reserve("user:b", 100)
+    assert list(ledger._accounts) == ["user:c", "user:b"]
+
+
+def test_flush_writes_each_record_once_and_counts_overwritten_ones(clock, tmp_path):
+    path = tmp_path / "ledger.jsonl"
+    ledger = TokenLedger(user_tpm=0, global_tpm=0, buffer_size=3, store_path=str(path), flush_interval=3600)
+    for _ in range(2):
+        ledger.settle(ledger.reserve("user:a", 10), 5, 5)
+    assert ledger.flush() == 2
+    assert ledger.flush() == 0
+
+    # Four more calls into a buffer of three: the first of them is dropped before it is written
+    for _ in range(4):
+        ledger.settle(ledger.reserve("user:a", 10), 5, 5)
+    assert ledger.flush() == 3
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 5
+    assert json.loads(lines[0])["account"] == "user:a"
+    stats = ledger.stats()
+    assert (stats["records_flushed"], stats["records_lost"]) == (5, 1)
+
+
+def test_records_are_not_lost_without_a_store(clock):
+    ledger = TokenLedger(buffer_size=2)
+    for _ in range(5):
+        ledger.settle(ledger.reserve("user:a", 10), 5, 5)
+    assert ledger.stats()["records_lost"] == 0
+    assert ledger.usage()["records"] == 2
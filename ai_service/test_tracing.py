@@ -0,0 +1,70 @@
+from jobs import JobQueue
+from tracing import Tracer, current_span
+
+UPSTREAM = "00-" + "a" * 32 + "-" + "b" * 16 + "-01"
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+def tracer(sample_rate=0.0, trust_upstream_sampling=False):
+    subject = Tracer()
+    subject.configure(ListExporter(), sample_rate, trust_upstream_sampling)
+    return subject
+
+
+def test_upstream_sampled_flag_is_ignored_by_default():
+    subject = tracer()
+    span = subject.begin_trace("GET /", UPSTREAM)
+    subject.end(span)
+    # The caller still chooses the trace to join, not whether it is exported
+    assert (span.trace_id, span.parent_id) == ("a" * 32, "b" * 16)
+    assert not span.sampled
+    assert span.traceparent.endswith("-00")
+
+
+def test_upstream_sampled_flag_is_honoured_when_trusted():
+    subject = tracer(trust_upstream_sampling=True)
+    span = subject.begin_trace("GET /", UPSTREAM)
+    subject.end(span)
+    assert span.sampled
+    unsampled = subject.begin_trace("GET /", UPSTREAM[:-2] + "00")
+    subject.end(unsampled)
+    assert not unsampled.sampled
+
+
+def test_malformed_traceparent_starts_a_new_trace():
+    subject = tracer(sample_rate=1.0)
+    span = subject.begin_trace("GET /", "00-not-a-trace-01")
+    subject.end(span)
+    assert span.parent_id is None
+    assert span.trace_id != "a" * 32
+    assert span.sampled
+
+
+def test_job_spans_join_the_submitting_request_trace():
+    subject = tracer(sample_rate=1.0)
+
+    def handler(payload):
+        with subject.span("chat_job") as span:
+            return {"trace_id": span.trace_id, "parent_id": span.parent_id, "sampled": span.sampled}
+
+    jobs = JobQueue(handler, max_workers=1)
+    root = subject.begin_trace("POST /api/chat/jobs")
+    job, _ = jobs.submit({"user_input": "hi"})
+    subject.end(root)
+    assert current_span() is None
+
+    job.done.wait(5)
+    assert job.result == {"trace_id": root.trace_id, "parent_id": root.span_id, "sampled": True}
+
+
+def test_spans_outside_a_request_are_never_sampled():
+    subject = tracer(sample_rate=1.0)
+    with subject.span("background") as span:
+        assert not span.sampled
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+from validation import (MAX_BODY_BYTES, MAX_HISTORY_TURNS, MAX_SCORE_CATEGORIES, MAX_USER_INPUT_CHARS,
+                        ValidationError, check_content_length, decode_channel_open, decode_chat_request)
+
+
+def decode(body):
+    return decode_chat_request(json.dumps(body).encode("utf-8"))
+
+
+def rejected(body) -> ValidationError:
+    with pytest.raises(ValidationError) as raised:
+        decode(body)
+    return raised.value
+
+
+def test_valid_request_keeps_fields_and_maps_aliases():
+    request = decode({
+        "user_input": "How do I build trust?",
+        "user_context": {"profile": {"name": "Ada", "age": 30}, "assessmentScores": {"trust": 40},
+                         "delusionalScore": None, "compatibility_score": 72.5},
+        "chat_history": [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}],
+        "conversation_id": "c1",
+        "history_turns": 2,
+    })
+    assert request.user_input == "How do I build trust?"
+    assert request.user_context == {"profile": {"name": "Ada"}, "assessment_scores": {"trust": 40},
+                                    "delusional_score": None, "compatibility_score": 72.5}
+    assert len(request.chat_history) == 2
+    assert (request.conversation_id, request.history_turns) == ("c1", 2)
+
+
+@pytest.mark.parametrize("raw, status", [
+    (b"", 400),
+    (b"not json", 400),
+    (b"[]", 400),
+    (b"{}", 400),
+    (b'{"user_input": ""}', 400),
+    (b'{"user_input": 5}', 422),
+])
+def test_malformed_bodies(raw, status):
+    with pytest.raises(ValidationError) as raised:
+        decode_chat_request(raw)
+    assert raised.value.status == status
+
+
+def test_body_size_limits_answer_413():
+    with pytest.raises(ValidationError) as raised:
+        check_content_length(MAX_BODY_BYTES + 1)
+    assert raised.value.status == 413
+    check_content_length(MAX_BODY_BYTES)
+    check_content_length(None)
+    with pytest.raises(ValidationError) as raised:
+        decode_chat_request(b" " * (MAX_BODY_BYTES + 1))
+    assert raised.value.status == 413
+
+
+@pytest.mark.parametrize("body, field", [
+    ({"user_input": "x" * (MAX_USER_INPUT_CHARS + 1)}, "user_input"),
+    ({"user_input": "q", "chat_history": [{"role": "user", "content": "a"}] * (MAX_HISTORY_TURNS + 1)},
+     "chat_history"),
+    ({"user_input": "q", "chat_history": [{"role": "system", "content": "a"}]}, "chat_history[0].role"),
+    ({"user_input": "q", "chat_history": ["a"]}, "chat_history[0]"),
+    ({"user_input": "q", "history_turns": -1}, "history_turns"),
+    ({"user_input": "q", "history_turns": True}, "history_turns"),
+    ({"user_input": "q", "conversation_id": "c" * 65}, "conversation_id"),
+    ({"user_input": "q", "user_context": []}, "user_context"),
+    ({"user_input": "q", "user_context": {"profile": {"name": "x" * 201}}}, "user_context.profile.name"),
+    ({"user_input": "q", "user_context": {"assessment_scores": {f"c{i}": 1 for i in range(MAX_SCORE_CATEGORIES + 1)}}},
+     "user_context.assessment_scores"),
+    ({"user_input": "q", "user_context": {"assessment_scores": {"trust": "high"}}},
+     "user_context.assessment_scores.trust"),
+    ({"user_input": "q", "user_context": {"assessment_scores": {"trust": True}}},
+     "user_context.assessment_scores.trust"),
+    ({"user_input": "q", "user_context": {"delusional_score": "5"}}, "user_context.delusional_score"),
+])
+def test_field_errors_answer_422_with_the_field(body, field):
+    error = rejected(body)
+    assert error.status == 422
+    assert error.field_name == field
+    assert error.to_dict()["field"] == field
+
+
+def test_null_assessment_score_is_rejected():
+    error = rejected({"user_input": "q", "user_context": {"assessment_scores": {"trust": None}}})
+    assert error.status == 422
+    assert error.field_name == "user_context.assessment_scores.trust"
+
+
+def test_null_delusional_and_compatibility_scores_are_kept():
+    request = decode({"user_input": "q", "user_context": {"delusional_score": None, "compatibilityScore": None}})
+    assert request.user_context["delusional_score"] is None
+    assert request.user_context["compatibility_score"] is None
+
+
+def test_channel_open_frame():
+    frame = decode_channel_open({"access_token": "t", "user_context": {}, "history_turns": 3,
+                                 "subscription_tier": "premium"})
+    assert (frame.access_token, frame.history_turns, frame.subscription_tier) == ("t", 3, "premium")
+    with pytest.raises(ValidationError) as raised:
+        decode_channel_open(["open"])
+    assert raised.value.status == 400
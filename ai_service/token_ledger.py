@@ -0,0 +1,272 @@
+"""
+Token accounting for model calls: who used how many prompt and completion
+tokens, on which kind of question, and how long each call took, plus
+token-per-minute quotas per account and for the whole service.
+
+Quotas are token buckets holding up to one minute of tokens. A call reserves
+its estimated size (prompt estimate plus max_tokens) before it is made and
+settles the difference once the provider reports actual usage, so a few
+heavy accounts hit their own limit before the service hits the upstream one.
+"""
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("token_ledger")
+
+
+class QuotaExceeded(Exception):
+    """Not enough tokens left this minute; callers answer with the fallback"""
+
+    def __init__(self, message: str, scope: str, retry_after: float):
+        super().__init__(message)
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills at tokens_per_minute / 60 per second up to one minute's worth.
+
+    Settling a reservation can drive the level below zero; the debt is paid
+    off by the refill before the next call gets through.
+    """
+
+    def __init__(self, tokens_per_minute: float, now: float):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.level = self.capacity
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.level
+
+    def wait_for(self, tokens: float) -> float:
+        """Seconds until `tokens` are available (after refill())"""
+        return max(0.0, (min(tokens, self.capacity) - self.level) / self.rate) if self.rate else float("inf")
+
+
+class Reservation:
+    __slots__ = ("account", "tokens", "source", "started")
+
+    def __init__(self, account: Optional[str], tokens: int, source: str, started: float):
+        self.account = account
+        self.tokens = tokens
+        self.source = source
+        self.started = started
+
+
+class TokenLedger:
+    """Per-call usage records in a ring buffer, flushed to a JSONL file, and TPM token buckets.
+
+    user_tpm limits each account and global_tpm the whole process; 0 turns a
+    limit off. Calls without an account (materialized answers, bulk jobs)
+    count against the global bucket only. At most max_accounts buckets are
+    kept, least recently used dropped first (a dropped account starts full).
+    """
+
+    def __init__(self, user_tpm: int = 20000, global_tpm: int = 200000, buffer_size: int = 10000,
+                 max_accounts: int = 10000, store_path: Optional[str] = None, flush_interval: int = 30):
+        self.user_tpm = user_tpm
+        self.global_tpm = global_tpm
+        self.max_accounts = max_accounts
+        self.store_path = store_path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        now = time.monotonic()
+        self._global = TokenBucket(global_tpm, now) if global_tpm > 0 else None
+        self._accounts: "collections.OrderedDict[str, TokenBucket]" = collections.OrderedDict()
+        # (sequence number, record); the sequence tells the flusher what it has already written
+        self._records: "collections.deque[tuple]" = collections.deque(maxlen=buffer_size)
+        self._sequence = 0
+        self._flushed_sequence = 0
+        self._last_flushed_at: Optional[float] = None
+        self._counters = {"calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                          "rejected_user": 0, "rejected_global": 0, "records_flushed": 0, "records_lost": 0}
+
+        if self.store_path:
+            flusher = threading.Thread(target=self._flush_loop, name="token-ledger-flush", daemon=True)
+            flusher.start()
+
+    def reserve(self, account: Optional[str], tokens: int, source: str = "chat") -> Reservation:
+        """Take `tokens` from the account's and the global bucket, or raise QuotaExceeded"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._account_bucket(account, now) if account and self.user_tpm > 0 else None
+            if bucket is not None and bucket.refill(now) < min(tokens, bucket.capacity):
+                self._counters["rejected_user"] += 1
+                raise QuotaExceeded(f"Token quota for {account} used up", "user", bucket.wait_for(tokens))
+            if self._global is not None and self._global.refill(now) < min(tokens, self._global.capacity):
+                self._counters["rejected_global"] += 1
+                raise QuotaExceeded("Service token quota used up", "global", self._global.wait_for(tokens))
+            if bucket is not None:
+                bucket.level -= tokens
+            if self._global is not None:
+                self._global.level -= tokens
+        return Reservation(account, tokens, source, time.perf_counter())
+
+    def settle(self, reservation: Reservation, prompt_tokens: Optional[int], completion_tokens: Optional[int],
+               kind: str = "", model: str = "", estimated: bool = False, error: Optional[str] = None) -> None:
+        """Charge actual usage against the reservation and record the call.
+
+        A failed call passes no token counts and gets its reservation back.
+        """
+        latency_ms = round((time.perf_counter() - reservation.started) * 1000, 1)
+        prompt_tokens, completion_tokens = prompt_tokens or 0, completion_tokens or 0
+        adjustment = prompt_tokens + completion_tokens - reservation.tokens
+        record = {
+            "t": round(time.time(), 3),
+            "account": reservation.account,
+            "source": reservation.source,
+            "kind": kind,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency_ms": latency_ms,
+        }
+        if estimated:
+            record["estimated"] = True
+        if error:
+            record["error"] = error
+        with self._lock:
+            if reservation.account and self.user_tpm > 0:
+                bucket = self._accounts.get(reservation.account)
+                if bucket is not None:
+                    bucket.level = min(bucket.capacity, bucket.level - adjustment)
+            if self._global is not None:
+                self._global.level = min(self._global.capacity, self._global.level - adjustment)
+            self._sequence += 1
+            if len(self._records) == self._records.maxlen and self._records[0][0] > self._flushed_sequence \
+                    and self.store_path:
+                self._counters["records_lost"] += 1
+            self._records.append((self._sequence, record))
+            self._counters["calls"] += 1
+            self._counters["errors"] += 1 if error else 0
+            self._counters["prompt_tokens"] += prompt_tokens
+            self._counters["completion_tokens"] += completion_tokens
+
+    def quota(self, account: Optional[str] = None) -> Dict[str, Any]:
+        """Bucket levels (the global one, and the account's when given) and usage in the buffer"""
+        now = time.monotonic()
+        with self._lock:
+            state: Dict[str, Any] = {
+                "user_tpm": self.user_tpm,
+                "global_tpm": self.global_tpm,
+                "global_available": round(self._global.refill(now)) if self._global is not None else None,
+                "tracked_accounts": len(self._accounts),
+            }
+            if account:
+                bucket = self._accounts.get(account)
+                state["account"] = account
+                state["account_available"] = round(bucket.refill(now)) if bucket is not None else self.user_tpm
+            records = [record for _, record in self._records]
+        if account:
+            state["account_usage"] = _usage([record for record in records if record["account"] == account])
+        return state
+
+    def usage(self, top: int = 20, since_seconds: Optional[float] = None) -> Dict[str, Any]:
+        """Tokens per account, kind and source over the records still in the buffer"""
+        with self._lock:
+            records = [record for _, record in self._records]
+        if since_seconds is not None:
+            cutoff = time.time() - since_seconds
+            records = [record for record in records if record["t"] >= cutoff]
+        by_account: Dict[str, List[Dict[str, Any]]] = collections.defaultdict(list)
+        by_kind: Dict[str, List[Dict[str, Any]]] = collections.defaultdict(list)
+        for record in records:
+            by_account[record["account"] or "(none)"].append(record)
+            by_kind[f"{record['source']}/{record['kind']}"].append(record)
+        accounts = sorted(((name, _usage(rows)) for name, rows in by_account.items()),
+                          key=lambda item: -item[1]["total_tokens"])
+        return {
+            "records": len(records),
+            "since": records[0]["t"] if records else None,
+            "total": _usage(records),
+            "top_accounts": [{"account": name, **totals} for name, totals in accounts[:top]],
+            "by_kind": {name: _usage(rows) for name, rows in sorted(by_kind.items())},
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "user_tpm": self.user_tpm,
+                "global_tpm": self.global_tpm,
+                "global_available": round(self._global.refill(now)) if self._global is not None else None,
+                "tracked_accounts": len(self._accounts),
+                "buffered_records": len(self._records),
+                "persistence": bool(self.store_path),
+                "last_flushed_at": self._last_flushed_at,
+                **self._counters,
+            }
+
+    def flush(self) -> int:
+        """Append records not yet written to store_path; returns how many were written"""
+        if not self.store_path:
+            return 0
+        with self._lock:
+            pending = [(sequence, record) for sequence, record in self._records if sequence > self._flushed_sequence]
+        if not pending:
+            return 0
+        payload = "".join(json.dumps(record, separators=(",", ":")) + "\n" for _, record in pending).encode("utf-8")
+        # One append-mode write per flush, so several workers can share the file
+        fd = os.open(self.store_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, payload)
+        finally:
+            os.close(fd)
+        with self._lock:
+            self._flushed_sequence = pending[-1][0]
+            self._counters["records_flushed"] += len(pending)
+            self._last_flushed_at = time.time()
+        return len(pending)
+
+    def _account_bucket(self, account: str, now: float) -> TokenBucket:
+        # Caller must hold self._lock
+        bucket = self._accounts.get(account)
+        if bucket is None:
+            bucket = self._accounts[account] = TokenBucket(self.user_tpm, now)
+            while len(self._accounts) > self.max_accounts:
+                self._accounts.popitem(last=False)
+        else:
+            self._accounts.move_to_end(account)
+        return bucket
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error(f"❌ Token ledger flush failed: {str(e)}")
+
+
+def _usage(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    prompt_tokens = sum(record["prompt_tokens"] for record in records)
+    completion_tokens = sum(record["completion_tokens"] for record in records)
+    latencies = sorted(record["latency_ms"] for record in records)
+    return {
+        "calls": len(records),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "p95_latency_ms": latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)] if latencies else None,
+    }
+
+
+def build_token_ledger_from_env() -> TokenLedger:
+    """Token ledger configured from AI_TOKEN_* (AI_TOKEN_LEDGER_PATH enables the JSONL store)"""
+    return TokenLedger(
+        user_tpm=int(os.environ.get("AI_TOKEN_USER_TPM", "20000")),
+        global_tpm=int(os.environ.get("AI_TOKEN_GLOBAL_TPM", "200000")),
+        buffer_size=int(os.environ.get("AI_TOKEN_LEDGER_BUFFER", "10000")),
+        max_accounts=int(os.environ.get("AI_TOKEN_MAX_ACCOUNTS", "10000")),
+        store_path=os.environ.get("AI_TOKEN_LEDGER_PATH") or None,
+        flush_interval=int(os.environ.get("AI_TOKEN_LEDGER_FLUSH_INTERVAL", "30"))
+    )
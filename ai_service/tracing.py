@@ -0,0 +1,238 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# W3C trace context: version-traceid-parentid-flags
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed stage of a request"""
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "ok"
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.token: Any = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class JsonlExporter:
+    """Appends finished spans to a local JSONL file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+
+class OtlpHttpExporter:
+    """Posts spans as OTLP/HTTP JSON to a local collector (e.g. http://localhost:4318/v1/traces)"""
+
+    def __init__(self, endpoint: str, service_name: str = "lovemirror-ai-service"):
+        self.endpoint = endpoint
+        self.service_name = service_name
+
+    def export(self, spans: List[Span]) -> None:
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+            "scopeSpans": [{"scope": {"name": "lovemirror.tracing"}, "spans": [
+                {
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    "parentSpanId": span.parent_id or "",
+                    "name": span.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": [_otlp_attribute(k, v) for k, v in span.attributes.items()],
+                    "status": {"code": 2 if span.status == "error" else 1},
+                }
+                for span in spans
+            ]}],
+        }]}
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST")
+        urllib.request.urlopen(request, timeout=5).close()
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Tracer:
+    """Creates spans and exports sampled ones from a background thread"""
+
+    def __init__(self, max_queue: int = 2048, batch_size: int = 64):
+        self.exporter: Any = None
+        self.sample_rate = 0.0
+        self.trust_upstream_sampling = False
+        self.batch_size = batch_size
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._counters = {"sampled_spans": 0, "exported": 0, "dropped": 0, "export_errors": 0}
+
+    def configure(self, exporter: Any, sample_rate: float, trust_upstream_sampling: bool = False) -> None:
+        """Start exporting; until called, spans are timed but never exported.
+
+        With trust_upstream_sampling, a caller's traceparent marked sampled forces
+        the request to be sampled; otherwise callers only choose the trace id.
+        """
+        started = self.exporter is not None
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.trust_upstream_sampling = trust_upstream_sampling
+        if exporter is not None and not started:
+            threading.Thread(target=self._export_loop, name="trace-export", daemon=True).start()
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def begin_trace(self, name: str, traceparent: Optional[str] = None, **attributes: Any) -> Span:
+        """Open the root span of an incoming request, continuing the caller's trace if it sent one.
+
+        The span becomes current until end() is called with it.
+        """
+        match = _TRACEPARENT_RE.match((traceparent or "").strip().lower())
+        if match:
+            trace_id, parent_id, flags = match.groups()
+            # Any client can send flags 01; honouring it would let callers force export of their requests
+            upstream_sampled = self.trust_upstream_sampling and bool(int(flags, 16) & 1)
+            sampled = upstream_sampled or random.random() < self.sample_rate
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            sampled = random.random() < self.sample_rate
+        return self._begin(Span(name, trace_id, parent_id, sampled and self.enabled, attributes))
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """Child span of the current span; never exported outside a sampled trace"""
+        parent = _current_span.get()
+        if parent is None:
+            span = Span(name, "0" * 32, None, False, attributes)
+        else:
+            span = Span(name, parent.trace_id, parent.span_id, parent.sampled, attributes)
+        self._begin(span)
+        try:
+            yield span
+        except Exception as e:
+            span.status = "error"
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            self.end(span)
+
+    def end(self, span: Span) -> None:
+        """Close a span, restore its parent as current and queue it for export"""
+        span.end_ns = time.time_ns()
+        _current_span.reset(span.token)
+        if span.sampled:
+            self._counters["sampled_spans"] += 1
+            try:
+                self._queue.put_nowait(span)
+            except queue.Full:
+                self._counters["dropped"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "trust_upstream_sampling": self.trust_upstream_sampling,
+            "queue_size": self._queue.qsize(),
+            **self._counters,
+        }
+
+    def _begin(self, span: Span) -> Span:
+        span.token = _current_span.set(span)
+        return span
+
+    def _export_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.exporter.export(batch)
+                self._counters["exported"] += len(batch)
+            except Exception as e:
+                self._counters["export_errors"] += 1
+                logger.warning(f"⚠️ Trace export failed: {str(e)}")
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def configure_tracing() -> Tracer:
+    """Configure the shared tracer from AI_TRACE_EXPORT ("jsonl:<path>" or "otlp:<url>"),
+    AI_TRACE_SAMPLE_RATE and AI_TRACE_TRUST_UPSTREAM_SAMPLING"""
+    target = os.environ.get("AI_TRACE_EXPORT", "")
+    sample_rate = float(os.environ.get("AI_TRACE_SAMPLE_RATE", "0.1"))
+    trust_upstream = os.environ.get("AI_TRACE_TRUST_UPSTREAM_SAMPLING", "false").lower() == "true"
+    kind, _, location = target.partition(":")
+    if kind == "jsonl" and location:
+        exporter = JsonlExporter(location)
+    elif kind == "otlp" and location:
+        exporter = OtlpHttpExporter(location)
+    else:
+        exporter = None
+    if exporter is not None:
+        tracer.configure(exporter, sample_rate, trust_upstream)
+        logger.info(f"✅ Tracing enabled ({kind}), sample rate {sample_rate}")
+    return tracer
+
+
+# Shared tracer so any layer (router, retrieval) can open child spans
+tracer = Tracer()
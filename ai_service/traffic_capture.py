@@ -0,0 +1,212 @@
+"""
+Opt-in capture of anonymized request shapes, for replaying production traffic
+against a test instance (see replay.py).
+
+Each record describes one request by its sizes, timings and outcome: message
+and history lengths, score categories, status, latency, token counts and a
+keyed hash of the message text. Message text, names, profiles, score values
+and ids are never written. Records go to gzip-compressed JSONL files, rotated
+by size and age, with the oldest files deleted past a limit.
+"""
+
+import glob
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from score_analytics import assessment_type
+
+logger = logging.getLogger("traffic_capture")
+
+# Assessment types written as-is; anything else a client declares is recorded as "other"
+KNOWN_ASSESSMENT_TYPES = {"high-value-man", "wife-material", "bridal-price", "unknown"}
+
+FILE_PATTERN = "capture-*.jsonl.gz"
+
+
+class TrafficCapture:
+    """Writes request shapes to rotating gzip JSONL files from a background thread.
+
+    record() only enqueues, so a request never waits on disk; when the queue
+    is full the record is dropped and counted. Text is hashed with HMAC-SHA256
+    under `salt`, so repeats of a question can be told apart without storing
+    it. Without a salt a random one is used, and hashes do not match across
+    restarts.
+    """
+
+    def __init__(self, directory: str, salt: Optional[str] = None, sample_rate: float = 1.0,
+                 max_file_bytes: int = 64 * 1024 * 1024, max_file_seconds: int = 3600, max_files: int = 48,
+                 queue_size: int = 10000):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_file_bytes = max_file_bytes
+        self.max_file_seconds = max_file_seconds
+        self.max_files = max_files
+        self._salt = (salt or os.urandom(16).hex()).encode("utf-8")
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_path: Optional[str] = None
+        self._file_bytes = 0
+        self._file_opened_at = 0.0
+        self._counters = {"recorded": 0, "dropped": 0, "written": 0, "files_rotated": 0, "files_deleted": 0,
+                          "write_errors": 0}
+
+        os.makedirs(self.directory, exist_ok=True)
+        writer = threading.Thread(target=self._write_loop, name="traffic-capture", daemon=True)
+        writer.start()
+
+    def sampled(self) -> bool:
+        """Whether to capture the current request"""
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def text_hash(self, text: str) -> str:
+        return hmac.new(self._salt, text.encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+
+    def describe_chat(self, user_input: str, user_context: Dict[str, Any], chat_history: List[Dict[str, Any]],
+                      conversation_id: Optional[str], known_categories: Iterable[str]) -> Dict[str, Any]:
+        """The anonymized shape of a chat request; chat_history is the history the reply is generated from"""
+        scores = user_context.get("assessment_scores") or {}
+        kind = assessment_type(user_context)
+        return {
+            "input_chars": len(user_input),
+            "input_hash": self.text_hash(user_input),
+            "history_messages": len(chat_history),
+            "history_chars": sum(len(str(message.get("content", ""))) for message in chat_history),
+            "conversation": self.text_hash(conversation_id) if conversation_id else None,
+            "score_categories": len(scores),
+            # Category names from the book's own taxonomy; anything else a client sends is only counted
+            "categories": sorted(category for category in scores if category in known_categories),
+            "assessment_type": kind if kind in KNOWN_ASSESSMENT_TYPES else "other",
+            "has_delusional_score": user_context.get("delusional_score") is not None,
+        }
+
+    def record(self, shape: Dict[str, Any]) -> None:
+        """Queue one request's record for writing; never blocks"""
+        try:
+            self._queue.put_nowait(shape)
+        except queue.Full:
+            with self._lock:
+                self._counters["dropped"] += 1
+            return
+        with self._lock:
+            self._counters["recorded"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": True,
+                "directory": self.directory,
+                "sample_rate": self.sample_rate,
+                "current_file": self._file_path and os.path.basename(self._file_path),
+                "queued": self._queue.qsize(),
+                **self._counters,
+            }
+
+    def _write_loop(self) -> None:
+        while True:
+            record = self._queue.get()
+            try:
+                self._write(record)
+                # Drain whatever else is waiting, then make it readable by flushing once
+                while True:
+                    try:
+                        self._write(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                self._file.flush()
+            except (OSError, ValueError) as e:
+                with self._lock:
+                    self._counters["write_errors"] += 1
+                logger.error(f"❌ Traffic capture write failed: {str(e)}")
+                self._close_file()
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        now = time.time()
+        if self._file is None or self._file_bytes >= self.max_file_bytes or \
+                now - self._file_opened_at >= self.max_file_seconds:
+            self._rotate(now)
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        self._file.write(line)
+        self._file_bytes += len(line)
+        with self._lock:
+            self._counters["written"] += 1
+
+    def _rotate(self, now: float) -> None:
+        if self._file is not None:
+            self._close_file()
+            with self._lock:
+                self._counters["files_rotated"] += 1
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(now))
+        path = os.path.join(self.directory, f"capture-{stamp}-{os.getpid()}.jsonl.gz")
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        with self._lock:
+            self._file_path = path
+        self._file_bytes = 0
+        self._file_opened_at = now
+        self._prune()
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError as e:
+                logger.warning(f"⚠️ Could not close capture file: {str(e)}")
+            self._file = None
+
+    def _prune(self) -> None:
+        # Oldest first across every worker's files in the directory
+        paths = sorted(glob.glob(os.path.join(self.directory, FILE_PATTERN)), key=os.path.getmtime)
+        for path in paths[:max(len(paths) - self.max_files, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            with self._lock:
+                self._counters["files_deleted"] += 1
+
+
+def read_captures(paths: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Records from capture files or directories of them, file by file.
+
+    A file still being written (or cut off by a crash) is read up to its last
+    complete record.
+    """
+    files: List[str] = []
+    for path in paths:
+        files.extend(sorted(glob.glob(os.path.join(path, FILE_PATTERN))) if os.path.isdir(path) else [path])
+    for path in files:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        break
+        except (EOFError, OSError, zlib.error) as e:
+            logger.warning(f"⚠️ Capture file {path} ends early: {str(e)}")
+
+
+def build_traffic_capture_from_env() -> Optional[TrafficCapture]:
+    """Traffic capture configured from AI_CAPTURE_*; None (off) unless AI_CAPTURE_DIR is set"""
+    directory = os.environ.get("AI_CAPTURE_DIR")
+    if not directory:
+        return None
+    return TrafficCapture(
+        directory,
+        salt=os.environ.get("AI_CAPTURE_SALT") or None,
+        sample_rate=float(os.environ.get("AI_CAPTURE_SAMPLE_RATE", "1")),
+        max_file_bytes=int(os.environ.get("AI_CAPTURE_MAX_FILE_BYTES", str(64 * 1024 * 1024))),
+        max_file_seconds=int(os.environ.get("AI_CAPTURE_MAX_FILE_SECONDS", "3600")),
+        max_files=int(os.environ.get("AI_CAPTURE_MAX_FILES", "48")),
+        queue_size=int(os.environ.get("AI_CAPTURE_QUEUE_SIZE", "10000"))
+    )
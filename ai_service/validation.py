@@ -0,0 +1,204 @@
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+# ─── PAYLOAD LIMITS ──────────────────────────────────────────────────────────
+MAX_BODY_BYTES = int(os.environ.get("AI_MAX_BODY_BYTES", "65536"))
+MAX_HISTORY_TURNS = int(os.environ.get("AI_MAX_HISTORY_TURNS", "100"))
+MAX_USER_INPUT_CHARS = int(os.environ.get("AI_MAX_USER_INPUT_CHARS", "4000"))
+MAX_MESSAGE_CHARS = int(os.environ.get("AI_MAX_MESSAGE_CHARS", "8000"))
+MAX_FIELD_CHARS = int(os.environ.get("AI_MAX_FIELD_CHARS", "200"))
+MAX_SCORE_CATEGORIES = 20
+
+PROFILE_FIELDS = ("name", "gender", "region", "cultural_context")
+CHAT_ROLES = ("user", "assistant")
+
+# The web client has sent both spellings of these keys
+USER_CONTEXT_ALIASES = {
+    "assessmentScores": "assessment_scores",
+    "delusionalScore": "delusional_score",
+    "compatibilityScore": "compatibility_score",
+    "assessmentType": "assessment_type",
+}
+
+
+class ValidationError(Exception):
+    """A request that failed schema or size checks"""
+
+    def __init__(self, message: str, status: int = 422, field_name: Optional[str] = None):
+        super().__init__(message)
+        self.status = status
+        self.field_name = field_name
+
+    def to_dict(self) -> Dict[str, Any]:
+        error = {"success": False, "error": str(self)}
+        if self.field_name:
+            error["field"] = self.field_name
+        return error
+
+
+@dataclass
+class ChatRequest:
+    """Validated body of /api/chat and /api/chat/jobs"""
+    user_input: str
+    user_context: Dict[str, Any] = field(default_factory=dict)
+    chat_history: List[Dict[str, str]] = field(default_factory=list)
+    conversation_id: Optional[str] = None
+    history_turns: int = 0
+
+
+@dataclass
+class ChannelOpen:
+    """Validated opening frame of the /ws/chat channel"""
+    access_token: str = ""
+    user_context: Dict[str, Any] = field(default_factory=dict)
+    chat_history: List[Dict[str, str]] = field(default_factory=list)
+    conversation_id: Optional[str] = None
+    history_turns: int = 0
+    subscription_tier: Optional[str] = None
+
+
+def check_content_length(content_length: Optional[int]) -> None:
+    """Reject oversized bodies from the Content-Length header, before reading them"""
+    if content_length is not None and content_length > MAX_BODY_BYTES:
+        raise ValidationError(f"Request body too large ({content_length} bytes, max {MAX_BODY_BYTES})", status=413)
+
+
+def decode_chat_request(raw: bytes) -> ChatRequest:
+    """Parse and validate a chat request body in a single pass"""
+    if len(raw) > MAX_BODY_BYTES:
+        raise ValidationError(f"Request body too large ({len(raw)} bytes, max {MAX_BODY_BYTES})", status=413)
+    if not raw:
+        raise ValidationError("No data provided", status=400)
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        raise ValidationError("Request body is not valid JSON", status=400)
+    if not isinstance(data, dict) or not data:
+        raise ValidationError("No data provided", status=400)
+
+    return ChatRequest(
+        user_input=decode_user_input(data.get('user_input', '')),
+        user_context=_user_context(data.get('user_context', {})),
+        chat_history=_chat_history(data.get('chat_history', [])),
+        conversation_id=_conversation_id(data.get('conversation_id')),
+        history_turns=_history_turns(data.get('history_turns', 0))
+    )
+
+
+def decode_channel_open(data: Any) -> ChannelOpen:
+    """Validate the first frame of a WebSocket chat channel (already parsed from JSON)"""
+    if not isinstance(data, dict):
+        raise ValidationError("Frame must be a JSON object", status=400)
+    return ChannelOpen(
+        access_token=_string(data.get('access_token') or '', 'access_token', MAX_BODY_BYTES),
+        user_context=_user_context(data.get('user_context', {})),
+        chat_history=_chat_history(data.get('chat_history', [])),
+        conversation_id=_conversation_id(data.get('conversation_id')),
+        history_turns=_history_turns(data.get('history_turns', 0)),
+        subscription_tier=_string(data['subscription_tier'], 'subscription_tier', MAX_FIELD_CHARS)
+        if data.get('subscription_tier') is not None else None
+    )
+
+
+def decode_user_input(value: Any) -> str:
+    """Validate one user message"""
+    user_input = _string(value, 'user_input', MAX_USER_INPUT_CHARS)
+    if not user_input:
+        raise ValidationError("No user input provided", status=400, field_name='user_input')
+    return user_input
+
+
+def decode_user_context(value: Any) -> Dict[str, Any]:
+    """Validate a user_context on its own, for inputs that are not chat requests (e.g. batch files)"""
+    return _user_context(value)
+
+
+def _conversation_id(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    return _string(value, 'conversation_id', 64) or None
+
+
+def _history_turns(value: Any) -> int:
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise ValidationError("history_turns must be a non-negative integer", field_name='history_turns')
+    return value
+
+
+def _string(value: Any, name: str, max_chars: int) -> str:
+    if not isinstance(value, str):
+        raise ValidationError(f"{name} must be a string", field_name=name)
+    if len(value) > max_chars:
+        raise ValidationError(f"{name} exceeds {max_chars} characters", field_name=name)
+    return value
+
+
+def _number(value: Any, name: str, nullable: bool = False) -> Optional[float]:
+    if value is None and nullable:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValidationError(f"{name} must be a number", field_name=name)
+    return value
+
+
+def _user_context(value: Any) -> Dict[str, Any]:
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ValidationError("user_context must be an object", field_name='user_context')
+    value = {USER_CONTEXT_ALIASES.get(key, key): item for key, item in value.items()}
+
+    user_context: Dict[str, Any] = {}
+
+    profile = value.get('profile') or {}
+    if not isinstance(profile, dict):
+        raise ValidationError("user_context.profile must be an object", field_name='user_context.profile')
+    user_context['profile'] = {
+        key: _string(profile[key], f"user_context.profile.{key}", MAX_FIELD_CHARS)
+        for key in PROFILE_FIELDS if profile.get(key) is not None
+    }
+
+    scores = value.get('assessment_scores') or {}
+    if not isinstance(scores, dict) or len(scores) > MAX_SCORE_CATEGORIES:
+        raise ValidationError(
+            f"user_context.assessment_scores must be an object with at most {MAX_SCORE_CATEGORIES} categories",
+            field_name='user_context.assessment_scores'
+        )
+    user_context['assessment_scores'] = {
+        _string(category, 'user_context.assessment_scores', MAX_FIELD_CHARS):
+            _number(score, f"user_context.assessment_scores.{category}")
+        for category, score in scores.items()
+    }
+
+    for key in ('delusional_score', 'compatibility_score'):
+        if key in value:
+            # The web client sends null when the user has no such score yet
+            user_context[key] = _number(value[key], f"user_context.{key}", nullable=True)
+
+    if value.get('assessment_type') is not None:
+        user_context['assessment_type'] = _string(value['assessment_type'], 'user_context.assessment_type',
+                                                  MAX_FIELD_CHARS)
+
+    return user_context
+
+
+def _chat_history(value: Any) -> List[Dict[str, str]]:
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise ValidationError("chat_history must be an array", field_name='chat_history')
+    if len(value) > MAX_HISTORY_TURNS:
+        raise ValidationError(f"chat_history exceeds {MAX_HISTORY_TURNS} messages", field_name='chat_history')
+
+    history = []
+    for index, turn in enumerate(value):
+        name = f"chat_history[{index}]"
+        if not isinstance(turn, dict):
+            raise ValidationError(f"{name} must be an object", field_name=name)
+        role = turn.get('role')
+        if role not in CHAT_ROLES:
+            raise ValidationError(f"{name}.role must be one of {', '.join(CHAT_ROLES)}", field_name=f"{name}.role")
+        history.append({"role": role, "content": _string(turn.get('content', ''), f"{name}.content", MAX_MESSAGE_CHARS)})
+    return history
@@ -0,0 +1,74 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class WarmupStep:
+    def __init__(self, name: str, func: Callable[[], Any], required: bool):
+        self.name = name
+        self.func = func
+        self.required = required
+        self.status = "pending"
+        self.duration_ms = None
+        self.error = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        step = {"name": self.name, "status": self.status, "required": self.required,
+                "duration_ms": self.duration_ms}
+        if self.error:
+            step["error"] = self.error
+        return step
+
+
+class Warmup:
+    """Runs startup steps in the background and tracks readiness.
+
+    The service is ready once every required step has succeeded; optional
+    steps (such as pre-opening model connections) may fail without blocking it.
+    """
+
+    def __init__(self):
+        self.steps: List[WarmupStep] = []
+        self.ready = threading.Event()
+        self.started_at = None
+        self.finished_at = None
+
+    def step(self, name: str, func: Callable[[], Any], required: bool = True) -> None:
+        self.steps.append(WarmupStep(name, func, required))
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def run(self) -> bool:
+        self.started_at = time.time()
+        for step in self.steps:
+            step.status = "running"
+            start = time.perf_counter()
+            try:
+                step.func()
+                step.status = "done"
+            except Exception as e:
+                step.status = "failed"
+                step.error = str(e)
+                log = logger.error if step.required else logger.warning
+                log(f"{'❌' if step.required else '⚠️'} Warm-up step {step.name} failed: {str(e)}")
+            step.duration_ms = round((time.perf_counter() - start) * 1000, 1)
+        self.finished_at = time.time()
+
+        if all(step.status == "done" for step in self.steps if step.required):
+            self.ready.set()
+            logger.info(f"✅ Warm-up finished in {(self.finished_at - self.started_at) * 1000:.0f}ms, service ready")
+        return self.ready.is_set()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready.is_set(),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "steps": [step.to_dict() for step in self.steps],
+        }
@@ -6,6 +6,7 @@ export const AI_CONFIG = {
   // API endpoints
   ENDPOINTS: {
     CHAT: '/api/chat',
+    CHAT_SOCKET: '/ws/chat',
     HEALTH: '/health',
   },
   
@@ -38,9 +39,16 @@ export const buildAPIUrl = (endpoint: string): string => {
   return `${config.BASE_URL}${endpoint}`;
 };
 
+// W3C trace context for one request, so the AI service's spans join the client's trace
+const randomHex = (bytes: number): string =>
+  Array.from(crypto.getRandomValues(new Uint8Array(bytes)), (b) => b.toString(16).padStart(2, '0')).join('');
+
+export const buildTraceparent = (): string => `00-${randomHex(16)}-${randomHex(8)}-00`;
+
 // Default headers for AI service requests
 export const getDefaultHeaders = () => ({
   'Content-Type': 'application/json',
   'Accept': 'application/json',
   'User-Agent': 'LoveMirror-AI-Client/1.0',
+  'traceparent': buildTraceparent(),
 }); 
\ No newline at end of file
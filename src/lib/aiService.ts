@@ -1,4 +1,5 @@
 import { getAIConfig, buildAPIUrl, getDefaultHeaders } from './aiConfig';
+import { supabase } from '@/lib/supabase';
 
 interface BookRecommendationPayload {
   assessmentScores: Record<string, number>;
@@ -37,6 +38,10 @@ interface AIRequestPayload {
     role: 'user' | 'assistant';
     content: string;
   }>;
+  // When set, the service keeps the history server-side and only the new turn is sent
+  conversationId?: string;
+  // Subscribers are scheduled ahead of free users when model capacity is short
+  subscriptionTier?: 'premium' | 'free';
 }
 
 interface AIResponse {
@@ -49,29 +54,59 @@ interface AIResponse {
  * Get hybrid AI response (AI first, fallback to book chapters)
  */
 export async function getHybridAIResponse(payload: AIRequestPayload): Promise<AIResponse> {
-  const { userInput, userContext, chatHistory } = payload;
+  const { userInput, userContext, chatHistory, conversationId, subscriptionTier } = payload;
   const config = getAIConfig();
   const url = buildAPIUrl('/api/chat');
 
-  try {
+  // The signed-in user's access token lets the service verify their tier and fill in their delusional score
+  const { data: { session } } = await supabase.auth.getSession();
+  const headers: Record<string, string> = { ...getDefaultHeaders() };
+  if (session?.access_token) {
+    headers['Authorization'] = `Bearer ${session.access_token}`;
+  }
+  if (subscriptionTier) {
+    headers['X-Subscription-Tier'] = subscriptionTier;
+  }
+
+  const sendRequest = (includeHistory: boolean) => {
     // Format the request for the hybrid AI service
-    const requestBody = {
-      user_input: userInput,
-      user_context: userContext,
-      chat_history: chatHistory,
-    };
+    const requestBody = conversationId
+      ? {
+          user_input: userInput,
+          user_context: userContext,
+          conversation_id: conversationId,
+          history_turns: chatHistory.length,
+          chat_history: includeHistory ? chatHistory : [],
+        }
+      : {
+          user_input: userInput,
+          user_context: userContext,
+          chat_history: chatHistory,
+        };
 
     if (config.ENABLE_LOGGING) {
       console.log('[Hybrid AI] Sending request:', { url, requestBody });
     }
 
     // Make the API call to the hybrid AI service
-    const response = await fetch(url, {
+    return fetch(url, {
       method: 'POST',
-      headers: getDefaultHeaders(),
+      headers,
       body: JSON.stringify(requestBody),
       signal: AbortSignal.timeout(config.TIMEOUT),
     });
+  };
+
+  try {
+    let response = await sendRequest(false);
+
+    // The service lost this conversation (restart or eviction) - resend the full history once
+    if (response.status === 409 && conversationId) {
+      if (config.ENABLE_LOGGING) {
+        console.log('[Hybrid AI] Conversation expired on server, resending history');
+      }
+      response = await sendRequest(true);
+    }
 
     if (!response.ok) {
       const errorText = await response.text();
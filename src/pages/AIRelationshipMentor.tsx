@@ -36,6 +36,8 @@ export default function AIRelationshipMentor() {
   const [loading, setLoading] = useState(true);
   const [aiServiceStatus, setAiServiceStatus] = useState<{ isAvailable: boolean; message: string } | null>(null);
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  // Lets the AI service keep this conversation's history server-side
+  const conversationIdRef = useRef<string>(crypto.randomUUID());
 
   // Load user data and check AI service status on component mount
   useEffect(() => {
@@ -205,6 +207,8 @@ export default function AIRelationshipMentor() {
           compatibilityScore: context?.compatibilityScore || null,
         },
         chatHistory,
+        conversationId: conversationIdRef.current,
+        subscriptionTier: isSubscribed ? 'premium' : 'free',
       });
 
       if (result.success && result.response) {